@@ -0,0 +1,336 @@
+# ai_gateway.py
+"""
+بوابة موحّدة لكل طلبات OpenAI في البوت.
+
+- عميل OpenAI واحد فوق httpx.Client بمجموعة اتصالات (pool) مع keep-alive.
+- مهلة (timeout) لكل نوع عملية بدل الانتظار بلا حد.
+- إعادة المحاولة عند 429 / 5xx / انقطاع الاتصال مع تأخير عشوائي (full jitter).
+- حد أقصى للطلبات المتزامنة لكل موديل (semaphore).
+- قاطع دائرة (circuit breaker) لكل موديل: بعد أخطاء متتالية نفشل فوراً لفترة قصيرة
+  بدل تكديس طلبات تنتظر خدمة متعطلة.
+
+كل الإعدادات من متغيرات البيئة (AI_*).
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+import httpx
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    OpenAI,
+    RateLimitError,
+)
+
+from metrics import (
+    AI_FIRST_TOKEN,
+    observe_ai_call,
+    record_ai_usage,
+    record_image_cost,
+    register_collector,
+)
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+
+AI_MAX_CONNECTIONS = int(os.environ.get("AI_MAX_CONNECTIONS", "32"))
+AI_MAX_KEEPALIVE = int(os.environ.get("AI_MAX_KEEPALIVE", "16"))
+AI_CONNECT_TIMEOUT = float(os.environ.get("AI_CONNECT_TIMEOUT", "5"))
+
+AI_MAX_RETRIES = int(os.environ.get("AI_MAX_RETRIES", "3"))
+AI_RETRY_BASE = float(os.environ.get("AI_RETRY_BASE", "0.5"))
+AI_RETRY_CAP = float(os.environ.get("AI_RETRY_CAP", "8"))
+
+# عدد الطلبات المتزامنة لكل موديل، ومدة الانتظار القصوى للحصول على مكان
+AI_MODEL_CONCURRENCY = int(os.environ.get("AI_MODEL_CONCURRENCY", "8"))
+AI_QUEUE_TIMEOUT = float(os.environ.get("AI_QUEUE_TIMEOUT", "60"))
+# استثناءات لموديلات معينة: "gpt-image-1=2,gpt-4.1-mini=12"
+AI_MODEL_LIMITS = {
+    name.strip(): int(limit)
+    for name, _, limit in (
+        item.partition("=") for item in os.environ.get("AI_MODEL_LIMITS", "").split(",")
+    )
+    if name.strip() and limit.strip()
+}
+
+AI_BREAKER_FAILURES = int(os.environ.get("AI_BREAKER_FAILURES", "5"))
+AI_BREAKER_COOLDOWN = float(os.environ.get("AI_BREAKER_COOLDOWN", "30"))
+
+# مهلة القراءة لكل نوع عملية (ثوانٍ)
+OPERATION_TIMEOUTS = {
+    "story": 120.0,
+    "story_review": 90.0,
+    "article_review": 90.0,
+    "video_prompt": 45.0,
+    "image_prompt": 45.0,
+    "image": 180.0,
+}
+DEFAULT_OPERATION_TIMEOUT = 60.0
+
+
+class AIGatewayError(Exception):
+    """خطأ من البوابة نفسها (وليس من OpenAI)."""
+
+
+class AIUnavailable(AIGatewayError):
+    """الخدمة غير مفعّلة أو القاطع مفتوح بعد أخطاء متتالية."""
+
+
+class AIBusy(AIGatewayError):
+    """لم نحصل على مكان ضمن حد الطلبات المتزامنة للموديل خلال AI_QUEUE_TIMEOUT."""
+
+
+class CircuitBreaker:
+    """closed → open بعد N أخطاء متتالية → half-open (طلب تجريبي واحد) بعد فترة التهدئة."""
+
+    def __init__(self, name: str, failures: int, cooldown: float):
+        self.name = name
+        self.max_failures = failures
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._failures >= self.max_failures
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._failures < self.max_failures:
+                return
+            if time.monotonic() - self._opened_at < self.cooldown or self._trial_running:
+                raise AIUnavailable(f"circuit open for {self.name}")
+            # half-open: نسمح بطلب تجريبي واحد
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._failures >= self.max_failures:
+                logger.info("AI circuit for %s closed", self.name)
+            self._failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_running = False
+            if self._failures >= self.max_failures:
+                if self._failures == self.max_failures:
+                    logger.warning("AI circuit for %s opened", self.name)
+                self._opened_at = time.monotonic()
+
+
+_http_client = httpx.Client(
+    limits=httpx.Limits(
+        max_connections=AI_MAX_CONNECTIONS,
+        max_keepalive_connections=AI_MAX_KEEPALIVE,
+    ),
+    timeout=httpx.Timeout(DEFAULT_OPERATION_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+)
+
+# إعادة المحاولة تتم هنا فقط، لذلك نلغي إعادة المحاولة الداخلية في مكتبة openai
+_client = (
+    OpenAI(api_key=OPENAI_API_KEY, http_client=_http_client, max_retries=0)
+    if OPENAI_API_KEY
+    else None
+)
+
+_models_lock = threading.Lock()
+_semaphores = {}
+_breakers = {}
+
+
+def ai_enabled() -> bool:
+    return _client is not None
+
+
+def _model_guards(model: str):
+    with _models_lock:
+        if model not in _semaphores:
+            _semaphores[model] = threading.BoundedSemaphore(
+                AI_MODEL_LIMITS.get(model, AI_MODEL_CONCURRENCY)
+            )
+            _breakers[model] = CircuitBreaker(model, AI_BREAKER_FAILURES, AI_BREAKER_COOLDOWN)
+        return _semaphores[model], _breakers[model]
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(exc, APIStatusError) and exc.status_code >= 500
+
+
+def _retry_delay(exc: Exception, attempt: int) -> float:
+    # نحترم Retry-After إن أرسله الخادم، وإلا full jitter
+    response = getattr(exc, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+        if retry_after:
+            try:
+                return min(float(retry_after), AI_RETRY_CAP)
+            except ValueError:
+                pass
+    return random.uniform(0, min(AI_RETRY_CAP, AI_RETRY_BASE * (2 ** attempt)))
+
+
+def _timeout_for(operation: str) -> httpx.Timeout:
+    read = OPERATION_TIMEOUTS.get(operation, DEFAULT_OPERATION_TIMEOUT)
+    return httpx.Timeout(read, connect=AI_CONNECT_TIMEOUT)
+
+
+def _call(operation: str, model: str, func, kwargs: dict, hold_slot: bool = False):
+    """
+    ينفّذ func(**kwargs) مع الحد والقاطع وإعادة المحاولة.
+    hold_slot=True يرجع (النتيجة, دالة لإرجاع المكان) للـ streaming بدل إرجاع المكان فوراً.
+    """
+    if _client is None:
+        raise AIUnavailable("OPENAI_API_KEY is not set")
+
+    semaphore, breaker = _model_guards(model)
+
+    if not semaphore.acquire(timeout=AI_QUEUE_TIMEOUT):
+        raise AIBusy(f"{model} concurrency limit reached")
+
+    try:
+        breaker.before_call()
+    except AIUnavailable:
+        semaphore.release()
+        raise
+
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            semaphore.release()
+
+    try:
+        attempt = 0
+        while True:
+            try:
+                result = func(timeout=_timeout_for(operation), **kwargs)
+                break
+            except Exception as e:
+                if not _is_retryable(e):
+                    # الخادم ردّ (مثلاً 400): الخدمة تعمل والخطأ في الطلب نفسه
+                    breaker.record_success()
+                    raise
+                breaker.record_failure()
+                if attempt >= AI_MAX_RETRIES or breaker.is_open:
+                    raise
+                delay = _retry_delay(e, attempt)
+                attempt += 1
+                logger.warning(
+                    "AI %s (%s) failed: %s, retry %d in %.1fs",
+                    operation, model, e, attempt, delay,
+                )
+                time.sleep(delay)
+    except Exception:
+        release()
+        raise
+
+    if hold_slot:
+        return result, release
+
+    breaker.record_success()
+    release()
+    return result
+
+
+def chat(operation: str, messages: list, model: str, **kwargs):
+    """chat.completions.create عبر البوابة؛ operation يحدد المهلة (انظر OPERATION_TIMEOUTS)."""
+    with observe_ai_call(operation, model):
+        completion = _call(
+            operation,
+            model,
+            _client.chat.completions.create if _client else None,
+            dict(model=model, messages=messages, **kwargs),
+        )
+    record_ai_usage(operation, model, getattr(completion, "usage", None))
+    return completion
+
+
+def chat_stream(operation: str, messages: list, model: str, **kwargs):
+    """
+    مثل chat لكن بـ stream=True ويرجع قطع النص (delta) أولاً بأول.
+    مكان الموديل يبقى محجوزاً حتى ينتهي الـ stream أو يُغلق.
+    """
+    started = time.perf_counter()
+    with observe_ai_call(operation, model):
+        stream, release = _call(
+            operation,
+            model,
+            _client.chat.completions.create if _client else None,
+            dict(
+                model=model,
+                messages=messages,
+                stream=True,
+                # آخر chunk يحمل usage فنحسب الـ tokens للـ stream أيضاً
+                extra_body={"stream_options": {"include_usage": True}},
+                **kwargs,
+            ),
+            hold_slot=True,
+        )
+        _, breaker = _model_guards(model)
+        first_token = True
+        try:
+            for chunk in stream:
+                usage = getattr(chunk, "usage", None)
+                if usage is not None:
+                    record_ai_usage(operation, model, usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if first_token:
+                        first_token = False
+                        AI_FIRST_TOKEN.observe(operation, model, value=time.perf_counter() - started)
+                    yield delta
+        except Exception as e:
+            if _is_retryable(e):
+                breaker.record_failure()
+            raise
+        else:
+            breaker.record_success()
+        finally:
+            release()
+
+
+def generate_image(operation: str, model: str, **kwargs):
+    """images.generate عبر البوابة."""
+    with observe_ai_call(operation, model):
+        result = _call(
+            operation,
+            model,
+            _client.images.generate if _client else None,
+            dict(model=model, **kwargs),
+        )
+    usage = getattr(result, "usage", None)
+    if usage is not None:
+        record_ai_usage(operation, model, usage)
+    else:
+        record_image_cost(operation, model, images=kwargs.get("n", 1))
+    return result
+
+
+def _circuit_metrics() -> list:
+    with _models_lock:
+        breakers = dict(_breakers)
+    return [(
+        "ai_circuit_open",
+        "gauge",
+        "1 while the AI circuit breaker for a model is open",
+        {f'{{model="{model}"}}': 1 if b.is_open else 0 for model, b in breakers.items()},
+    )]
+
+
+register_collector(_circuit_metrics)
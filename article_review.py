@@ -0,0 +1,132 @@
+# article_review.py
+"""
+مراجعة المقالات الطويلة على أجزاء (map-reduce).
+
+بدل قص النص عند 15000 حرف نقسّمه على حدود الصفحات والفقرات،
+ونراجع الأجزاء بالتوازي (بحد أقصى ARTICLE_REVIEW_CONCURRENCY طلب في نفس الوقت)،
+ثم ندمج النتائج: المقال مقبول فقط إذا قُبلت كل أجزائه.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# صفحات النص المستخرج من PDF مفصولة بهذا الحرف
+PAGE_SEPARATOR = "\f"
+
+ARTICLE_CHUNK_CHARS = int(os.environ.get("ARTICLE_CHUNK_CHARS", "12000"))
+ARTICLE_REVIEW_CONCURRENCY = int(os.environ.get("ARTICLE_REVIEW_CONCURRENCY", "4"))
+ARTICLE_MAX_CHUNKS = int(os.environ.get("ARTICLE_MAX_CHUNKS", "12"))
+
+_review_pool = ThreadPoolExecutor(
+    max_workers=ARTICLE_REVIEW_CONCURRENCY,
+    thread_name_prefix="article-review",
+)
+
+
+class ArticleTooLong(ValueError):
+    """المقال يحتاج أجزاء أكثر من ARTICLE_MAX_CHUNKS."""
+
+
+def _split_block(block: str, max_chars: int) -> list:
+    """تقسيم نص أطول من max_chars على الفقرات، ثم الأسطر، ثم المسافات."""
+    if len(block) <= max_chars:
+        return [block]
+
+    for sep in ("\n\n", "\n", " "):
+        parts = block.split(sep)
+        if len(parts) > 1:
+            pieces, current = [], ""
+            for part in parts:
+                candidate = f"{current}{sep}{part}" if current else part
+                if len(candidate) <= max_chars:
+                    current = candidate
+                    continue
+                if current:
+                    pieces.append(current)
+                current = part
+            if current:
+                pieces.append(current)
+            # أي قطعة بقيت أطول من الحد تُقسَّم بالفاصل التالي
+            return [p for piece in pieces for p in _split_block(piece, max_chars)]
+
+    return [block[i:i + max_chars] for i in range(0, len(block), max_chars)]
+
+
+def split_review_chunks(text: str, max_chars: int = ARTICLE_CHUNK_CHARS) -> list:
+    """
+    يرجع قائمة (first_page, last_page, chunk_text).
+    الصفحات المتتالية تُجمع في جزء واحد ما دام لم يتجاوز max_chars.
+    """
+    chunks = []
+    current, first_page, last_page = [], 0, 0
+    size = 0
+
+    for page_no, page in enumerate(text.split(PAGE_SEPARATOR), start=1):
+        page = page.strip()
+        if not page:
+            continue
+
+        for block in _split_block(page, max_chars):
+            if current and size + len(block) + 2 > max_chars:
+                chunks.append((first_page, last_page, "\n\n".join(current)))
+                current, size = [], 0
+            if not current:
+                first_page = page_no
+            current.append(block)
+            size += len(block) + 2
+            last_page = page_no
+
+    if current:
+        chunks.append((first_page, last_page, "\n\n".join(current)))
+    return chunks
+
+
+def merge_chunk_verdicts(verdicts: list) -> dict:
+    """دمج نتائج الأجزاء: الرفض في أي جزء يرفض المقال، مع أسباب كل جزء مرفوض."""
+    rejected = [(i, v) for i, v in enumerate(verdicts, start=1) if not v.get("approved")]
+
+    if not rejected:
+        reasons = verdicts[0].get("reasons", "") if len(verdicts) == 1 else (
+            f"تمت مراجعة المقال كاملاً ({len(verdicts)} أجزاء) ولم يظهر ما يمنع نشره."
+        )
+        return {"approved": True, "reasons": reasons}
+
+    if len(verdicts) == 1:
+        return {"approved": False, "reasons": rejected[0][1].get("reasons", "")}
+
+    seen = set()
+    lines = []
+    for i, verdict in rejected:
+        reason = (verdict.get("reasons") or "").strip()
+        if reason and reason not in seen:
+            seen.add(reason)
+            lines.append(f"• (الجزء {i}) {reason}")
+    return {"approved": False, "reasons": "\n".join(lines)}
+
+
+def review_in_chunks(text: str, review_chunk, max_chars: int = ARTICLE_CHUNK_CHARS) -> dict:
+    """
+    review_chunk(chunk_text, index, total, first_page, last_page) -> dict
+    تُستدعى لكل جزء بالتوازي؛ أول استثناء من أي جزء يُرفع كما هو.
+    """
+    chunks = split_review_chunks(text, max_chars)
+    if not chunks:
+        return {"approved": False, "reasons": "لا يوجد نص للمراجعة."}
+    if len(chunks) > ARTICLE_MAX_CHUNKS:
+        raise ArticleTooLong(len(chunks))
+
+    total = len(chunks)
+    if total == 1:
+        first_page, last_page, chunk = chunks[0]
+        return merge_chunk_verdicts([review_chunk(chunk, 1, 1, first_page, last_page)])
+
+    futures = [
+        _review_pool.submit(review_chunk, chunk, i, total, first_page, last_page)
+        for i, (first_page, last_page, chunk) in enumerate(chunks, start=1)
+    ]
+    try:
+        verdicts = [f.result() for f in futures]
+    except Exception:
+        for f in futures:
+            f.cancel()
+        raise
+    return merge_chunk_verdicts(verdicts)
@@ -0,0 +1,90 @@
+# bench_generate_codes.py
+"""
+قياس سرعة توليد الأكواد بالوضع الجماعي مقابل الطريقة القديمة (كود بكود).
+
+يعمل على قاعدة DATABASE_URL لكن داخل جدول مؤقت (TEMP) نسخة من redeem_codes،
+فلا يُضاف أي كود حقيقي إلى الجدول الأصلي.
+
+    python bench_generate_codes.py              # مليون كود
+    python bench_generate_codes.py 200000 2000  # عدد الأكواد، وعدد أكواد الطريقة القديمة
+"""
+import io
+import sys
+import time
+
+from database import engine
+from generate_codes import generate_code_candidates, generate_codes_bulk, generate_random_code
+
+BENCH_TABLE = "redeem_codes_bench"
+
+
+def _create_bench_table(conn) -> None:
+    cur = conn.cursor()
+    cur.execute(f"DROP TABLE IF EXISTS {BENCH_TABLE}")
+    # بدون INCLUDING DEFAULTS: الافتراضي لـ id هو nextval('redeem_codes_id_seq')،
+    # ونسخه يجعل كل تشغيل للقياس يستهلك أرقاماً من تسلسل الجدول الحقيقي.
+    # الجدول المؤقت يأخذ تسلسلاً خاصاً به (identity) بدلاً من ذلك.
+    cur.execute(
+        f"CREATE TEMP TABLE {BENCH_TABLE} "
+        "(LIKE redeem_codes INCLUDING INDEXES INCLUDING CONSTRAINTS)"
+    )
+    cur.execute(f"ALTER TABLE {BENCH_TABLE} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY")
+    conn.commit()
+    cur.close()
+
+
+def bench_legacy(conn, count: int) -> float:
+    """الطريقة القديمة: SELECT ثم INSERT ثم commit لكل كود."""
+    cur = conn.cursor()
+    started = time.perf_counter()
+    for _ in range(count):
+        while True:
+            code = generate_random_code(10)
+            cur.execute(f"SELECT 1 FROM {BENCH_TABLE} WHERE code = %s", (code,))
+            if cur.fetchone() is None:
+                break
+        cur.execute(
+            f"INSERT INTO {BENCH_TABLE} (code, points, is_used, is_redeemed) "
+            "VALUES (%s, %s, false, false)",
+            (code, 0),
+        )
+        conn.commit()
+    elapsed = time.perf_counter() - started
+    cur.close()
+    return elapsed
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    legacy_count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    started = time.perf_counter()
+    generate_code_candidates(count)
+    gen_elapsed = time.perf_counter() - started
+    print(f"in-memory generation : {count:>9,} codes in {gen_elapsed:6.2f}s")
+
+    conn = engine.raw_connection()
+    try:
+        _create_bench_table(conn)
+
+        legacy_elapsed = bench_legacy(conn, legacy_count)
+        legacy_rate = legacy_count / legacy_elapsed
+        print(
+            f"legacy (per code)    : {legacy_count:>9,} codes in {legacy_elapsed:6.2f}s "
+            f"({legacy_rate:,.0f} codes/s, ~{count / legacy_rate:,.0f}s for {count:,})"
+        )
+
+        out = io.StringIO()
+        started = time.perf_counter()
+        produced = generate_codes_bulk(count, 0, out_file=out, table=BENCH_TABLE, conn=conn)
+        bulk_elapsed = time.perf_counter() - started
+        print(
+            f"bulk                 : {produced:>9,} codes in {bulk_elapsed:6.2f}s "
+            f"({produced / bulk_elapsed:,.0f} codes/s)"
+        )
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# bench_pdf_ingest.py
+"""
+قياس قراءة ملفات PDF عربية: الطريقة القديمة (كل الصفحات مع text += ...)
+مقابل pdf_ingest بميزانية القصة (STORY_MAX_CHARS) وميزانية المقال.
+
+الملفات تُولَّد في الذاكرة (نص عربي عشوائي مع ToUnicode حتى يستخرجه PyPDF2 كعربي).
+
+    python bench_pdf_ingest.py              # 10 و 100 و 500 صفحة
+    python bench_pdf_ingest.py 50 1000      # أعداد صفحات أخرى
+"""
+import random
+import sys
+import time
+from io import BytesIO
+
+import PyPDF2
+
+from article_review import ARTICLE_CHUNK_CHARS, ARTICLE_MAX_CHUNKS, PAGE_SEPARATOR
+from pdf_ingest import extract_pdf_text
+from story_prescreen import STORY_MAX_CHARS
+
+ARABIC_LETTERS = [chr(c) for c in range(0x0621, 0x063B)] + [chr(c) for c in range(0x0641, 0x064B)]
+LINES_PER_PAGE = 35
+WORDS_PER_LINE = 12
+
+
+def _pdf_object(num: int, body: bytes) -> bytes:
+    return b"%d 0 obj\n" % num + body + b"\nendobj\n"
+
+
+def _stream(data: bytes) -> bytes:
+    return b"<< /Length %d >>\nstream\n" % len(data) + data + b"\nendstream"
+
+
+def make_arabic_pdf(pages: int, seed: int = 1) -> bytes:
+    """PDF بخط Helvetica وجدول ToUnicode يحوّل كل بايت إلى حرف عربي."""
+    rnd = random.Random(seed)
+    codes = {ch: 0x21 + i for i, ch in enumerate(ARABIC_LETTERS)}
+    bfchar = "\n".join(f"<{code:02X}> <{ord(ch):04X}>" for ch, code in codes.items())
+    cmap = (
+        "/CIDInit /ProcSet findresource begin 12 dict begin begincmap\n"
+        "/CMapName /Arabic def 1 begincodespacerange <00> <FF> endcodespacerange\n"
+        f"{len(codes) + 1} beginbfchar\n<20> <0020>\n{bfchar}\nendbfchar\n"
+        "endcmap CMapName currentdict /CMap defineresource pop end end"
+    ).encode()
+
+    # 1: الخط، 2: الـ CMap، 3: شجرة الصفحات، ثم (محتوى، صفحة) لكل صفحة، ثم الـ catalog
+    objects = [
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /ToUnicode 2 0 R >>",
+        _stream(cmap),
+        None,
+    ]
+    kids = []
+    for _ in range(pages):
+        ops = ["BT /F1 11 Tf 14 TL 50 800 Td"]
+        for _ in range(LINES_PER_PAGE):
+            line = " ".join(
+                "".join(rnd.choice(ARABIC_LETTERS) for _ in range(rnd.randint(2, 7)))
+                for _ in range(WORDS_PER_LINE)
+            )
+            ops.append(f"<{bytes(codes.get(ch, 0x20) for ch in line).hex()}> Tj T*")
+        ops.append("ET")
+        objects.append(_stream("\n".join(ops).encode()))
+        content_id = len(objects)
+        objects.append(
+            f"<< /Type /Page /Parent 3 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 1 0 R >> >> /Contents {content_id} 0 R >>".encode()
+        )
+        kids.append(len(objects))
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(f'{k} 0 R' for k in kids)}] /Count {pages} >>".encode()
+    objects.append(b"<< /Type /Catalog /Pages 3 0 R >>")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += _pdf_object(num, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, len(objects), xref,
+    )
+    return bytes(out)
+
+
+def legacy_extract(data: bytes) -> str:
+    """نسخة من الكود القديم في handle_pdf_story."""
+    bio = BytesIO(data)
+    reader = PyPDF2.PdfReader(bio)
+    full_text = ""
+    for page in reader.pages:
+        full_text += (page.extract_text() or "") + "\n"
+    return full_text
+
+
+def _timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def main() -> None:
+    sizes = [int(a) for a in sys.argv[1:]] or [10, 100, 500]
+    article_budget = ARTICLE_MAX_CHUNKS * ARTICLE_CHUNK_CHARS
+
+    print(f"{'pages':>6} {'size':>8} | {'legacy':>8} | {'story':>8} {'pages':>6} | {'article':>8} {'pages':>6}")
+    for pages in sizes:
+        data = make_arabic_pdf(pages)
+        legacy_s, _ = _timed(legacy_extract, data)
+        story_s, story = _timed(extract_pdf_text, BytesIO(data), max_chars=STORY_MAX_CHARS)
+        article_s, article = _timed(
+            extract_pdf_text, BytesIO(data), separator=PAGE_SEPARATOR, max_chars=article_budget,
+        )
+        print(
+            f"{pages:>6} {len(data) // 1024:>6}KB | {legacy_s:>7.2f}s | "
+            f"{story_s:>7.2f}s {story.pages:>6} | {article_s:>7.2f}s {article.pages:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
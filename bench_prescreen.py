@@ -0,0 +1,122 @@
+# bench_prescreen.py
+"""
+قياس سرعة الفحص المحلي للقصص (story_prescreen) ونسبة ما يرفضه قبل أي طلب للذكاء الاصطناعي.
+
+بدون وسائط يبني مجموعة عيّنات صناعية تشبه ما يصل للبوت:
+قصص سليمة، قصيرة، بالإنجليزية، بأسطر مكررة، نص PDF تالف، ونصوص طويلة جداً،
+وقصص سليمة بأشكال العرض العربية (U+FE70–U+FEFF) كما يرجعها PyPDF2 من بعض الملفات،
+وقصص سليمة فيها فواصل (----) وعناوين مزاحة بمسافات ونقاط وتطويل كما تظهر في نص PDF.
+ويمكن تمرير مجلد فيه ملفات .txt لقياس عيّنات حقيقية:
+
+    python bench_prescreen.py
+    python bench_prescreen.py samples/ 50      # المجلد، وعدد مرات التكرار
+"""
+import os
+import random
+import statistics
+import sys
+import time
+import unicodedata
+from collections import Counter
+
+from story_prescreen import STORY_MAX_CHARS, STORY_MIN_WORDS, prescreen_story
+
+_WORDS = (
+    "كان الولد يمشي في الطريق الطويل نحو البيت القديم حين سمع صوتاً غريباً "
+    "خلف الأشجار فتوقف قليلاً ونظر حوله بخوف ثم تذكر كلام جدته عن الغابة "
+    "والليل والقمر والنجوم التي تحرس المسافرين وقرر أن يكمل طريقه بشجاعة"
+).split()
+
+
+def _arabic_story(words: int, rng: random.Random) -> str:
+    lines = []
+    for _ in range(max(1, words // 12)):
+        lines.append(" ".join(rng.choice(_WORDS) for _ in range(12)) + ".")
+    return "\n".join(lines)
+
+
+def _presentation_forms_map() -> dict:
+    """الحرف الأساسي -> أول شكل عرض له (عادة المعزول)."""
+    forms = {}
+    for code in range(0xFE70, 0xFEFF):
+        base = unicodedata.normalize("NFKC", chr(code))
+        if len(base) == 1:
+            forms.setdefault(base, chr(code))
+    return forms
+
+
+_PRESENTATION = str.maketrans(_presentation_forms_map())
+
+
+def build_corpus(rng: random.Random) -> list:
+    corpus = []
+    for _ in range(40):
+        corpus.append(("valid", _arabic_story(rng.randint(STORY_MIN_WORDS, 3000), rng)))
+    for _ in range(40):
+        corpus.append(("short", _arabic_story(rng.randint(20, STORY_MIN_WORDS - 50), rng)))
+    for _ in range(10):
+        story = _arabic_story(rng.randint(STORY_MIN_WORDS + 100, 3000), rng)
+        corpus.append(("presentation_forms", story.translate(_PRESENTATION)))
+    for _ in range(10):
+        story = _arabic_story(rng.randint(STORY_MIN_WORDS + 100, 3000), rng)
+        corpus.append(("divider", story.replace("\n", "\n" + "-" * 40 + "\n", 3)))
+    for _ in range(10):
+        story = _arabic_story(rng.randint(STORY_MIN_WORDS + 100, 3000), rng)
+        heading = " " * 40 + "الفصل الأول" + "\n" + "ـ" * 35 + "\n" + "…" * 30 + "\n"
+        corpus.append(("indented", heading + story))
+    for _ in range(10):
+        corpus.append(("english", "Once upon a time there was a boy who walked home. " * 150))
+    for _ in range(10):
+        line = " ".join(rng.choice(_WORDS) for _ in range(10))
+        corpus.append(("repeated", "\n".join([line] * 200)))
+    for _ in range(10):
+        corpus.append(("garbage", "� #$% " * 2000 + _arabic_story(200, rng)))
+    for _ in range(5):
+        corpus.append(("too_long", _arabic_story(STORY_MAX_CHARS // 5, rng)))
+    return corpus
+
+
+def load_corpus(folder: str) -> list:
+    corpus = []
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(".txt"):
+            with open(os.path.join(folder, name), encoding="utf-8") as f:
+                corpus.append((name, f.read()))
+    return corpus
+
+
+def main() -> None:
+    folder = sys.argv[1] if len(sys.argv) > 1 else None
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    corpus = load_corpus(folder) if folder else build_corpus(random.Random(7))
+    total_chars = sum(len(t) for _, t in corpus)
+
+    timings = []
+    rejected = Counter()
+    for round_no in range(rounds):
+        for label, text in corpus:
+            started = time.perf_counter()
+            result = prescreen_story(text)
+            timings.append(time.perf_counter() - started)
+            if not result.ok and round_no == 0:
+                rejected[label] += 1
+
+    timings.sort()
+    p50 = statistics.median(timings) * 1000
+    p95 = timings[int(len(timings) * 0.95) - 1] * 1000
+    print(f"samples        : {len(corpus)} ({total_chars / 1e6:.1f}M chars), {rounds} rounds")
+    print(f"latency        : p50 {p50:.2f} ms, p95 {p95:.2f} ms, max {timings[-1] * 1000:.2f} ms")
+    print(f"throughput     : {len(timings) / sum(timings):,.0f} submissions/s")
+
+    n_rejected = sum(rejected.values())
+    print(
+        f"rejected local : {n_rejected}/{len(corpus)} "
+        f"({n_rejected / len(corpus):.0%} of AI review calls avoided)"
+    )
+    for label, count in sorted(rejected.items()):
+        print(f"    {label:<12} {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# bench_runway_client.py
+"""
+قياس متابعة مهام Runway كثيرة على خادم وهمي محلي (fake_runway.py):
+اتصال جديد لكل استعلام (الطريقة القديمة) مقابل RunwayClient و AsyncRunwayClient.
+
+يطبع الزمن وعدد الاتصالات التي فتحها الخادم لكل طريقة. الخادم المحلي بدون TLS،
+لذلك يضيف تأخيراً لكل اتصال جديد (handshake) يقارب مصافحة TLS مع Runway.
+
+    python bench_runway_client.py                   # 50 مهمة × 20 استعلام
+    python bench_runway_client.py 200 10 0.01 0.05  # مهام، استعلامات لكل مهمة، تأخير كل رد، تأخير كل اتصال
+"""
+import asyncio
+import json
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_runway import FakeRunwayServer
+from runway_client import AsyncRunwayClient, RunwayClient
+
+THREADS = 8
+
+
+def bench_fresh_connections(server: FakeRunwayServer, task_ids: list, polls: int) -> float:
+    """مثل requests.get بدون Session: اتصال TCP جديد وheaders جديدة لكل استعلام."""
+
+    def poll(task_id):
+        for _ in range(polls):
+            req = urllib.request.Request(
+                f"{server.base_url}/tasks/{task_id}",
+                headers={"Authorization": f"Bearer {server.api_key}", "X-Runway-Version": "2024-11-06"},
+            )
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                json.loads(resp.read())
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(poll, task_ids))
+    return time.perf_counter() - started
+
+
+def bench_sync_client(client: RunwayClient, task_ids: list, polls: int) -> float:
+    def poll(task_id):
+        for _ in range(polls):
+            client.get_task(task_id)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(poll, task_ids))
+    return time.perf_counter() - started
+
+
+async def bench_async_client(server: FakeRunwayServer, task_ids: list, polls: int) -> float:
+    async with AsyncRunwayClient(server.api_key, base_url=server.base_url) as client:
+        async def poll(task_id):
+            for _ in range(polls):
+                await client.get_task(task_id)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(poll(t) for t in task_ids))
+        return time.perf_counter() - started
+
+
+def _report(name: str, seconds: float, server: FakeRunwayServer, total: int) -> None:
+    stats = server.stats
+    print(
+        f"{name:<22} {seconds:7.2f}s  {total / seconds:8.0f} req/s  "
+        f"connections={stats['connections']:<5} requests={stats['requests']}"
+    )
+    server.reset_stats()
+
+
+def main() -> None:
+    tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    polls = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    handshake = float(sys.argv[4]) if len(sys.argv) > 4 else 0.03
+    total = tasks * polls
+
+    with FakeRunwayServer(task_seconds=3600, latency=latency, handshake=handshake) as server:
+        with RunwayClient(server.api_key, base_url=server.base_url) as client:
+            task_ids = [
+                client.create_text_to_video("قط يقرأ كتاباً", model="veo3.1", ratio="1280:720", duration=4).id
+                for _ in range(tasks)
+            ]
+            server.reset_stats()
+
+            print(f"{tasks} tasks × {polls} polls = {total} status requests\n")
+            _report("fresh connection", bench_fresh_connections(server, task_ids, polls), server, total)
+            _report("RunwayClient", bench_sync_client(client, task_ids, polls), server, total)
+
+        _report("AsyncRunwayClient", asyncio.run(bench_async_client(server, task_ids, polls)), server, total)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,10 @@ import logging
 import json
 import time
 import base64
+import threading
 from io import BytesIO
 from textwrap import wrap
-from datetime import datetime
+from datetime import timezone
 import re
 
 from telegram import (
@@ -23,15 +24,63 @@ from telegram.ext import (
     CallbackContext,
 )
 
-from openai import OpenAI
-import PyPDF2
-import requests
 from pricing_config import get_pricing_text
+from ai_gateway import ai_enabled, chat, chat_stream, generate_image
+from metrics import start_metrics_server
+from structured_output import (
+    ArticleReview,
+    StoryReview,
+    StructuredOutputError,
+    VideoPrompt,
+    chat_structured,
+    to_dict,
+)
+from lanes import run_in_lane
+from throttle import KeyedTokenBucket
+from code_format import is_well_formed_code, normalize_code
+from stream_edit import StreamingMessage
+from runway_client import RUNWAY_TERMINAL_STATUSES, RunwayClient, RunwayError
+from runway_status import get_task_status
+from story_prescreen import STORY_MAX_CHARS, PrescreenResult, normalize_text, prescreen_story
+from pdf_ingest import PdfParseError, PdfTooLarge, read_pdf_document
+from pdf_cache import pdf_cache_stats, purge_pdf_cache_dir
+from article_review import (
+    ARTICLE_CHUNK_CHARS,
+    ARTICLE_MAX_CHUNKS,
+    PAGE_SEPARATOR,
+    ArticleTooLong,
+    review_in_chunks,
+)
+from review_cache import (
+    get_cached_review,
+    prompt_version,
+    purge_expired_reviews,
+    review_cache_key,
+    review_cache_stats,
+    store_review,
+)
 
 # SQLAlchemy / DB
 from sqlalchemy.orm import Session
-from database import Base, engine, SessionLocal
-from models import User, Wallet, RedeemCode
+from database import Base, engine, current_session, release_connection, with_session_scope
+from models import LedgerReason
+from wallet_service import (
+    DEFAULT_HOLD_TTL_SECONDS,
+    REDEEM_ALREADY_USED,
+    REDEEM_INVALID,
+    add_points,
+    commit_hold,
+    ensure_user_wallet,
+    expire_stale_holds,
+    get_balance,
+    get_held_points,
+    list_open_holds_with_ref,
+    reconcile_ledger,
+    redeem_code,
+    release_hold,
+    reserve_points,
+    set_hold_ref,
+)
 
 # =============== الإعدادات العامة ===============
 
@@ -46,17 +95,29 @@ OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 OPENAI_MODEL = os.environ.get("OPENAI_MODEL", "gpt-4.1-mini")
 
 # مفاتيح خدمة الفيديو بالذكاء الاصطناعي (Runway في الخلفية)
+# العنوان والمهلات وحجم الـ pool في runway_client (RUNWAY_BASE_URL, RUNWAY_*_TIMEOUT ...)
 RUNWAY_API_KEY = os.environ.get("RUNWAY_API_KEY")
-RUNWAY_API_URL = os.environ.get(
-    "RUNWAY_API_URL",
-    "https://api.dev.runwayml.com/v1/text_to_video",
-)
-RUNWAY_API_VERSION = os.environ.get("RUNWAY_API_VERSION", "2024-11-06")
 RUNWAY_MODEL = os.environ.get("RUNWAY_MODEL", "veo3.1")
-RUNWAY_TASKS_URL = os.environ.get(
-    "RUNWAY_TASKS_URL",
-    "https://api.dev.runwayml.com/v1/tasks",
-)
+# متابعة مهام الفيديو في الخلفية (JobQueue) بدل الانتظار داخل الـ handler
+RUNWAY_POLL_TICK_SECONDS = float(os.environ.get("RUNWAY_POLL_TICK_SECONDS", "2"))
+RUNWAY_POLL_MIN_INTERVAL = float(os.environ.get("RUNWAY_POLL_MIN_INTERVAL", "5"))
+RUNWAY_POLL_MAX_INTERVAL = float(os.environ.get("RUNWAY_POLL_MAX_INTERVAL", "30"))
+RUNWAY_TASK_MAX_WAIT = float(os.environ.get("RUNWAY_TASK_MAX_WAIT", "900"))
+# حجز نقاط الفيديو يجب أن يعيش أطول من أقصى مدة متابعة
+VIDEO_HOLD_TTL_SECONDS = int(RUNWAY_TASK_MAX_WAIT) + 600
+# إعادة نقاط الحجوزات المنتهية دورياً
+WALLET_HOLD_SWEEP_INTERVAL = float(os.environ.get("WALLET_HOLD_SWEEP_INTERVAL", "120"))
+# مطابقة سجل النقاط مع الأرصدة دورياً
+LEDGER_RECONCILE_INTERVAL = float(os.environ.get("LEDGER_RECONCILE_INTERVAL", str(6 * 3600)))
+LEDGER_RECONCILE_CHUNK = int(os.environ.get("LEDGER_RECONCILE_CHUNK", "1000"))
+# حذف نتائج المراجعة المنتهية من كاش Postgres
+REVIEW_CACHE_PURGE_INTERVAL = float(os.environ.get("REVIEW_CACHE_PURGE_INTERVAL", str(12 * 3600)))
+# حذف ملفات كاش نص PDF القديمة من القرص (pdf_cache)
+PDF_CACHE_PURGE_INTERVAL = float(os.environ.get("PDF_CACHE_PURGE_INTERVAL", str(24 * 3600)))
+# منفذ /metrics عند تشغيل البوت كعملية مستقلة (0 = معطل)
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# عرض القصة أثناء كتابتها (stream) بدل انتظار النص كاملاً
+STORY_STREAMING = os.environ.get("STORY_STREAMING", "1") == "1"
 STORIES_TOPIC_ID = int(os.environ.get("STORIES_TOPIC_ID", "0"))
 COMMUNITY_CHAT_ID = os.environ.get("COMMUNITY_CHAT_ID")
 ARTICLES_TOPIC_ID = int(os.environ.get("ARTICLES_TOPIC_ID", "0"))
@@ -65,15 +126,22 @@ STATE_ARTICLE_PDF = 50
 if not BOT_TOKEN:
     raise RuntimeError("BOT_TOKEN is not set in environment variables")
 
+# عميل OpenAI نفسه في ai_gateway (pool اتصالات، مهلات، إعادة محاولة، وحدود تزامن)
 if not OPENAI_API_KEY:
     logger.warning("OPENAI_API_KEY is not set. Story generation / review will fail.")
-    client = None
-else:
-    client = OpenAI(api_key=OPENAI_API_KEY)
+
+# عميل Runway واحد (pool اتصالات مع keep-alive) للإنشاء والـ poller و /video_status
+runway_client = RunwayClient(RUNWAY_API_KEY) if RUNWAY_API_KEY else None
+if runway_client is None:
+    logger.warning("RUNWAY_API_KEY is not set. Video generation will fail.")
 
 # تأكد من إنشاء الجداول
 Base.metadata.create_all(bind=engine)
 
+# وزن كل نوع طلب في الجدولة العادلة بين المستخدمين (القصة = 1)
+IMAGE_JOB_COST = 2
+VIDEO_JOB_COST = 3
+
 # ======== أسعار النقاط =========
 
 IMAGE_COST_POINTS = 25        # صورة
@@ -265,6 +333,11 @@ IMAGE_PROMPT_SYSTEM = """
 أعد النتيجة كنص واحد فقط: البرومبت باللغة الإنجليزية بدون أي شرح إضافي.
 """
 
+# نسخ البرومبتات داخل مفتاح كاش المراجعات: تعديل البرومبت يُبطل النتائج القديمة
+STORY_REVIEW_VERSION = prompt_version(REVIEW_PROMPT)
+# حجم الجزء يغيّر طريقة المراجعة، لذلك هو جزء من نسخة مراجعة المقالات
+ARTICLE_REVIEW_VERSION = prompt_version(f"{ARTICLE_REVIEW_PROMPT}|chunk={ARTICLE_CHUNK_CHARS}")
+
 # =============== دوال المستخدم والمحفظة ===============
 def article_command(update: Update, context: CallbackContext) -> int:
     if update.effective_chat.type != "private":
@@ -327,16 +400,20 @@ def handle_article_pdf(update: Update, context: CallbackContext) -> int:
 
     # ================== تحميل وقراءة PDF ==================
     try:
-        bio = BytesIO()
-        doc.get_file().download(out=bio)
-        bio.seek(0)
-
-        reader = PyPDF2.PdfReader(bio)
-        text = ""
-
-        for page in reader.pages:
-            text += (page.extract_text() or "") + "\n"
-
+        # نحتفظ بحدود الصفحات ليقسّم المراجع المقال عليها،
+        # ونتوقف عند أقصى ما يمكن مراجعته (ما بعده يجعل المقال طويلاً جداً على أي حال)
+        text = read_pdf_document(
+            doc,
+            separator=PAGE_SEPARATOR,
+            max_chars=ARTICLE_MAX_CHUNKS * ARTICLE_CHUNK_CHARS,
+        ).text
+
+    except PdfTooLarge as e:
+        reply_pdf_too_large(update, e)
+        return ConversationHandler.END
+    except PdfParseError as e:
+        reply_pdf_unreadable(update, e)
+        return ConversationHandler.END
     except Exception as e:
         logger.exception("PDF read error: %s", e)
         update.message.reply_text(
@@ -351,7 +428,21 @@ def handle_article_pdf(update: Update, context: CallbackContext) -> int:
         return ConversationHandler.END
 
     # ================== مراجعة المقال بالذكاء الاصطناعي ==================
-    review = review_article_with_openai(text)
+    try:
+        review = review_article_with_openai(text)
+    except ArticleTooLong:
+        update.message.reply_text(
+            "❌ المقال طويل جداً للمراجعة، رجاءً أرسل مقالاً أقصر.",
+            reply_markup=MAIN_KEYBOARD,
+        )
+        return ConversationHandler.END
+    except Exception as e:
+        logger.exception("AI article review error: %s", e)
+        update.message.reply_text(
+            "⚠️ حدث خطأ أثناء مراجعة المقال بالذكاء الاصطناعي، حاول مرة أخرى لاحقاً.",
+            reply_markup=MAIN_KEYBOARD,
+        )
+        return ConversationHandler.END
 
     if not review.get("approved"):
         update.message.reply_text(
@@ -396,18 +487,40 @@ def handle_article_pdf(update: Update, context: CallbackContext) -> int:
     return ConversationHandler.END
 
 def review_article_with_openai(text: str):
-    if client is None:
+    if not ai_enabled():
         return {"approved": False, "reasons": "AI غير متاح"}
 
-    completion = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=[
+    cache_key = review_cache_key("article", ARTICLE_REVIEW_VERSION, OPENAI_MODEL, text)
+    cached = get_cached_review(cache_key)
+    if cached is not None:
+        return cached
+
+    # كل جزء يُراجع في طلب مستقل وبالتوازي، ثم تُدمج النتائج
+    data = review_in_chunks(text, _review_article_chunk)
+    store_review(cache_key, "article", OPENAI_MODEL, data)
+    return data
+
+
+def _review_article_chunk(chunk: str, index: int, total: int, first_page: int, last_page: int) -> dict:
+    content = chunk
+    if total > 1:
+        content = (
+            f"هذا الجزء {index} من {total} من المقال (الصفحات {first_page}-{last_page}).\n"
+            "راجع هذا الجزء فقط.\n\n"
+            f"{chunk}"
+        )
+
+    review = chat_structured(
+        "article_review",
+        [
             {"role": "system", "content": ARTICLE_REVIEW_PROMPT},
-            {"role": "user", "content": text[:15000]},
+            {"role": "user", "content": content},
         ],
+        model=OPENAI_MODEL,
+        result_type=ArticleReview,
         temperature=0.0,
     )
-    return json.loads(completion.choices[0].message.content.strip())
+    return to_dict(review)
 
 def get_user_id(update: Update) -> int:
     return update.effective_user.id
@@ -421,80 +534,131 @@ def myid_command(update: Update, context: CallbackContext):
     )
 
 
-def _get_or_create_user_and_wallet(db: Session, tg_user) -> tuple[User, Wallet]:
-    """يرجع User + Wallet من DB أو يقوم بإنشائهما.
+def _get_or_create_user_and_wallet(db: Session, tg_user) -> tuple[int, int, bool]:
+    """يرجع (user_id, wallet_id, created) أو ينشئ المستخدم والمحفظة.
        المستخدم الجديد يحصل تلقائياً على 5 نقاط مجانية."""
-    
-    user_created = False
-    wallet_created = False
-
-    # --- إنشاء المستخدم إذا لم يكن موجوداً ---
-    user = db.query(User).filter(User.telegram_id == tg_user.id).first()
-    if not user:
-        user = User(
-            telegram_id=tg_user.id,
-            first_name=tg_user.first_name,
-            username=tg_user.username,
-        )
-        db.add(user)
-        db.flush()
-        user_created = True
-
-    # --- إنشاء المحفظة إذا لم تكن موجودة ---
-    wallet = user.wallet
-    if wallet is None:
-        wallet = Wallet(user_id=user.id, balance_cents=0)
-        db.add(wallet)
-        wallet_created = True
-
-        # 🎁 مكافأة ترحيبية للمستخدم الجديد
-        wallet.balance_cents = 5   # 5 نقاط مجانية
-
-    # --- حفظ التغييرات ---
-    if user_created or wallet_created:
-        db.commit()
-
-    return user, wallet
+    return ensure_user_wallet(
+        db,
+        tg_user.id,
+        first_name=tg_user.first_name,
+        username=tg_user.username,
+    )
 
 
 def get_user_balance(user_id: int) -> int:
     """جلب رصيد المستخدم من wallets.balance_cents."""
-    db: Session = SessionLocal()
+    db = current_session()
     try:
-        tg_user = type("TgUserProxy", (), {"id": user_id, "first_name": None, "username": None})
-        _, wallet = _get_or_create_user_and_wallet(db, tg_user)
-        db.commit()
-        return wallet.balance_cents or 0
+        _, wallet_id, _ = ensure_user_wallet(db, user_id)
+        return get_balance(db, wallet_id) or 0
     except Exception as e:
         logger.exception("get_user_balance error: %s", e)
         db.rollback()
         return 0
     finally:
-        db.close()
+        release_connection(db)
 
 
-def add_user_points(user_id: int, delta: int) -> int:
+def add_user_points(user_id: int, delta: int, reason: LedgerReason) -> int:
     """إضافة/خصم نقاط من wallet.balance_cents."""
-    db: Session = SessionLocal()
+    db = current_session()
     try:
-        tg_user = type("TgUserProxy", (), {"id": user_id, "first_name": None, "username": None})
-        _, wallet = _get_or_create_user_and_wallet(db, tg_user)
-        wallet.balance_cents = max(0, (wallet.balance_cents or 0) + delta)
-        db.commit()
-        return wallet.balance_cents
+        _, wallet_id, _ = ensure_user_wallet(db, user_id)
+        return add_points(db, wallet_id, delta, reason) or 0
     except Exception as e:
         logger.exception("add_user_points error: %s", e)
         db.rollback()
         return 0
     finally:
-        db.close()
+        release_connection(db)
+
+
+def get_user_wallet_summary(user_id: int) -> tuple[int, int]:
+    """(الرصيد المتاح, النقاط المحجوزة لطلبات قيد التنفيذ)."""
+    db = current_session()
+    try:
+        _, wallet_id, _ = ensure_user_wallet(db, user_id)
+        return get_balance(db, wallet_id) or 0, get_held_points(db, wallet_id)
+    except Exception as e:
+        logger.exception("get_user_wallet_summary error: %s", e)
+        db.rollback()
+        return 0, 0
+    finally:
+        release_connection(db)
 
 
-def require_points(update: Update, needed_points: int) -> bool:
-    """تحقق من وجود رصيد كافٍ."""
+def reserve_user_points(
+    user_id: int,
+    amount: int,
+    reason: LedgerReason,
+    ttl_seconds: int = DEFAULT_HOLD_TTL_SECONDS,
+) -> tuple[int, int] | None:
+    """حجز ذرّي: يرجع (hold_id, الرصيد المتاح) أو None إذا لم يكفِ الرصيد."""
+    db = current_session()
+    try:
+        # مستخدم لم يرسل /start ليس له محفظة بعد؛ بدونها لا يطابق الحجز أي صف
+        # (المستخدم المعروف يُخدم من الكاش بدون استعلام)
+        ensure_user_wallet(db, user_id)
+        return reserve_points(db, user_id, amount, reason, ttl_seconds=ttl_seconds)
+    except Exception as e:
+        logger.exception("reserve_user_points error: %s", e)
+        db.rollback()
+        return None
+    finally:
+        release_connection(db)
+
+
+def commit_user_hold(hold_id: int, ref: str | None = None) -> bool:
+    """تثبيت الحجز بعد نجاح الطلب."""
+    db = current_session()
+    try:
+        return commit_hold(db, hold_id, ref=ref)
+    except Exception as e:
+        logger.exception("commit_user_hold error (%s): %s", hold_id, e)
+        db.rollback()
+        return False
+    finally:
+        release_connection(db)
+
+
+def release_user_hold(hold_id: int) -> int | None:
+    """إعادة نقاط الحجز بعد فشل الطلب (بدون round trip إضافي للرصيد)."""
+    db = current_session()
+    try:
+        return release_hold(db, hold_id)
+    except Exception as e:
+        # إن فشلت الإعادة الآن فسيعيدها الـ sweeper عند انتهاء مهلة الحجز
+        logger.exception("release_user_hold error (%s): %s", hold_id, e)
+        db.rollback()
+        return None
+    finally:
+        release_connection(db)
+
+
+def require_and_reserve(
+    update: Update,
+    needed_points: int,
+    reason: LedgerReason,
+    ttl_seconds: int = DEFAULT_HOLD_TTL_SECONDS,
+) -> int | None:
+    """
+    يحجز النقاط بجملة واحدة مشروطة بكفاية الرصيد، ويرجع hold_id.
+    على الـ handler أن يثبّت الحجز (commit_user_hold) عند النجاح
+    أو يعيده (release_user_hold) عند الفشل؛ وإلا أعاده الـ sweeper بعد انتهاء المهلة.
+    """
     user_id = get_user_id(update)
-    balance = get_user_balance(user_id)
-    if balance < needed_points:
+    reserved = reserve_user_points(user_id, needed_points, reason, ttl_seconds=ttl_seconds)
+
+    if reserved is None:
+        # المسار النادر فقط: نقرأ الرصيد لنخبر المستخدم بما ينقصه
+        balance = get_user_balance(user_id)
+        if balance >= needed_points:
+            update.message.reply_text(
+                "⚠️ حدث خطأ أثناء حجز النقاط، حاول مرة أخرى لاحقاً.",
+                reply_markup=MAIN_KEYBOARD,
+            )
+            return None
+
         short = needed_points - balance
         update.message.reply_text(
             f"❌ رصيدك الحالي: {balance} نقطة.\n"
@@ -502,36 +666,91 @@ def require_points(update: Update, needed_points: int) -> bool:
             f"ينقصك: {short} نقطة.\n\n"
             "💳 اشترِ كود شحن من متجر *مرويات*:\n🔗 https://salla.sa/mrwiat\n\n"
             "ثم استخدم الأمر /redeem أو زر 🎟 شحن برمز من سلة لإضافة الرصيد.",
-            "أو زر 🎟 شحن برمز من سلة لإضافة الرصيد.",
             parse_mode="Markdown",
             reply_markup=MAIN_KEYBOARD,
         )
-        return False
-    return True
-
+        return None
 
-def require_and_deduct(update: Update, needed_points: int) -> bool:
-    """يتحقق من الرصيد ثم يخصم النقاط."""
-    if not require_points(update, needed_points):
-        return False
-    user_id = get_user_id(update)
-    new_balance = add_user_points(user_id, -needed_points)
+    hold_id, new_balance = reserved
     update.message.reply_text(
-        f"✅ تم خصم {needed_points} نقطة من محفظتك.\n"
-        f"🔢 رصيدك الحالي: {new_balance} نقطة.",
+        f"✅ تم حجز {needed_points} نقطة لهذا الطلب.\n"
+        f"🔢 رصيدك المتاح: {new_balance} نقطة.\n"
+        "↩️ ستُعاد النقاط تلقائياً إذا فشل الطلب.",
         reply_markup=ReplyKeyboardRemove(),
     )
-    return True
+    return hold_id
+
+
+def expire_holds_job(context: CallbackContext) -> None:
+    """Job دوري: يعيد نقاط الحجوزات التي تجاوزت مهلتها (مثلاً بعد توقف البوت أثناء طلب)."""
+    db = current_session()
+    try:
+        expired = expire_stale_holds(db)
+        if expired:
+            logger.warning("Expired %d stale wallet holds", expired)
+    except Exception as e:
+        logger.exception("Expire holds error: %s", e)
+        db.rollback()
+    finally:
+        release_connection(db)
+
+
+def reconcile_wallets_job(context: CallbackContext) -> None:
+    """Job دوري: يطابق مجموع wallet_transactions مع أرصدة المحافظ ويسجّل أي فرق."""
+    db = current_session()
+    try:
+        mismatches = reconcile_ledger(db, chunk_size=LEDGER_RECONCILE_CHUNK)
+    except Exception as e:
+        logger.exception("Ledger reconciliation error: %s", e)
+        db.rollback()
+        return
+    finally:
+        release_connection(db)
+
+    for wallet_id, balance, ledger_sum in mismatches:
+        logger.error(
+            "Ledger mismatch: wallet_id=%s balance=%s ledger_sum=%s",
+            wallet_id, balance, ledger_sum,
+        )
+    logger.info("Ledger reconciliation done, %d mismatches", len(mismatches))
+
+
+def purge_review_cache_job(context: CallbackContext) -> None:
+    """Job دوري: حذف نتائج المراجعة المنتهية من Postgres وتسجيل إحصائيات الكاش."""
+    db = current_session()
+    try:
+        purged = purge_expired_reviews(db)
+    except Exception as e:
+        logger.exception("Review cache purge error: %s", e)
+        db.rollback()
+        return
+    finally:
+        release_connection(db)
+
+    logger.info("Review cache: purged %d expired rows, stats=%s", purged, review_cache_stats())
+
+
+def purge_pdf_cache_job(context: CallbackContext) -> None:
+    """Job دوري: حذف نصوص PDF المحفوظة على القرص التي لم تُستخدم منذ PDF_CACHE_DISK_DAYS."""
+    try:
+        removed = purge_pdf_cache_dir()
+    except Exception as e:
+        logger.exception("PDF cache purge error: %s", e)
+        return
+    logger.info("PDF cache: removed %d files, stats=%s", removed, pdf_cache_stats())
 
 # =============== المحفظة والأسعار ===============
 
 def wallet_command(update: Update, context: CallbackContext) -> None:
     user = update.effective_user
-    balance = get_user_balance(user.id)
+    balance, held = get_user_wallet_summary(user.id)
+
+    held_line = f"⏳ محجوز لطلبات قيد التنفيذ: *{held}* نقطة.\n" if held else ""
 
     msg = (
         f"💳 *محفظتك في مرويات*\n\n"
-        f"🔢 رصيدك الحالي: *{balance}* نقطة.\n\n"
+        f"🔢 رصيدك المتاح: *{balance}* نقطة.\n"
+        f"{held_line}\n"
         "لشحن المحفظة:\n"
         "1️⃣ اشترِ *كود شحن* من متجر مرويات في سلة:\n"
         "🔗 https://salla.sa/mrwiat\n\n"
@@ -567,7 +786,7 @@ def redeem_command(update: Update, context: CallbackContext) -> int:
         "إذا لم تشترِ كودًا بعد، تفضل هنا:\n🔗 https://salla.sa/mrwiat\n\n"
         "🎟 جميل! أرسل الآن *رمز الشحن* الذي اشتريته من متجر سلة.\n\n"
         "مثال (الشكل فقط، ليس كودًا حقيقياً):\n"
-        "`XYZ111`\n\n"
+        "`AB12CD34EF5G`\n\n"
         "تأكد من نسخه كما هو تمامًا.",
         parse_mode="Markdown",
         reply_markup=ReplyKeyboardRemove(),
@@ -575,6 +794,13 @@ def redeem_command(update: Update, context: CallbackContext) -> int:
     return STATE_REDEEM_CODE
 
 
+# محاولات الشحن لكل مستخدم: دفعة أولى ثم محاولة كل REDEEM_REFILL_SECONDS ثانية
+REDEEM_THROTTLE = KeyedTokenBucket(
+    capacity=int(os.environ.get("REDEEM_MAX_ATTEMPTS", "5")),
+    refill_every=float(os.environ.get("REDEEM_REFILL_SECONDS", "30")),
+)
+
+
 def redeem_code_logic(tg_user, raw_text: str):
     """
     يتحقق من الكود في جدول RedeemCode ويضيف النقاط إلى Wallet.
@@ -582,48 +808,37 @@ def redeem_code_logic(tg_user, raw_text: str):
     if not raw_text:
         return False, "⚠️ لم أستطع قراءة الكود، أرسله مرة أخرى."
 
-    code_text = raw_text.strip().upper()
-
-    prefixes = ["MRW-100-", "MRW-50-", "MRW-500-", "MRW-1100-", "MRW-"]
-    for p in prefixes:
-        if code_text.startswith(p):
-            code_text = code_text[len(p):]
-            break
+    code_text = normalize_code(raw_text)
 
     if not code_text:
         return False, "⚠️ الكود فارغ بعد التنظيف، تأكد من نسخه بشكل صحيح."
 
-    db = SessionLocal()
+    # فحص محلي (الحروف والطول وحرف التحقق) قبل فتح أي اتصال بقاعدة البيانات
+    if not is_well_formed_code(code_text):
+        return False, "❌ هذا الكود غير صحيح، تأكد من نسخه كما هو تماماً."
+
+    db = current_session()
     try:
-        user, wallet = _get_or_create_user_and_wallet(db, tg_user)
+        user_id, wallet_id, _ = _get_or_create_user_and_wallet(db, tg_user)
 
-        redeem = db.query(RedeemCode).filter(RedeemCode.code == code_text).first()
+        result, points, balance = redeem_code(db, user_id, wallet_id, code_text)
 
-        if not redeem:
+        if result == REDEEM_INVALID:
             return False, "❌ هذا الكود غير صحيح."
 
-        if redeem.is_redeemed:
+        if result == REDEEM_ALREADY_USED:
             return False, "⛔ تم استخدام هذا الكود من قبل."
 
-        points = redeem.points or 0
-        wallet.balance_cents += points
-
-        redeem.is_redeemed = True
-        redeem.redeemed_by_user_id = user.id
-        redeem.redeemed_at = datetime.utcnow()
-
-        db.commit()
-
         return True, (
             f"🎉 تم شحن *{points}* نقطة إلى محفظتك بنجاح.\n"
-            f"🔢 رصيدك الحالي: {wallet.balance_cents} نقطة."
+            f"🔢 رصيدك الحالي: {balance} نقطة."
         )
     except Exception as e:
         db.rollback()
         logger.exception("Redeem code error: %s", e)
         return False, "⚠️ حدث خطأ أثناء معالجة الكود، حاول مرة أخرى لاحقاً."
     finally:
-        db.close()
+        release_connection(db)
 
 
 def handle_redeem_code(update: Update, context: CallbackContext) -> int:
@@ -631,6 +846,15 @@ def handle_redeem_code(update: Update, context: CallbackContext) -> int:
     user = update.effective_user
     text = (update.message.text or "").strip()
 
+    # حد لعدد المحاولات لكل مستخدم قبل أي وصول لقاعدة البيانات
+    if not REDEEM_THROTTLE.try_acquire(user.id):
+        wait_seconds = REDEEM_THROTTLE.retry_after(user.id)
+        update.message.reply_text(
+            "⏳ محاولات كثيرة خلال وقت قصير.\n"
+            f"انتظر {wait_seconds} ثانية ثم أرسل الكود مرة أخرى.",
+        )
+        return STATE_REDEEM_CODE
+
     success, message = redeem_code_logic(user, text)
 
     if success:
@@ -651,14 +875,11 @@ def handle_redeem_code(update: Update, context: CallbackContext) -> int:
 
 def start(update: Update, context: CallbackContext) -> None:
     user = update.effective_user
-    db = SessionLocal()
-    u, w = _get_or_create_user_and_wallet(db, user)
+    _, _, created = _get_or_create_user_and_wallet(current_session(), user)
     welcome_bonus_msg = ""
-    if w.balance_cents == 5:
+    if created:
         welcome_bonus_msg = "🎁 لقد حصلت على *5 نقاط مجانية* هدية ترحيبية!"
 
-
-
     update.message.reply_text(
         "👋 أهلاً بك في بوت مرويات للقصص.\n\n"
         "المميزات المتاحة حالياً:\n"
@@ -710,24 +931,28 @@ def handle_story_genre(update: Update, context: CallbackContext) -> int:
     return STATE_STORY_BRIEF
 
 
-def generate_story_with_openai(brief: str, genre: str, username: str = "") -> str:
-    if client is None:
-        return "❌ خدمة الذكاء الاصطناعي غير مفعّلة حالياً، حاول لاحقاً."
-
+def _story_messages(brief: str, genre: str, username: str) -> list:
     user_prompt = (
         f"نوع القصة المطلوب: {genre}\n\n"
         f"هذه فكرة القصة من المستخدم (@{username}):\n\n"
         f"{brief}\n\n"
         "اكتب قصة كاملة وفق هذه الفكرة وهذا النوع."
     )
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def generate_story_with_openai(brief: str, genre: str, username: str = "") -> str:
+    if not ai_enabled():
+        return "❌ خدمة الذكاء الاصطناعي غير مفعّلة حالياً، حاول لاحقاً."
 
     try:
-        completion = client.chat.completions.create(
+        completion = chat(
+            "story",
+            _story_messages(brief, genre, username),
             model=OPENAI_MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt},
-            ],
             temperature=0.9,
         )
         story = completion.choices[0].message.content.strip()
@@ -737,6 +962,55 @@ def generate_story_with_openai(brief: str, genre: str, username: str = "") -> st
         return "❌ حدث خطأ أثناء الاتصال بخدمة الذكاء الاصطناعي. حاول مرة أخرى لاحقاً."
 
 
+def stream_story_with_openai(brief: str, genre: str, username: str = ""):
+    """مثل generate_story_with_openai لكن يرجع نص القصة قطعةً قطعة أثناء توليده."""
+    yield from chat_stream(
+        "story",
+        _story_messages(brief, genre, username),
+        model=OPENAI_MODEL,
+        temperature=0.9,
+    )
+
+
+def _stream_story_reply(update: Update, context: CallbackContext, brief: str, genre: str, username: str, hold_id: int) -> int:
+    """يعرض القصة في رسالة تُعدَّل أثناء الكتابة، ثم يثبّت الحجز أو يعيده."""
+    live = StreamingMessage(context.bot, update.effective_chat.id)
+    live.start(f"✍️ أكتب الآن قصة من نوع: {genre}...")
+
+    try:
+        for delta in stream_story_with_openai(brief, genre=genre, username=username):
+            live.append(delta)
+    except Exception as e:
+        logger.exception("AI story stream error: %s", e)
+        live.finish(suffix="⚠️ انقطعت الكتابة قبل اكتمال القصة.")
+        release_user_hold(hold_id)
+        update.message.reply_text(
+            "❌ حدث خطأ أثناء الاتصال بخدمة الذكاء الاصطناعي. حاول مرة أخرى لاحقاً.\n"
+            "↩️ تم إعادة النقاط إلى محفظتك.",
+            reply_markup=MAIN_KEYBOARD,
+        )
+        return ConversationHandler.END
+
+    if not live.text.strip():
+        live.finish(suffix="⚠️ لم يصل أي نص من خدمة الذكاء الاصطناعي.")
+        release_user_hold(hold_id)
+        update.message.reply_text(
+            "↩️ تم إعادة النقاط إلى محفظتك، حاول مرة أخرى.",
+            reply_markup=MAIN_KEYBOARD,
+        )
+        return ConversationHandler.END
+
+    live.finish()
+    commit_user_hold(hold_id)
+
+    update.message.reply_text(
+        "🎉 انتهينا! إذا أعجبتك القصة يمكنك حفظها أو مشاركتها.\n"
+        "لإنشاء قصة جديدة استخدم الأمر /write أو الزر من الأسفل.",
+        reply_markup=MAIN_KEYBOARD,
+    )
+    return ConversationHandler.END
+
+
 def receive_story_brief(update: Update, context: CallbackContext) -> int:
     brief = (update.message.text or "").strip()
     genre = context.user_data.get("story_genre", "غير محدد")
@@ -748,9 +1022,13 @@ def receive_story_brief(update: Update, context: CallbackContext) -> int:
     user = update.effective_user
     username = user.username or user.first_name or "قارئ مرويات"
 
-    if not require_and_deduct(update, STORY_COST_POINTS):
+    hold_id = require_and_reserve(update, STORY_COST_POINTS, LedgerReason.STORY)
+    if hold_id is None:
         return ConversationHandler.END
 
+    if STORY_STREAMING and ai_enabled():
+        return _stream_story_reply(update, context, brief, genre, username, hold_id)
+
     update.message.reply_text(
         f"⏳ جميل! سأكتب الآن قصة من نوع: {genre}\n"
         "بناءً على فكرتك... قد يستغرق ذلك بضع ثوانٍ.",
@@ -759,9 +1037,15 @@ def receive_story_brief(update: Update, context: CallbackContext) -> int:
     story_text = generate_story_with_openai(brief, genre=genre, username=username)
 
     if story_text.startswith("❌"):
-        update.message.reply_text(story_text, reply_markup=MAIN_KEYBOARD)
+        release_user_hold(hold_id)
+        update.message.reply_text(
+            story_text + "\n↩️ تم إعادة النقاط إلى محفظتك.",
+            reply_markup=MAIN_KEYBOARD,
+        )
         return ConversationHandler.END
 
+    commit_user_hold(hold_id)
+
     MAX_LEN = 3500
     chunks = wrap(story_text, MAX_LEN, break_long_words=False, replace_whitespace=False)
 
@@ -781,46 +1065,86 @@ def receive_story_brief(update: Update, context: CallbackContext) -> int:
 
 # ====================== مراجعة / نشر قصة ======================
 
-def review_story_with_openai(text: str, username: str = ""):
-    if client is None:
+def review_story_with_openai(text: str, username: str = "", prescreen: PrescreenResult | None = None):
+    # نفس النص الذي عدّه الفحص المحلي (بدون أشكال العرض العربية)
+    text = normalize_text(text)
+    if prescreen is None:
+        prescreen = prescreen_story(text)
+
+    if not ai_enabled():
         return {
             "approved": False,
-            "word_count": len(text.split()),
+            "word_count": prescreen.word_count,
             "title": "",
             "reasons": "خدمة الذكاء الاصطناعي غير مفعّلة حالياً.",
             "suggestions": "",
         }
 
+    cache_key = review_cache_key("story", STORY_REVIEW_VERSION, OPENAI_MODEL, text)
+    cached = get_cached_review(cache_key)
+    if cached is not None:
+        cached["word_count"] = prescreen.word_count
+        return cached
+
     try:
-        completion = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
+        review = chat_structured(
+            "story_review",
+            [
                 {"role": "system", "content": REVIEW_PROMPT},
-                {"role": "user", "content": f"هذه قصة من المستخدم @{username}:\n\n{text}"},
+                {
+                    "role": "user",
+                    "content": f"{prescreen.prompt_facts()}\n\nهذه قصة من المستخدم @{username}:\n\n{text}",
+                },
             ],
+            model=OPENAI_MODEL,
+            result_type=StoryReview,
             temperature=0.3,
         )
-        raw = completion.choices[0].message.content.strip()
-
-        data = json.loads(raw)
-        data.setdefault("approved", False)
-        data.setdefault("word_count", len(text.split()))
-        data.setdefault("title", "")
-        data.setdefault("reasons", "")
-        data.setdefault("suggestions", "")
+        # العدد المحلي أدق من تقدير الموديل
+        review.word_count = prescreen.word_count
+        data = to_dict(review)
+        store_review(cache_key, "story", OPENAI_MODEL, data)
         return data
 
     except Exception as e:
         logger.exception("AI review error: %s", e)
         return {
             "approved": False,
-            "word_count": len(text.split()),
+            "word_count": prescreen.word_count,
             "title": "",
             "reasons": "حدث خطأ أثناء مراجعة القصة بالذكاء الاصطناعي.",
             "suggestions": "",
         }
 
 
+def reply_prescreen_rejection(update: Update, prescreen: PrescreenResult) -> None:
+    """رد فوري على قصة رفضها الفحص المحلي (بدون أي طلب للذكاء الاصطناعي)."""
+    update.message.reply_text(
+        f"📊 عدد كلمات قصتك هو *{prescreen.word_count}* كلمة تقريباً.\n\n"
+        "🚫 النتيجة: *غير جاهزة للنشر حالياً*.\n\n"
+        f"السبب:\n{prescreen.reason}",
+        parse_mode="Markdown",
+        reply_markup=MAIN_KEYBOARD,
+    )
+
+
+def reply_pdf_too_large(update: Update, error: PdfTooLarge) -> None:
+    update.message.reply_text(
+        f"❌ حجم الملف أكبر من المسموح ({error.limit // (1024 * 1024)} ميجابايت).\n"
+        "رجاءً أرسل ملفاً أصغر.",
+        reply_markup=MAIN_KEYBOARD,
+    )
+
+
+def reply_pdf_unreadable(update: Update, error: PdfParseError) -> None:
+    logger.warning("PDF parse error: %s", error)
+    update.message.reply_text(
+        "❌ تعذرت قراءة الملف: إما أنه كبير جداً أو معقد، أو أن الخدمة مشغولة الآن.\n"
+        "جرّب ملفاً أصغر أو أعد المحاولة بعد قليل.",
+        reply_markup=MAIN_KEYBOARD,
+    )
+
+
 def publish_command(update: Update, context: CallbackContext) -> int:
     if update.effective_chat.type != "private":
         update.message.reply_text(
@@ -865,16 +1189,15 @@ def handle_pdf_story(update: Update, context: CallbackContext) -> int:
 
     # ================== قراءة ملف PDF ==================
     try:
-        bio = BytesIO()
-        doc.get_file().download(out=bio)
-        bio.seek(0)
-
-        reader = PyPDF2.PdfReader(bio)
-        full_text = ""
-
-        for page in reader.pages:
-            full_text += (page.extract_text() or "") + "\n"
+        # ما بعد STORY_MAX_CHARS لا يُستخرج: الفحص المحلي يرفض القصة الأطول منه
+        full_text = read_pdf_document(doc, max_chars=STORY_MAX_CHARS).text
 
+    except PdfTooLarge as e:
+        reply_pdf_too_large(update, e)
+        return ConversationHandler.END
+    except PdfParseError as e:
+        reply_pdf_unreadable(update, e)
+        return ConversationHandler.END
     except Exception as e:
         logger.exception("PDF read error: %s", e)
         update.message.reply_text(
@@ -889,8 +1212,14 @@ def handle_pdf_story(update: Update, context: CallbackContext) -> int:
         )
         return ConversationHandler.END
 
+    # ================== فحص محلي قبل المراجعة ==================
+    prescreen = prescreen_story(cleaned_text)
+    if not prescreen.ok:
+        reply_prescreen_rejection(update, prescreen)
+        return ConversationHandler.END
+
     # ================== مراجعة القصة بالذكاء الاصطناعي ==================
-    review = review_story_with_openai(cleaned_text, username=user.username or "")
+    review = review_story_with_openai(cleaned_text, username=user.username or "", prescreen=prescreen)
 
     approved = bool(review.get("approved"))
     word_count = int(review.get("word_count") or len(cleaned_text.split()))
@@ -968,9 +1297,14 @@ def receive_publish_story(update: Update, context: CallbackContext) -> int:
     user = update.effective_user
     username = user.username or user.first_name or "قارئ مرويات"
 
+    prescreen = prescreen_story(text)
+    if not prescreen.ok:
+        reply_prescreen_rejection(update, prescreen)
+        return ConversationHandler.END
+
     update.message.reply_text("🔎 جاري تحليل قصتك والتأكد من جاهزيتها للنشر...")
 
-    review = review_story_with_openai(text, username=username)
+    review = review_story_with_openai(text, username=username, prescreen=prescreen)
     approved = bool(review.get("approved"))
     word_count = int(review.get("word_count") or len(text.split()))
     reasons = review.get("reasons") or ""
@@ -1025,7 +1359,7 @@ def video_command(update: Update, context: CallbackContext) -> int:
 
 
 def refine_video_prompt_with_openai(idea: str, extra_info: str = "", username: str = ""):
-    if client is None:
+    if not ai_enabled():
         return {"status": "error", "error": "No AI client configured."}
 
     user_content = f"فكرة الفيديو من المستخدم @{username}:\n{idea}"
@@ -1033,38 +1367,21 @@ def refine_video_prompt_with_openai(idea: str, extra_info: str = "", username: s
         user_content += f"\n\nمعلومات إضافية:\n{extra_info}"
 
     try:
-        completion = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
+        # الـ schema يفرض أحد الشكلين (ok / need_more) فلا حاجة لتطبيع الصيغ القديمة
+        result = chat_structured(
+            "video_prompt",
+            [
                 {"role": "system", "content": VIDEO_PROMPT_SYSTEM},
                 {"role": "user", "content": user_content},
             ],
+            model=OPENAI_MODEL,
+            result_type=VideoPrompt,
             temperature=0.5,
         )
-        raw = completion.choices[0].message.content.strip()
-
-        try:
-            data = json.loads(raw)
-        except Exception as e:
-            logger.error(f"JSON ERROR: {e}\nRAW RESPONSE:\n{raw}")
-            return {"status": "error", "error": "JSON parse failed"}
-
-        # تطبيع للنسخ القديمة إن رجعت بصيغة مختلفة
-        if "status" not in data:
-            clarity = data.get("clarity")
-            if clarity and clarity != "clear":
-                questions = data.get("missing_details") or []
-                if not questions and data.get("request_for_more_info"):
-                    questions = [data["request_for_more_info"]]
-                return {"status": "need_more", "questions": questions}
-            elif clarity == "clear" and "final_prompt" in data:
-                data["status"] = "ok"
-                return data
-            else:
-                return {"status": "error", "error": "Unexpected JSON schema"}
-
-        return data
+        return to_dict(result)
 
+    except StructuredOutputError:
+        return {"status": "error", "error": "JSON parse failed"}
     except Exception as e:
         logger.exception("AI video prompt error: %s", e)
         return {"status": "error", "error": "حدث خطأ أثناء تحليل فكرة الفيديو."}
@@ -1080,88 +1397,262 @@ def _map_duration_to_runway(seconds: int) -> int:
 
 
 def create_runway_video_generation(prompt: str, duration_seconds: int = 10, aspect_ratio: str = "1280:720"):
-    if not RUNWAY_API_KEY:
+    if runway_client is None:
         return {"ok": False, "error": "Video AI service key is not set."}
 
-    mapped_duration = _map_duration_to_runway(duration_seconds)
-
-    headers = {
-        "Authorization": f"Bearer {RUNWAY_API_KEY}",
-        "Content-Type": "application/json",
-        "X-Runway-Version": RUNWAY_API_VERSION,
-    }
-
-    payload = {
-        "model": RUNWAY_MODEL,
-        "promptText": prompt,
-        "ratio": aspect_ratio,
-        "audio": False,
-        "duration": mapped_duration,
-    }
-
     try:
-        resp = requests.post(RUNWAY_API_URL, headers=headers, json=payload, timeout=30)
-        if resp.status_code >= 400:
-            return {"ok": False, "error": f"Video AI service error: {resp.status_code} {resp.text}"}
-        data = resp.json()
-        return {"ok": True, "data": data}
-    except Exception as e:
-        logger.exception("Video AI API error: %s", e)
+        task = runway_client.create_text_to_video(
+            prompt,
+            model=RUNWAY_MODEL,
+            ratio=aspect_ratio,
+            duration=_map_duration_to_runway(duration_seconds),
+        )
+        return {"ok": True, "data": task.raw}
+    except RunwayError as e:
+        logger.error("Video AI API error: %s", e)
+        if e.status_code is not None:
+            return {"ok": False, "error": str(e)}
         return {"ok": False, "error": "فشل الاتصال بخدمة إنشاء الفيديو بالذكاء الاصطناعي."}
 
 
 def get_runway_task_detail(task_id: str):
-    if not RUNWAY_API_KEY:
+    if runway_client is None:
         return {"ok": False, "error": "Video AI service key is not set."}
 
-    headers = {
-        "Authorization": f"Bearer {RUNWAY_API_KEY}",
-        "X-Runway-Version": RUNWAY_API_VERSION,
-    }
+    try:
+        return {"ok": True, "data": runway_client.get_task(task_id).raw}
+    except RunwayError as e:
+        logger.error("Video task detail error: %s", e)
+        if e.status_code is not None:
+            return {"ok": False, "error": str(e), "status_code": e.status_code}
+        return {"ok": False, "error": "فشل جلب حالة مهمة إنشاء الفيديو."}
+
+
+# المهام المعلّقة: task_id -> معلومات المتابعة (المحادثة، موعد الاستعلام القادم...)
+_pending_runway_tasks: dict[str, dict] = {}
+_pending_runway_tasks_lock = threading.Lock()
 
-    url = f"{RUNWAY_TASKS_URL.rstrip('/')}/{task_id}"
 
+def track_runway_task(
+    task_id: str,
+    chat_id: int,
+    hold_id: int | None = None,
+    created_at: float | None = None,
+) -> None:
+    """
+    تسجيل مهمة فيديو ليتابعها الـ poller ويرسل نتيجتها إلى chat_id.
+    created_at يُمرَّر عند استئناف مهمة بعد إعادة التشغيل حتى تُحسب مهلتها من بدايتها الفعلية.
+    """
+    now = time.time()
+    with _pending_runway_tasks_lock:
+        _pending_runway_tasks[task_id] = {
+            "task_id": task_id,
+            "chat_id": chat_id,
+            "hold_id": hold_id,
+            "created_at": created_at or now,
+            "next_poll_at": now + RUNWAY_POLL_MIN_INTERVAL,
+            "interval": RUNWAY_POLL_MIN_INTERVAL,
+            "failures": 0,
+        }
+
+
+def attach_runway_task_to_hold(hold_id: int, task_id: str) -> bool:
+    """حفظ رقم مهمة الفيديو في حجزها (wallet_holds.ref) حتى تُستأنف متابعتها بعد إعادة التشغيل."""
+    db = current_session()
     try:
-        resp = requests.get(url, headers=headers, timeout=30)
-        if resp.status_code >= 400:
-            return {
-                "ok": False,
-                "error": f"Video task detail error: {resp.status_code} {resp.text}",
-                "status_code": resp.status_code,
-            }
-        return {"ok": True, "data": resp.json()}
+        return set_hold_ref(db, hold_id, task_id)
     except Exception as e:
-        logger.exception("Video task detail error: %s", e)
-        return {"ok": False, "error": "فشل جلب حالة مهمة إنشاء الفيديو."}
+        # المتابعة في الذاكرة تعمل؛ فقط لن تُستأنف بعد إعادة التشغيل (والـ sweeper يعيد النقاط)
+        logger.exception("attach_runway_task_to_hold error (%s): %s", hold_id, e)
+        db.rollback()
+        return False
+    finally:
+        release_connection(db)
+
 
+def restore_runway_tasks_job(context: CallbackContext) -> None:
+    """
+    Job عند بدء التشغيل: يستأنف متابعة مهام الفيديو التي ما زال حجزها نشطاً،
+    فلا يضيع فيديو أكملته الخدمة أثناء إعادة النشر أو إعادة التشغيل.
+    الفيديو يُطلب من الخاص فقط، فالمحادثة هي telegram_id صاحب المحفظة.
+    """
+    db = current_session()
+    try:
+        holds = list_open_holds_with_ref(db, LedgerReason.VIDEO)
+    except Exception as e:
+        logger.exception("Restore video tasks error: %s", e)
+        db.rollback()
+        return
+    finally:
+        release_connection(db)
+
+    for hold in holds:
+        track_runway_task(
+            hold.ref,
+            hold.telegram_id,
+            hold_id=hold.hold_id,
+            created_at=hold.created_at.replace(tzinfo=timezone.utc).timestamp(),
+        )
+    if holds:
+        logger.info("Resumed tracking %d video tasks", len(holds))
+
+
+def _next_runway_poll_interval(task: dict, data: dict) -> float:
+    """
+    فترة الاستعلام القادمة لكل مهمة على حدة:
+    - إذا أعادت الخدمة progress نقدّر الوقت المتبقي ونستعلم قرب نهايته.
+    - وإلا نزيد الفترة تدريجياً (backoff) حتى الحد الأعلى.
+    """
+    interval = task["interval"] * 1.5
+
+    progress = data.get("progress") if isinstance(data, dict) else None
+    if isinstance(progress, (int, float)) and 0 < progress < 1:
+        elapsed = time.time() - task["created_at"]
+        remaining = elapsed * (1 - progress) / progress
+        interval = remaining / 2
+
+    return min(max(interval, RUNWAY_POLL_MIN_INTERVAL), RUNWAY_POLL_MAX_INTERVAL)
 
-def wait_for_runway_task(task_id: str, max_wait: int = 60, poll_interval: int = 6):
-    start = time.time()
-    last_data = None
-    while time.time() - start < max_wait:
-        result = get_runway_task_detail(task_id)
+
+def poll_runway_tasks(context: CallbackContext) -> None:
+    """
+    Job دوري على JobQueue: يستعلم فقط عن المهام التي حان موعدها،
+    ويرسل الفيديو للمحادثة الصحيحة عند انتهاء المهمة.
+    """
+    now = time.time()
+    with _pending_runway_tasks_lock:
+        due = [t for t in _pending_runway_tasks.values() if t["next_poll_at"] <= now]
+
+    for task in due:
+        task_id = task["task_id"]
+        timed_out = time.time() - task["created_at"] > RUNWAY_TASK_MAX_WAIT
+
+        result = get_task_status(task_id, get_runway_task_detail)
         if not result.get("ok"):
-            return result
+            task["failures"] += 1
+            if result.get("status_code") == 404 or timed_out or task["failures"] >= 5:
+                _forget_runway_task(task_id)
+                _settle_runway_hold(task, succeeded=False)
+                _notify_runway_unknown(context.bot, task, result.get("error"))
+            else:
+                task["interval"] = min(task["interval"] * 2, RUNWAY_POLL_MAX_INTERVAL)
+                task["next_poll_at"] = time.time() + task["interval"]
+            continue
 
-        data = result["data"]
-        last_data = data
+        data = result.get("data") or {}
         status = str(data.get("status", "")).upper()
+        task["failures"] = 0
 
-        if status in ("SUCCEEDED", "FAILED", "ABORTED", "CANCELED", "CANCELLED"):
-            return {
-                "ok": status == "SUCCEEDED",
-                "status": status,
-                "data": data,
-            }
+        if status in RUNWAY_TERMINAL_STATUSES:
+            _forget_runway_task(task_id)
+            _settle_runway_hold(task, succeeded=status == "SUCCEEDED")
+            try:
+                deliver_runway_result(context.bot, task["chat_id"], task_id, status, data)
+            except Exception as e:
+                logger.exception("Deliver video result error (%s): %s", task_id, e)
+        elif timed_out:
+            _forget_runway_task(task_id)
+            _settle_runway_hold(task, succeeded=False)
+            _notify_runway_unknown(context.bot, task, None, status=status)
+        else:
+            task["interval"] = _next_runway_poll_interval(task, data)
+            task["next_poll_at"] = time.time() + task["interval"]
+
+
+def _forget_runway_task(task_id: str) -> None:
+    with _pending_runway_tasks_lock:
+        _pending_runway_tasks.pop(task_id, None)
+
+
+def _settle_runway_hold(task: dict, succeeded: bool) -> None:
+    """تثبيت نقاط الفيديو عند النجاح، وإعادتها عند الفشل أو انتهاء المهلة."""
+    hold_id = task.get("hold_id")
+    if hold_id is None:
+        return
+    if succeeded:
+        commit_user_hold(hold_id, ref=task["task_id"])
+    else:
+        release_user_hold(hold_id)
+
+
+def _notify_runway_unknown(bot, task: dict, error, status: str = "") -> None:
+    if status:
+        msg = (
+            f"ℹ️ حالة مهمة الفيديو `{task['task_id']}` ما زالت: *{status}*.\n"
+            "قد تستمر المعالجة، استخدم /video_status لاحقاً مع رقم الطلب."
+        )
+    else:
+        msg = (
+            f"⚠️ لم أستطع التأكد من انتهاء مهمة الفيديو `{task['task_id']}`.\n"
+            "استخدم /video_status لاحقاً مع رقم الطلب."
+        )
+    if task.get("hold_id") is not None:
+        msg += "\n↩️ تم إعادة النقاط المحجوزة إلى محفظتك."
+    if error:
+        logger.warning("Runway poll gave up on %s: %s", task["task_id"], error)
+
+    try:
+        bot.send_message(
+            chat_id=task["chat_id"],
+            text=msg,
+            parse_mode="Markdown",
+            reply_markup=MAIN_KEYBOARD,
+        )
+    except Exception as e:
+        logger.exception("Telegram send_message (video poller) error: %s", e)
+
+
+def deliver_runway_result(bot, chat_id: int, task_id: str, status: str, task_data: dict) -> None:
+    """إرسال نتيجة مهمة فيديو منتهية إلى المستخدم."""
+    if status != "SUCCEEDED":
+        bot.send_message(
+            chat_id=chat_id,
+            text=(
+                f"❌ فشلت مهمة إنشاء الفيديو `{task_id}`.\n"
+                f"📌 الحالة: *{status}*\n"
+                "↩️ تم إعادة النقاط المحجوزة إلى محفظتك."
+            ),
+            parse_mode="Markdown",
+            reply_markup=MAIN_KEYBOARD,
+        )
+        return
 
-        time.sleep(poll_interval)
+    video_url = extract_runway_video_url(task_data)
 
-    return {
-        "ok": False,
-        "status": str(last_data.get("status")) if isinstance(last_data, dict) else "UNKNOWN",
-        "data": last_data,
-        "error": "TIMEOUT",
-    }
+    if video_url:
+        try:
+            bot.send_message(
+                chat_id=chat_id,
+                text="🎉 تم إنشاء الفيديو بالذكاء الاصطناعي! سأرسله لك الآن...",
+            )
+            bot.send_video(
+                chat_id=chat_id,
+                video=video_url,
+                caption="🎬 الفيديو الناتج من خدمة إنشاء الفيديو بالذكاء الاصطناعي.",
+                reply_markup=MAIN_KEYBOARD,
+            )
+        except Exception as e:
+            logger.exception("Telegram send_video error: %s", e)
+            bot.send_message(
+                chat_id=chat_id,
+                text=(
+                    "🎬 تم إنشاء الفيديو، لكن تعذر إرساله كملف على تيليجرام.\n"
+                    f"هذا رابط الفيديو:\n{video_url}"
+                ),
+                reply_markup=MAIN_KEYBOARD,
+            )
+    else:
+        pretty = json.dumps(task_data, ensure_ascii=False, indent=2)
+        bot.send_message(
+            chat_id=chat_id,
+            text=(
+                "✅ المهمة انتهت بنجاح في خدمة إنشاء الفيديو، لكن لم أستطع العثور على رابط الفيديو بشكل واضح.\n"
+                "هذا الردّ القادم من خدمة الذكاء الاصطناعي:\n"
+                f"```json\n{pretty}\n```"
+            ),
+            parse_mode="Markdown",
+            reply_markup=MAIN_KEYBOARD,
+        )
 
 
 def extract_runway_video_url(task_data: dict):
@@ -1219,6 +1710,7 @@ def send_runway_request_and_reply(
     final_prompt: str,
     duration_seconds: int,
     aspect_ratio: str,
+    hold_id: int,
 ):
     runway_resp = create_runway_video_generation(
         prompt=final_prompt,
@@ -1227,8 +1719,10 @@ def send_runway_request_and_reply(
     )
 
     if not runway_resp.get("ok"):
+        release_user_hold(hold_id)
         update.message.reply_text(
-            f"⚠️ تم تجهيز برومبت الفيديو، لكن حدث خطأ عند الإرسال إلى خدمة إنشاء الفيديو بالذكاء الاصطناعي:\n{runway_resp.get('error')}",
+            f"⚠️ تم تجهيز برومبت الفيديو، لكن حدث خطأ عند الإرسال إلى خدمة إنشاء الفيديو بالذكاء الاصطناعي:\n{runway_resp.get('error')}\n"
+            "↩️ تم إعادة النقاط إلى محفظتك.",
             reply_markup=MAIN_KEYBOARD,
         )
         return
@@ -1242,52 +1736,24 @@ def send_runway_request_and_reply(
         parse_mode="Markdown",
     )
 
-    update.message.reply_text("⏳ جاري متابعة حالة مهمة إنشاء الفيديو، انتظر قليلاً...")
-
-    wait_result = wait_for_runway_task(gen_id, max_wait=60, poll_interval=6)
-
-    if not wait_result.get("ok"):
-        status = wait_result.get("status")
-        if status:
-            msg = (
-                f"ℹ️ حالة المهمة الحالية في خدمة إنشاء الفيديو: *{status}*.\n"
-                "قد تستمر المعالجة هناك، يمكنك متابعة التقدم من لوحة الخدمة باستخدام رقم الطلب."
-            )
-            update.message.reply_text(msg, parse_mode="Markdown", reply_markup=MAIN_KEYBOARD)
-        else:
-            update.message.reply_text(
-                "⚠️ لم أستطع التأكد من انتهاء مهمة إنشاء الفيديو الآن.",
-                reply_markup=MAIN_KEYBOARD,
-            )
-        return
-
-    task_data = wait_result.get("data") or {}
-    video_url = extract_runway_video_url(task_data)
-
-    if video_url:
-        try:
-            update.message.reply_text("🎉 تم إنشاء الفيديو بالذكاء الاصطناعي! سأرسله لك الآن...")
-            context.bot.send_video(
-                chat_id=update.effective_chat.id,
-                video=video_url,
-                caption="🎬 الفيديو الناتج من خدمة إنشاء الفيديو بالذكاء الاصطناعي.",
-            )
-        except Exception as e:
-            logger.exception("Telegram send_video error: %s", e)
-            update.message.reply_text(
-                "🎬 تم إنشاء الفيديو، لكن تعذر إرساله كملف على تيليجرام.\n"
-                f"هذا رابط الفيديو:\n{video_url}",
-                reply_markup=MAIN_KEYBOARD,
-            )
-    else:
-        pretty = json.dumps(task_data, ensure_ascii=False, indent=2)
+    if gen_id == "غير معروف":
+        release_user_hold(hold_id)
         update.message.reply_text(
-            "✅ المهمة انتهت بنجاح في خدمة إنشاء الفيديو، لكن لم أستطع العثور على رابط الفيديو بشكل واضح.\n"
-            "هذا الردّ القادم من خدمة الذكاء الاصطناعي:\n"
-            f"```json\n{pretty}\n```",
-            parse_mode="Markdown",
+            "⚠️ لم أستطع متابعة الطلب لعدم وجود رقم له، تم إعادة النقاط إلى محفظتك.",
             reply_markup=MAIN_KEYBOARD,
         )
+        return
+
+    # لا ننتظر داخل الـ handler: الـ poller في الخلفية سيرسل الفيديو عند جاهزيته
+    # ويثبّت الحجز عند النجاح أو يعيده عند الفشل / انتهاء المهلة
+    attach_runway_task_to_hold(hold_id, gen_id)
+    track_runway_task(gen_id, update.effective_chat.id, hold_id=hold_id)
+
+    update.message.reply_text(
+        "⏳ جاري إنشاء الفيديو، سأرسله لك هنا فور جاهزيته.\n"
+        "يمكنك أيضاً متابعة حالته عبر /video_status ورقم الطلب.",
+        reply_markup=MAIN_KEYBOARD,
+    )
 
 
 def handle_video_idea(update: Update, context: CallbackContext) -> int:
@@ -1368,7 +1834,7 @@ def handle_video_duration(update: Update, context: CallbackContext) -> int:
 
     if status == "ok":
         final_prompt = result.get("final_prompt", "")
-        duration_seconds = int(result.get("duration_seconds", seconds))
+        duration_seconds = int(result.get("duration_seconds") or seconds)
         aspect_ratio = "1280:720"
 
         if not final_prompt:
@@ -1379,7 +1845,10 @@ def handle_video_duration(update: Update, context: CallbackContext) -> int:
             return ConversationHandler.END
 
         needed_points = get_video_cost_points(duration_seconds)
-        if not require_and_deduct(update, needed_points):
+        hold_id = require_and_reserve(
+            update, needed_points, LedgerReason.VIDEO, ttl_seconds=VIDEO_HOLD_TTL_SECONDS
+        )
+        if hold_id is None:
             return ConversationHandler.END
 
         update.message.reply_text(
@@ -1393,6 +1862,7 @@ def handle_video_duration(update: Update, context: CallbackContext) -> int:
             final_prompt=final_prompt,
             duration_seconds=duration_seconds,
             aspect_ratio=aspect_ratio,
+            hold_id=hold_id,
         )
 
         return ConversationHandler.END
@@ -1486,7 +1956,7 @@ def handle_video_clarify(update: Update, context: CallbackContext) -> int:
 
     # ================== استخراج البيانات النهائية ==================
     final_prompt = (result.get("final_prompt") or "").strip()
-    duration_seconds = int(result.get("duration_seconds", seconds))
+    duration_seconds = int(result.get("duration_seconds") or seconds)
     aspect_ratio = "1280:720"
 
     if not final_prompt:
@@ -1499,7 +1969,10 @@ def handle_video_clarify(update: Update, context: CallbackContext) -> int:
 
     # ================== خصم النقاط ==================
     needed_points = get_video_cost_points(duration_seconds)
-    if not require_and_deduct(update, needed_points):
+    hold_id = require_and_reserve(
+        update, needed_points, LedgerReason.VIDEO, ttl_seconds=VIDEO_HOLD_TTL_SECONDS
+    )
+    if hold_id is None:
         return ConversationHandler.END
 
     update.message.reply_text(
@@ -1514,6 +1987,7 @@ def handle_video_clarify(update: Update, context: CallbackContext) -> int:
         final_prompt=final_prompt,
         duration_seconds=duration_seconds,
         aspect_ratio=aspect_ratio,
+        hold_id=hold_id,
     )
 
     return ConversationHandler.END
@@ -1549,7 +2023,7 @@ def handle_video_status(update: Update, context: CallbackContext) -> int:
         parse_mode="Markdown",
     )
 
-    result = get_runway_task_detail(task_id)
+    result = get_task_status(task_id, get_runway_task_detail)
     if not result.get("ok"):
         update.message.reply_text(
             f"⚠️ حدث خطأ أثناء جلب حالة الطلب من خدمة إنشاء الفيديو:\n{result.get('error')}",
@@ -1632,16 +2106,17 @@ def image_command(update: Update, context: CallbackContext) -> int:
 
 
 def generate_image_prompt_with_openai(description: str) -> str:
-    if client is None:
+    if not ai_enabled():
         return ""
 
     try:
-        completion = client.chat.completions.create(
-            model=OPENAI_MODEL,
-            messages=[
+        completion = chat(
+            "image_prompt",
+            [
                 {"role": "system", "content": IMAGE_PROMPT_SYSTEM},
                 {"role": "user", "content": description},
             ],
+            model=OPENAI_MODEL,
             temperature=0.7,
         )
         prompt = completion.choices[0].message.content.strip()
@@ -1657,7 +2132,8 @@ def handle_image_prompt(update: Update, context: CallbackContext) -> int:
         update.message.reply_text("❗ لم أستطع قراءة وصف الصورة، أعد كتابته من فضلك.")
         return STATE_IMAGE_PROMPT
 
-    if not require_and_deduct(update, IMAGE_COST_POINTS):
+    hold_id = require_and_reserve(update, IMAGE_COST_POINTS, LedgerReason.IMAGE)
+    if hold_id is None:
         return ConversationHandler.END
 
     update.message.reply_text(
@@ -1666,14 +2142,17 @@ def handle_image_prompt(update: Update, context: CallbackContext) -> int:
 
     refined_prompt = generate_image_prompt_with_openai(desc)
     if not refined_prompt:
+        release_user_hold(hold_id)
         update.message.reply_text(
-            "❌ حدث خطأ أثناء تجهيز برومبت الصورة. حاول مرة أخرى.",
+            "❌ حدث خطأ أثناء تجهيز برومبت الصورة. حاول مرة أخرى.\n"
+            "تم إعادة النقاط إلى محفظتك.",
             reply_markup=MAIN_KEYBOARD,
         )
         return ConversationHandler.END
 
     try:
-        img_resp = client.images.generate(
+        img_resp = generate_image(
+            "image",
             model="gpt-image-1",
             prompt=refined_prompt,
             size="1024x1024",
@@ -1697,6 +2176,7 @@ def handle_image_prompt(update: Update, context: CallbackContext) -> int:
                 ),
                 reply_markup=MAIN_KEYBOARD,
             )
+            commit_user_hold(hold_id)
             return ConversationHandler.END
 
         # ================== دعم URL (إن وُجد) ==================
@@ -1708,21 +2188,22 @@ def handle_image_prompt(update: Update, context: CallbackContext) -> int:
                 ),
                 reply_markup=MAIN_KEYBOARD,
             )
+            commit_user_hold(hold_id)
             return ConversationHandler.END
 
         raise RuntimeError("No image data returned")
 
     except Exception as e:
         logger.exception("AI image generation error: %s", e)
+
+        # ⛑ إعادة النقاط المحجوزة
+        release_user_hold(hold_id)
+
         update.message.reply_text(
             "❌ حدث خطأ أثناء توليد الصورة.\n"
             "تم إعادة النقاط إلى محفظتك.",
             reply_markup=MAIN_KEYBOARD,
         )
-
-        # ⛑ إعادة النقاط
-        add_user_points(get_user_id(update), IMAGE_COST_POINTS)
-
         return ConversationHandler.END
 
 # =============== /cancel ===============
@@ -1737,43 +2218,47 @@ def cancel(update: Update, context: CallbackContext) -> int:
 
 # =============== main ===============
 
-def main() -> None:
+def build_updater() -> Updater:
+    """
+    ينشئ Updater مع كل الـ handlers ومهام الخلفية بدون تشغيله.
+    main() تشغّله بـ polling، و main.py (FastAPI) تشغّله بـ webhook عبر start_webhook_mode.
+    """
     updater = Updater(BOT_TOKEN, use_context=True)
     dp = updater.dispatcher
 
     # ================== أوامر أساسية ==================
-    dp.add_handler(CommandHandler("start", start))
-    dp.add_handler(CommandHandler("pricing", pricing_command))
-    dp.add_handler(CommandHandler("wallet", wallet_command))
-    dp.add_handler(CommandHandler("myid", myid_command))
-    dp.add_handler(CommandHandler("id", myid_command))
+    dp.add_handler(CommandHandler("start", run_in_lane("fast", start)))
+    dp.add_handler(CommandHandler("pricing", run_in_lane("fast", pricing_command)))
+    dp.add_handler(CommandHandler("wallet", run_in_lane("fast", wallet_command)))
+    dp.add_handler(CommandHandler("myid", run_in_lane("fast", myid_command)))
+    dp.add_handler(CommandHandler("id", run_in_lane("fast", myid_command)))
 
     # ================== أزرار المحفظة والأسعار ==================
     dp.add_handler(
-        MessageHandler(Filters.regex("^💳 المحفظة / الشحن$"), wallet_command)
+        MessageHandler(Filters.regex("^💳 المحفظة / الشحن$"), run_in_lane("fast", wallet_command))
     )
     dp.add_handler(
-        MessageHandler(Filters.regex("^💰 الأسعار والنقاط$"), pricing_command)
+        MessageHandler(Filters.regex("^💰 الأسعار والنقاط$"), run_in_lane("fast", pricing_command))
     )
 
     # ================== كتابة قصة ==================
     story_conv = ConversationHandler(
         entry_points=[
-            CommandHandler("write", write_command),
+            CommandHandler("write", run_in_lane("fast", write_command)),
             MessageHandler(
                 Filters.regex("^✍️ كتابة قصة بالذكاء الاصطناعي$"),
-                write_command,
+                run_in_lane("fast", write_command),
             ),
         ],
         states={
             STATE_STORY_GENRE: [
-                MessageHandler(Filters.text & ~Filters.command, handle_story_genre)
+                MessageHandler(Filters.text & ~Filters.command, run_in_lane("fast", handle_story_genre))
             ],
             STATE_STORY_BRIEF: [
-                MessageHandler(Filters.text & ~Filters.command, receive_story_brief)
+                MessageHandler(Filters.text & ~Filters.command, run_in_lane("story", receive_story_brief))
             ],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", run_in_lane("fast", cancel))],
         allow_reentry=True,
     )
     dp.add_handler(story_conv)
@@ -1781,19 +2266,19 @@ def main() -> None:
     # ================== نشر قصة ==================
     publish_conv = ConversationHandler(
         entry_points=[
-            CommandHandler("publish", publish_command),
+            CommandHandler("publish", run_in_lane("fast", publish_command)),
             MessageHandler(
                 Filters.regex("^📤 نشر قصة من كتابتك$"),
-                publish_command,
+                run_in_lane("fast", publish_command),
             ),
         ],
         states={
             STATE_PUBLISH_STORY: [
-                MessageHandler(Filters.document.pdf, handle_pdf_story),
-                MessageHandler(Filters.text & ~Filters.command, receive_publish_story),
+                MessageHandler(Filters.document.pdf, run_in_lane("pdf", handle_pdf_story)),
+                MessageHandler(Filters.text & ~Filters.command, run_in_lane("story", receive_publish_story)),
             ],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", run_in_lane("fast", cancel))],
         allow_reentry=True,
     )
     dp.add_handler(publish_conv)
@@ -1801,24 +2286,24 @@ def main() -> None:
     # ================== فيديو ==================
     video_conv = ConversationHandler(
         entry_points=[
-            CommandHandler("video", video_command),
+            CommandHandler("video", run_in_lane("fast", video_command)),
             MessageHandler(
                 Filters.regex("^🎬 إنتاج فيديو بالذكاء الاصطناعي$"),
-                video_command,
+                run_in_lane("fast", video_command),
             ),
         ],
         states={
             STATE_VIDEO_IDEA: [
-                MessageHandler(Filters.text & ~Filters.command, handle_video_idea)
+                MessageHandler(Filters.text & ~Filters.command, run_in_lane("fast", handle_video_idea))
             ],
             STATE_VIDEO_DURATION: [
-                MessageHandler(Filters.text & ~Filters.command, handle_video_duration)
+                MessageHandler(Filters.text & ~Filters.command, run_in_lane("media", handle_video_duration, cost=VIDEO_JOB_COST))
             ],
             STATE_VIDEO_CLARIFY: [
-                MessageHandler(Filters.text & ~Filters.command, handle_video_clarify)
+                MessageHandler(Filters.text & ~Filters.command, run_in_lane("media", handle_video_clarify, cost=VIDEO_JOB_COST))
             ],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", run_in_lane("fast", cancel))],
         allow_reentry=True,
     )
     dp.add_handler(video_conv)
@@ -1826,18 +2311,18 @@ def main() -> None:
     # ================== حالة فيديو ==================
     video_status_conv = ConversationHandler(
         entry_points=[
-            CommandHandler("video_status", video_status_command),
+            CommandHandler("video_status", run_in_lane("fast", video_status_command)),
             MessageHandler(
                 Filters.regex("^📥 استعلام عن فيديو سابق$"),
-                video_status_command,
+                run_in_lane("fast", video_status_command),
             ),
         ],
         states={
             STATE_VIDEO_STATUS_ID: [
-                MessageHandler(Filters.text & ~Filters.command, handle_video_status)
+                MessageHandler(Filters.text & ~Filters.command, run_in_lane("media", handle_video_status))
             ],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", run_in_lane("fast", cancel))],
         allow_reentry=True,
     )
     dp.add_handler(video_status_conv)
@@ -1845,18 +2330,18 @@ def main() -> None:
     # ================== صورة ==================
     image_conv = ConversationHandler(
         entry_points=[
-            CommandHandler("image", image_command),
+            CommandHandler("image", run_in_lane("fast", image_command)),
             MessageHandler(
                 Filters.regex("^🖼 إنشاء صورة بالذكاء الاصطناعي$"),
-                image_command,
+                run_in_lane("fast", image_command),
             ),
         ],
         states={
             STATE_IMAGE_PROMPT: [
-                MessageHandler(Filters.text & ~Filters.command, handle_image_prompt)
+                MessageHandler(Filters.text & ~Filters.command, run_in_lane("media", handle_image_prompt, cost=IMAGE_JOB_COST))
             ],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", run_in_lane("fast", cancel))],
         allow_reentry=True,
     )
     dp.add_handler(image_conv)
@@ -1864,18 +2349,18 @@ def main() -> None:
     # ================== شحن برمز من سلة ==================
     redeem_conv = ConversationHandler(
         entry_points=[
-            CommandHandler("redeem", redeem_command),
+            CommandHandler("redeem", run_in_lane("fast", redeem_command)),
             MessageHandler(
                 Filters.regex("^(🎟 )?شحن برمز من سلة$"),
-                redeem_command,
+                run_in_lane("fast", redeem_command),
             ),
         ],
         states={
             STATE_REDEEM_CODE: [
-                MessageHandler(Filters.text & ~Filters.command, handle_redeem_code)
+                MessageHandler(Filters.text & ~Filters.command, run_in_lane("fast", handle_redeem_code))
             ],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", run_in_lane("fast", cancel))],
         allow_reentry=True,
     )
     dp.add_handler(redeem_conv)
@@ -1883,15 +2368,15 @@ def main() -> None:
     # ================== رفع مقال PDF (المهم) ==================
     article_conv = ConversationHandler(
         entry_points=[
-            CommandHandler("article", article_command),
+            CommandHandler("article", run_in_lane("fast", article_command)),
             MessageHandler(
                 Filters.regex("^📝 رفع مقال PDF$"),
-                article_command,
+                run_in_lane("fast", article_command),
             ),
         ],
         states={
             STATE_ARTICLE_PDF: [
-                MessageHandler(Filters.document.pdf, handle_article_pdf),
+                MessageHandler(Filters.document.pdf, run_in_lane("pdf", handle_article_pdf)),
                 MessageHandler(
                     Filters.all & ~Filters.document.pdf,
                     lambda u, c: u.message.reply_text(
@@ -1900,12 +2385,89 @@ def main() -> None:
                 ),
             ],
         },
-        fallbacks=[CommandHandler("cancel", cancel)],
+        fallbacks=[CommandHandler("cancel", run_in_lane("fast", cancel))],
         allow_reentry=True,
     )
     dp.add_handler(article_conv)
 
+    # ================== مهام الخلفية (JobQueue) ==================
+    # كل تشغيل لـ Job له session_scope خاص مثل handlers المسارات
+    updater.job_queue.run_once(
+        with_session_scope(restore_runway_tasks_job),
+        when=0,
+        name="runway_restore",
+    )
+    updater.job_queue.run_repeating(
+        with_session_scope(poll_runway_tasks),
+        interval=RUNWAY_POLL_TICK_SECONDS,
+        first=RUNWAY_POLL_TICK_SECONDS,
+        name="runway_poller",
+    )
+    updater.job_queue.run_repeating(
+        with_session_scope(expire_holds_job),
+        interval=WALLET_HOLD_SWEEP_INTERVAL,
+        first=30,
+        name="wallet_hold_sweeper",
+    )
+    updater.job_queue.run_repeating(
+        with_session_scope(reconcile_wallets_job),
+        interval=LEDGER_RECONCILE_INTERVAL,
+        first=60,
+        name="ledger_reconcile",
+    )
+
+    updater.job_queue.run_repeating(
+        with_session_scope(purge_review_cache_job),
+        interval=REVIEW_CACHE_PURGE_INTERVAL,
+        first=120,
+        name="review_cache_purge",
+    )
+    updater.job_queue.run_repeating(
+        purge_pdf_cache_job,
+        interval=PDF_CACHE_PURGE_INTERVAL,
+        first=180,
+        name="pdf_cache_purge",
+    )
+
+    return updater
+
+
+def start_webhook_mode(updater: Updater, webhook_url: str, secret_token: str) -> None:
+    """
+    تشغيل الـ dispatcher و JobQueue بدون polling، وتسجيل رابط الـ webhook عند تيليجرام.
+    التحديثات تصل من main.py إلى updater.dispatcher.update_queue.
+    """
+    # نفس ما يفعله Updater.start_webhook لكن بدون خادم HTTP خاص به
+    updater.job_queue.start()
+    ready = threading.Event()
+    threading.Thread(
+        target=updater.dispatcher.start,
+        kwargs={"ready": ready},
+        name="bot-dispatcher",
+        daemon=True,
+    ).start()
+    # إذا فشل تشغيل الـ dispatcher (مثلاً getMe بدون شبكة) لا نترك بدء تشغيل التطبيق معلّقاً
+    if not ready.wait(30):
+        updater.job_queue.stop()
+        raise RuntimeError("Telegram dispatcher did not start")
+
+    updater.bot.set_webhook(url=webhook_url, secret_token=secret_token)
+    logger.info("Telegram webhook set: %s", webhook_url.rsplit("/", 1)[0] + "/***")
+
+
+def stop_webhook_mode(updater: Updater) -> None:
+    # لا نحذف الـ webhook هنا: عند إعادة النشر تحتفظ تيليجرام بالتحديثات حتى تعود الخدمة
+    updater.stop()
+
+
+def main() -> None:
+    """وضع polling للتطوير المحلي (يحذف أي webhook مسجّل تلقائياً)."""
+    updater = build_updater()
+
     # ================== تشغيل البوت ==================
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT)
+
     updater.start_polling()
     updater.idle()
 
@@ -0,0 +1,76 @@
+# code_format.py
+"""
+صيغة أكواد الشحن.
+
+الأكواد الجديدة: 11 حرفاً عشوائياً + حرف تحقق (Luhn mod 36) = 12 حرفاً.
+حرف التحقق يكشف أي خطأ في حرف واحد ومعظم حالات تبديل حرفين متجاورين،
+فنرفض الكود الخاطئ محلياً بدون أي اتصال بقاعدة البيانات.
+
+الأكواد القديمة (10 أحرف بدون تحقق) تبقى مقبولة وتُتحقق منها قاعدة البيانات فقط.
+"""
+import os
+import string
+
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+CODE_BODY_LENGTH = 11
+CODE_LENGTH = CODE_BODY_LENGTH + 1
+
+# أطوال الأكواد القديمة المخزنة في redeem_codes (بدون حرف تحقق)
+LEGACY_CODE_LENGTHS = {
+    int(x) for x in os.environ.get("LEGACY_REDEEM_CODE_LENGTHS", "10").split(",") if x.strip()
+}
+
+# بادئات قد يلصقها المستخدم مع الكود
+CODE_PREFIXES = ["MRW-100-", "MRW-50-", "MRW-500-", "MRW-1100-", "MRW-"]
+
+_CHAR_VALUE = {c: i for i, c in enumerate(CODE_ALPHABET)}
+_N = len(CODE_ALPHABET)
+# قيمة الحرف بعد المضاعفة وجمع "خانتيه" في الأساس 36 (خطوة Luhn)
+_DOUBLED = [(2 * v) // _N + (2 * v) % _N for v in range(_N)]
+
+
+def luhn36_check_char(body: str) -> str:
+    """حساب حرف التحقق (Luhn mod N) لجسم الكود."""
+    total = 0
+    double = True
+    for ch in reversed(body):
+        v = _CHAR_VALUE[ch]
+        total += _DOUBLED[v] if double else v
+        double = not double
+    return CODE_ALPHABET[(_N - total % _N) % _N]
+
+
+def add_check_char(body: str) -> str:
+    return body + luhn36_check_char(body)
+
+
+def has_valid_check_char(code: str) -> bool:
+    total = 0
+    double = False
+    for ch in reversed(code):
+        v = _CHAR_VALUE[ch]
+        total += _DOUBLED[v] if double else v
+        double = not double
+    return total % _N == 0
+
+
+def normalize_code(raw_text: str) -> str:
+    """تنظيف الكود كما أرسله المستخدم: مسافات، حروف صغيرة، وبادئات MRW-."""
+    code_text = (raw_text or "").strip().upper()
+    for p in CODE_PREFIXES:
+        if code_text.startswith(p):
+            code_text = code_text[len(p):]
+            break
+    return code_text
+
+
+def is_well_formed_code(code: str) -> bool:
+    """
+    فحص محلي بالكامل: الحروف المسموحة والطول، وحرف التحقق للأكواد الجديدة.
+    False يعني أن الكود خاطئ حتماً ولا داعي لسؤال قاعدة البيانات.
+    """
+    if not code or any(ch not in _CHAR_VALUE for ch in code):
+        return False
+    if len(code) == CODE_LENGTH:
+        return has_valid_check_char(code)
+    return len(code) in LEGACY_CODE_LENGTHS
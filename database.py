@@ -1,8 +1,16 @@
 # database.py
+import functools
+import logging
 import os
+import threading
+from contextlib import contextmanager
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
 
 # -------------------------------------------------------------------
 # قراءة رابط قاعدة البيانات من متغير البيئة DATABASE_URL
@@ -71,3 +79,137 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+
+# -------------------------------------------------------------------
+# Session واحدة لكل تحديث (update) أو Job في البوت
+#
+# الـ handler لا يفتح SessionLocal() بنفسه؛ بل يستدعي current_session()
+# فتُفتح Session واحدة عند أول استخدام فقط، ويغلقها الغلاف (session_scope)
+# بعد انتهاء الـ handler: commit عند النجاح و rollback عند الاستثناء.
+# -------------------------------------------------------------------
+
+# تحذير في السجل إذا سحب تحديث واحد اتصالات من الـ pool أكثر من هذا العدد
+DB_CHECKOUTS_WARN = int(os.environ.get("DB_CHECKOUTS_WARN", "3"))
+
+_local = threading.local()
+
+_pool_stats_lock = threading.Lock()
+_pool_stats = {"checkouts": 0, "scopes": 0, "max_checkouts_per_scope": 0}
+
+
+class _SessionScope:
+    __slots__ = ("name", "session", "checkouts")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.session = None
+        self.checkouts = 0
+
+
+@event.listens_for(engine, "checkout")
+def _count_checkout(dbapi_connection, connection_record, connection_proxy):
+    with _pool_stats_lock:
+        _pool_stats["checkouts"] += 1
+    scope = getattr(_local, "scope", None)
+    if scope is not None:
+        scope.checkouts += 1
+
+
+def pool_stats() -> dict:
+    """إحصائيات الـ pool: إجمالي السحب، عدد الـ scopes، وأعلى سحب داخل scope واحد."""
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+    stats["pool"] = engine.pool.status()
+    return stats
+
+
+def _pool_metrics() -> list:
+    stats = pool_stats()
+    checked_out = getattr(engine.pool, "checkedout", None)
+    metrics = [
+        ("db_pool_checkouts_total", "counter", "Connections checked out of the pool", {"": stats["checkouts"]}),
+        ("db_session_scopes_total", "counter", "Completed per-update session scopes", {"": stats["scopes"]}),
+        (
+            "db_max_checkouts_per_scope",
+            "gauge",
+            "Highest pool checkout count seen in one session scope",
+            {"": stats["max_checkouts_per_scope"]},
+        ),
+    ]
+    if checked_out is not None:
+        metrics.append(("db_pool_checked_out", "gauge", "Connections currently checked out", {"": checked_out()}))
+    return metrics
+
+
+register_collector(_pool_metrics)
+
+
+@contextmanager
+def session_scope(name: str = ""):
+    """
+    يحدد نطاق Session واحدة للخيط الحالي.
+    النطاق المتداخل يعيد استخدام النطاق الخارجي بدل فتح Session جديدة.
+    """
+    outer = getattr(_local, "scope", None)
+    if outer is not None:
+        yield outer
+        return
+
+    scope = _SessionScope(name)
+    _local.scope = scope
+    try:
+        yield scope
+        if scope.session is not None:
+            scope.session.commit()
+    except Exception:
+        if scope.session is not None:
+            scope.session.rollback()
+        raise
+    finally:
+        if scope.session is not None:
+            scope.session.close()
+        _local.scope = None
+
+        with _pool_stats_lock:
+            _pool_stats["scopes"] += 1
+            if scope.checkouts > _pool_stats["max_checkouts_per_scope"]:
+                _pool_stats["max_checkouts_per_scope"] = scope.checkouts
+
+        if scope.checkouts > DB_CHECKOUTS_WARN:
+            logger.warning("%s checked out %d pooled connections", scope.name, scope.checkouts)
+        else:
+            logger.debug("%s checked out %d pooled connections", scope.name, scope.checkouts)
+
+
+def with_session_scope(func):
+    """غلاف لـ handlers و Jobs البوت: كل استدعاء يعمل داخل session_scope خاص به."""
+    name = getattr(func, "__name__", "handler")
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with session_scope(name):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def current_session() -> Session:
+    """Session النطاق الحالي، تُفتح عند أول طلب فقط."""
+    scope = getattr(_local, "scope", None)
+    if scope is None:
+        raise RuntimeError("current_session() called outside session_scope()")
+    if scope.session is None:
+        scope.session = SessionLocal()
+    return scope.session
+
+
+def release_connection(db: Session) -> None:
+    """
+    ينهي المعاملة المفتوحة (إن وجدت) فيعود الاتصال إلى الـ pool،
+    مع بقاء الـ Session صالحة لبقية الـ handler.
+    نستدعيها قبل الانتظار الطويل (طلبات الذكاء الاصطناعي) حتى لا نحجز اتصالاً بلا عمل.
+    """
+    if db.in_transaction():
+        db.commit()
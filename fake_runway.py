@@ -0,0 +1,182 @@
+# fake_runway.py
+"""
+خادم Runway وهمي محلي للاختبار والقياس (لا يستهلك رصيداً حقيقياً).
+
+يدعم POST /v1/text_to_video و GET /v1/tasks/<id> بنفس شكل ردود Runway:
+المهمة PENDING ثم RUNNING مع progress ثم SUCCEEDED مع رابط في output
+بعد task_seconds ثانية. ويعدّ الاتصالات الجديدة لقياس إعادة استخدامها.
+
+    python fake_runway.py 8765          # ثم RUNWAY_BASE_URL=http://127.0.0.1:8765/v1
+"""
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_API_KEY = "fake-runway-key"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 حتى يبقى الاتصال مفتوحاً (keep-alive) بين الطلبات
+    protocol_version = "HTTP/1.1"
+    # الـ headers والجسم في كتابتين منفصلتين؛ بدون هذا يتأخر الرد على الاتصال المعاد استخدامه (Nagle)
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.fake.count("connections")
+        self.server.fake.handshake_sleep()
+
+    def _reply(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _authorized(self) -> bool:
+        fake = self.server.fake
+        if self.headers.get("Authorization") != f"Bearer {fake.api_key}":
+            self._reply(401, {"error": "Unauthorized"})
+            return False
+        if not self.headers.get("X-Runway-Version"):
+            self._reply(400, {"error": "X-Runway-Version header is required"})
+            return False
+        return True
+
+    def do_POST(self):
+        fake = self.server.fake
+        fake.count("requests")
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self._authorized():
+            return
+        if self.path.rstrip("/") != "/v1/text_to_video":
+            self._reply(404, {"error": "Not found"})
+            return
+        if not body.get("promptText"):
+            self._reply(400, {"error": "promptText is required"})
+            return
+        fake.latency_sleep()
+        self._reply(200, {"id": fake.create_task()})
+
+    def do_GET(self):
+        fake = self.server.fake
+        fake.count("requests")
+        if not self._authorized():
+            return
+        prefix = "/v1/tasks/"
+        task = fake.task_view(self.path[len(prefix):]) if self.path.startswith(prefix) else None
+        if task is None:
+            self._reply(404, {"error": "Task not found"})
+            return
+        fake.latency_sleep()
+        self._reply(200, task)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeRunwayServer:
+    """
+    task_seconds: مدة "توليد" الفيديو
+    latency     : تأخير كل رد (لمحاكاة زمن الشبكة والخادم)
+    handshake   : تأخير كل اتصال جديد (لمحاكاة مصافحة TLS مع الخادم الحقيقي)
+    """
+
+    def __init__(
+        self,
+        port: int = 0,
+        task_seconds: float = 3.0,
+        latency: float = 0.0,
+        handshake: float = 0.0,
+        api_key: str = FAKE_API_KEY,
+    ):
+        self.task_seconds = task_seconds
+        self.latency = latency
+        self.handshake = handshake
+        self.api_key = api_key
+        self.stats = {"connections": 0, "requests": 0}
+        self._tasks = {}
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.stats[name] += 1
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {"connections": 0, "requests": 0}
+
+    def latency_sleep(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def handshake_sleep(self) -> None:
+        if self.handshake:
+            time.sleep(self.handshake)
+
+    def create_task(self) -> str:
+        task_id = str(uuid.uuid4())
+        with self._lock:
+            self._tasks[task_id] = time.monotonic()
+        return task_id
+
+    def task_view(self, task_id: str):
+        with self._lock:
+            created = self._tasks.get(task_id)
+        if created is None:
+            return None
+
+        elapsed = time.monotonic() - created
+        if elapsed >= self.task_seconds:
+            return {
+                "id": task_id,
+                "status": "SUCCEEDED",
+                "createdAt": created,
+                "output": [f"https://fake-runway.local/videos/{task_id}.mp4"],
+            }
+        if elapsed < self.task_seconds * 0.1:
+            return {"id": task_id, "status": "PENDING", "createdAt": created}
+        return {
+            "id": task_id,
+            "status": "RUNNING",
+            "createdAt": created,
+            "progress": round(elapsed / self.task_seconds, 3),
+        }
+
+    def start(self) -> "FakeRunwayServer":
+        threading.Thread(target=self._server.serve_forever, name="fake-runway", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8765
+    server = FakeRunwayServer(port=port)
+    print(f"Fake Runway on {server.base_url} (key: {server.api_key})")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -1,20 +1,41 @@
 import os
 import random
+import secrets
 import string
 import sys
+import time
 from datetime import datetime
 
+from psycopg2.extras import execute_values
 from sqlalchemy.orm import Session
 
-from database import SessionLocal
+from code_format import CODE_ALPHABET, CODE_BODY_LENGTH, add_check_char
+from database import SessionLocal, engine
 from models import RedeemCode
 
+# جدول تحويل البايتات العشوائية إلى حروف الكود (للوضع الجماعي):
+# القيم 0..251 تُحوَّل لحروف (252 = 7 × 36) والباقي يُحذف حتى لا يكون هناك انحياز.
+_UNBIASED_LIMIT = 256 - 256 % len(CODE_ALPHABET)
+_BYTE_TO_CODE_CHAR = bytes(
+    ord(CODE_ALPHABET[b % len(CODE_ALPHABET)]) if b < _UNBIASED_LIMIT else 0
+    for b in range(256)
+)
+_REJECTED_BYTES = bytes(range(_UNBIASED_LIMIT, 256))
+
+BULK_BATCH_SIZE = 10000
+
 
 def generate_random_code(length=10):
     """توليد كود عشوائي من حروف كبيرة وأرقام بطول محدد."""
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=length))
 
 
+def generate_checked_code() -> str:
+    """توليد كود بالصيغة الجديدة: جسم عشوائي + حرف تحقق (انظر code_format.py)."""
+    body = "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_BODY_LENGTH))
+    return add_check_char(body)
+
+
 def generate_codes(count: int, points: int):
     """
     توليد عدد من الأكواد وتخزينها داخل قاعدة البيانات.
@@ -27,7 +48,7 @@ def generate_codes(count: int, points: int):
         for _ in range(count):
             # تأكد أن الكود غير مكرر
             while True:
-                code = generate_random_code(10)
+                code = generate_checked_code()
                 exists = db.query(RedeemCode).filter_by(code=code).first()
                 if not exists:
                     break
@@ -49,6 +70,89 @@ def generate_codes(count: int, points: int):
     return codes_list
 
 
+def generate_code_candidates(count: int, length: int = CODE_BODY_LENGTH) -> set[str]:
+    """
+    توليد count كود مختلف في الذاكرة باستخدام secrets (بدون أي استعلام).
+    كل كود = جسم عشوائي بطول length + حرف تحقق.
+    التكرار داخل الدفعة يُحذف محلياً عبر set.
+    """
+    codes: set[str] = set()
+    while len(codes) < count:
+        need = count - len(codes)
+        raw = secrets.token_bytes(need * length + 64)
+        chars = raw.translate(_BYTE_TO_CODE_CHAR, _REJECTED_BYTES)
+        for i in range(0, len(chars) - length + 1, length):
+            codes.add(add_check_char(chars[i:i + length].decode("ascii")))
+            if len(codes) >= count:
+                break
+    return codes
+
+
+def _insert_codes_batch(cur, codes, points: int, table: str = "redeem_codes") -> list[str]:
+    """إدراج دفعة كاملة بجملة واحدة، ويرجع الأكواد التي أُدرجت فعلاً (بدون المتكررة في DB)."""
+    now = datetime.utcnow()
+    rows = [(c, points, False, False, now) for c in codes]
+    inserted = execute_values(
+        cur,
+        f"INSERT INTO {table} (code, points, is_used, is_redeemed, created_at) "
+        "VALUES %s ON CONFLICT (code) DO NOTHING RETURNING code",
+        rows,
+        page_size=len(rows),
+        fetch=True,
+    )
+    return [r[0] for r in inserted]
+
+
+def generate_codes_bulk(
+    count: int,
+    points: int,
+    out_file=None,
+    batch_size: int = BULK_BATCH_SIZE,
+    table: str = "redeem_codes",
+    conn=None,
+) -> int:
+    """
+    الوضع الجماعي لتوليد عدد كبير من الأكواد (مثلاً 50 ألف لحملة في سلة):
+    - التوليد في الذاكرة عبر secrets.
+    - إدراج دفعات كبيرة بـ INSERT ... ON CONFLICT (code) DO NOTHING.
+    - إعادة توليد الأكواد المتصادمة فقط.
+    - كتابة كل دفعة إلى out_file مباشرة بعد commit.
+    يرجع عدد الأكواد التي أُنشئت.
+    """
+    own_conn = conn is None
+    if own_conn:
+        conn = engine.raw_connection()
+
+    produced = 0
+    try:
+        cur = conn.cursor()
+        while produced < count:
+            wanted = min(batch_size, count - produced)
+            pending = generate_code_candidates(wanted)
+
+            while pending:
+                inserted = _insert_codes_batch(cur, pending, points, table=table)
+                conn.commit()
+
+                if out_file is not None:
+                    out_file.write("\n".join(inserted) + "\n" if inserted else "")
+                    out_file.flush()
+
+                produced += len(inserted)
+                collisions = len(pending) - len(inserted)
+                pending = generate_code_candidates(collisions) if collisions else set()
+
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if own_conn:
+            conn.close()
+
+    return produced
+
+
 def get_output_dir() -> str:
     """تحديد مجلد الحفظ باستخدام /var/data إذا موجود (ديسك Render)."""
     env_dir = os.environ.get("CODES_OUTPUT_DIR")
@@ -61,11 +165,14 @@ def get_output_dir() -> str:
     return "."
 
 
+def output_file_path(points: int) -> str:
+    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
+    return os.path.join(get_output_dir(), f"codes_{points}_{timestamp}.txt")
+
+
 def save_to_file(points: int, codes):
     """حفظ الأكواد في ملف TXT بدون أي بادئة."""
-    out_dir = get_output_dir()
-    timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    file_name = os.path.join(out_dir, f"codes_{points}_{timestamp}.txt")
+    file_name = output_file_path(points)
 
     with open(file_name, "w", encoding="utf-8") as f:
         for c in codes:
@@ -77,13 +184,29 @@ def save_to_file(points: int, codes):
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 3:
-        print("Usage: python generate_codes.py <count> <points>")
+    args = [a for a in sys.argv[1:] if a != "--bulk"]
+    bulk = "--bulk" in sys.argv[1:]
+
+    if len(args) != 2:
+        print("Usage: python generate_codes.py <count> <points> [--bulk]")
         print("Example: python generate_codes.py 50 100")
+        print("Bulk:    python generate_codes.py 50000 100 --bulk")
         sys.exit(1)
 
-    count = int(sys.argv[1])
-    points = int(sys.argv[2])
+    count = int(args[0])
+    points = int(args[1])
+
+    if bulk:
+        file_name = output_file_path(points)
+        started = time.perf_counter()
+        with open(file_name, "w", encoding="utf-8") as f:
+            produced = generate_codes_bulk(count, points, out_file=f)
+        elapsed = time.perf_counter() - started
+
+        print(f"📁 Saved {produced} codes to: {file_name}")
+        print(f"⏱ {elapsed:.1f}s ({produced / max(elapsed, 1e-9):,.0f} codes/s)")
+        print("\n✨ Done! Codes saved to database and file.")
+        sys.exit(0)
 
     codes = generate_codes(count, points)
 
@@ -0,0 +1,178 @@
+# lanes.py
+"""
+مسارات تنفيذ (lanes) منفصلة لـ handlers البوت.
+
+كل مسار له ThreadPool خاص وحد أقصى لعدد الطلبات المنتظرة فيه،
+حتى لا تعطّل طلبات الذكاء الاصطناعي البطيئة الأوامر السريعة مثل /wallet.
+مسارات الذكاء الاصطناعي (story / media / pdf) تستخدم جدولة عادلة بين المستخدمين
+(scheduler.FairScheduler) مع حد لطلبات كل مستخدم، وتخبر المستخدم بترتيبه في الطابور.
+يمكن ضبط الأحجام من متغيرات البيئة:
+
+    LANE_<NAME>_WORKERS   عدد الخيوط في المسار
+    LANE_<NAME>_QUEUE     عدد الطلبات المسموح بانتظارها فوق عدد الخيوط
+"""
+import functools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram import Update
+from telegram.ext import CallbackContext
+from telegram.utils.promise import Promise
+
+from database import with_session_scope
+from metrics import register_collector
+from scheduler import FairScheduler, SchedulerRejected
+
+logger = logging.getLogger(__name__)
+
+LANE_BUSY_TEXT = "⏳ الخدمة مشغولة حالياً بطلبات كثيرة، حاول مرة أخرى بعد قليل."
+USER_LIMIT_TEXT = "⏳ لديك طلبات قيد التنفيذ بالفعل، انتظر حتى تنتهي ثم أرسل طلبك الجديد."
+
+
+class LaneRejected(Exception):
+    """المسار رفض التحديث؛ text هو الرد المناسب للمستخدم."""
+
+    def __init__(self, text: str):
+        super().__init__(text)
+        self.text = text
+
+
+def _run_promise(promise: Promise, dispatcher) -> None:
+    promise.run()
+    if promise.exception is not None:
+        dispatcher.dispatch_error(promise.update, promise.exception, promise=promise)
+
+
+class Lane:
+    """ThreadPool محدود مع حد أقصى للطلبات المنتظرة (queue depth)."""
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix=f"lane-{name}",
+        )
+        # عدد الأماكن = الخيوط العاملة + الطابور المسموح
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+
+    def submit(self, callback, update: Update, context: CallbackContext, cost: float = 1.0):
+        """
+        يرسل الـ callback للتنفيذ في هذا المسار ويرجع (Promise, ترتيب الطابور).
+        الـ Promise يفهمها ConversationHandler كحالة معلّقة. يرفع LaneRejected إذا كان المسار ممتلئاً.
+        """
+        if not self._slots.acquire(blocking=False):
+            logger.warning("Lane %s is full, rejecting update", self.name)
+            raise LaneRejected(LANE_BUSY_TEXT)
+
+        promise = Promise(callback, (update, context), {}, update=update)
+        try:
+            self._executor.submit(self._run, promise, context.dispatcher)
+        except Exception:
+            self._slots.release()
+            raise
+        return promise, 0
+
+    def _run(self, promise: Promise, dispatcher) -> None:
+        try:
+            _run_promise(promise, dispatcher)
+        finally:
+            self._slots.release()
+
+
+class FairLane:
+    """مسار بجدولة عادلة بين المستخدمين بدل FIFO، مع حد لطلبات كل مستخدم."""
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._scheduler = FairScheduler(name, workers=workers, max_queue=max_queue)
+
+    def submit(self, callback, update: Update, context: CallbackContext, cost: float = 1.0):
+        user = update.effective_user
+        user_key = user.id if user else update.effective_chat.id
+
+        promise = Promise(callback, (update, context), {}, update=update)
+        try:
+            position = self._scheduler.submit(
+                user_key,
+                lambda: _run_promise(promise, context.dispatcher),
+                cost=cost,
+            )
+        except SchedulerRejected as e:
+            logger.warning("Lane %s rejected update from %s: %s", self.name, user_key, e.reason)
+            if e.reason == SchedulerRejected.USER_LIMIT:
+                raise LaneRejected(USER_LIMIT_TEXT)
+            raise LaneRejected(LANE_BUSY_TEXT)
+        return promise, position
+
+    def stats(self) -> dict:
+        return self._scheduler.stats()
+
+
+def _lane_from_env(name: str, workers: int, max_queue: int, lane_class=Lane):
+    prefix = f"LANE_{name.upper()}"
+    return lane_class(
+        name,
+        workers=int(os.environ.get(f"{prefix}_WORKERS", str(workers))),
+        max_queue=int(os.environ.get(f"{prefix}_QUEUE", str(max_queue))),
+    )
+
+
+# fast : أوامر فورية (المحفظة، الأسعار، الشحن، بدايات المحادثات)
+# story: كتابة ومراجعة القصص النصية   (جدولة عادلة)
+# media: الصور والفيديو                (جدولة عادلة)
+# pdf  : قراءة ومراجعة ملفات PDF        (جدولة عادلة)
+LANES = {
+    "fast": _lane_from_env("fast", workers=8, max_queue=200),
+    "story": _lane_from_env("story", workers=4, max_queue=20, lane_class=FairLane),
+    "media": _lane_from_env("media", workers=4, max_queue=20, lane_class=FairLane),
+    "pdf": _lane_from_env("pdf", workers=2, max_queue=10, lane_class=FairLane),
+}
+
+
+def _lane_metrics() -> list:
+    queued, running = {}, {}
+    for name, lane in LANES.items():
+        if isinstance(lane, FairLane):
+            stats = lane.stats()
+            queued[f'{{lane="{name}"}}'] = stats["queued"]
+            running[f'{{lane="{name}"}}'] = stats["running"]
+    return [
+        ("lane_queued_jobs", "gauge", "Jobs waiting in a fair-scheduled lane", queued),
+        ("lane_running_jobs", "gauge", "Jobs running in a fair-scheduled lane", running),
+    ]
+
+
+register_collector(_lane_metrics)
+
+
+def run_in_lane(lane_name: str, callback, cost: float = 1.0):
+    """
+    يغلّف callback بحيث يُنفَّذ داخل المسار المحدد بدل خيط الـ dispatcher،
+    وداخل session_scope خاص بالتحديث (Session واحدة تُفتح عند الحاجة فقط).
+    cost: وزن الطلب في الجدولة العادلة (الفيديو أثقل من القصة مثلاً).
+    """
+    lane = LANES[lane_name]
+    scoped_callback = with_session_scope(callback)
+
+    @functools.wraps(callback)
+    def wrapper(update: Update, context: CallbackContext):
+        try:
+            promise, position = lane.submit(scoped_callback, update, context, cost=cost)
+        except LaneRejected as e:
+            if update.effective_message:
+                update.effective_message.reply_text(e.text)
+            return None
+
+        if position and update.effective_message:
+            update.effective_message.reply_text(
+                f"⏳ طلبك في الطابور، ترتيبك الآن: #{position}.\nسأبدأ فيه تلقائياً عند وصول دورك."
+            )
+        return promise
+
+    return wrapper
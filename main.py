@@ -1,16 +1,70 @@
 # main.py
-from fastapi import FastAPI, Depends, HTTPException
+import hmac
+import logging
+import os
+import re
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
+from telegram import Update
 
 from database import Base, engine, get_db
 from models import User, Wallet
 from auth import verify_telegram_init_data  # جديد
+from wallet_service import ensure_user_wallet
+from metrics import CONTENT_TYPE, render_metrics
 from fastapi.middleware.cors import CORSMiddleware
 
+logger = logging.getLogger(__name__)
+
+# ================== وضع webhook للبوت ==================
+# عند ضبط TELEGRAM_WEBHOOK_URL (رابط الخدمة العام مثل https://mrwiat.onrender.com) يعمل البوت
+# داخل نفس العملية: تيليجرام ترسل التحديثات إلى /telegram/webhook/<secret> بدل polling،
+# ويتشارك البوت و API نفس engine وpool قاعدة البيانات ونفس /metrics.
+# بدونه يبقى البوت عملية مستقلة: python bot.py (polling، للتطوير المحلي).
+# حالة المحادثات في ذاكرة الـ dispatcher، لذلك يعمل هذا الوضع مع worker واحد فقط في uvicorn.
+TELEGRAM_WEBHOOK_URL = os.environ.get("TELEGRAM_WEBHOOK_URL", "").rstrip("/")
+# يُستخدم في المسار وفي header X-Telegram-Bot-Api-Secret-Token (حروف وأرقام و _ - فقط)
+TELEGRAM_WEBHOOK_SECRET = os.environ.get("TELEGRAM_WEBHOOK_SECRET", "")
+
+if TELEGRAM_WEBHOOK_URL and not re.fullmatch(r"[A-Za-z0-9_-]{16,256}", TELEGRAM_WEBHOOK_SECRET):
+    raise RuntimeError(
+        "TELEGRAM_WEBHOOK_SECRET must be 16-256 characters of A-Z a-z 0-9 _ - "
+        "when TELEGRAM_WEBHOOK_URL is set"
+    )
+
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Mrwiat Backend")
+updater = None
+
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global updater
+    if TELEGRAM_WEBHOOK_URL:
+        # bot يتطلب BOT_TOKEN، فلا يُستورد إلا في وضع webhook
+        import bot
+
+        updater = bot.build_updater()
+        await run_in_threadpool(
+            bot.start_webhook_mode,
+            updater,
+            f"{TELEGRAM_WEBHOOK_URL}/telegram/webhook/{TELEGRAM_WEBHOOK_SECRET}",
+            TELEGRAM_WEBHOOK_SECRET,
+        )
+    try:
+        yield
+    finally:
+        if updater is not None:
+            await run_in_threadpool(bot.stop_webhook_mode, updater)
+            updater = None
+
+
+app = FastAPI(title="Mrwiat Backend", lifespan=lifespan)
 
 origins = [
     "https://mrwiat.com",
@@ -31,32 +85,37 @@ def health():
     return {"status": "ok"}
 
 
-# نموذج البيانات القادمة من WebApp
-class TelegramInitData(BaseModel):
-    init_data: str
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    # مقاييس Prometheus: زمن وtokens وتكلفة طلبات الذكاء الاصطناعي لكل ميزة، و Runway، والكاش، والـ DB pool
+    return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
 
 
-def get_or_create_user_from_telegram(user_data: dict, db: Session) -> User:
-    telegram_id = user_data["id"]
-    first_name = user_data.get("first_name")
-    username = user_data.get("username")
+@app.post("/telegram/webhook/{secret}", include_in_schema=False)
+async def telegram_webhook(secret: str, request: Request):
+    # نفس الرد لأي مسار خاطئ حتى لا يُعرف أن الـ webhook مفعّل
+    if updater is None or not hmac.compare_digest(secret.encode(), TELEGRAM_WEBHOOK_SECRET.encode()):
+        raise HTTPException(status_code=404, detail="Not Found")
+    header = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    if not hmac.compare_digest(header.encode(), TELEGRAM_WEBHOOK_SECRET.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
 
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
-    if not user:
-        user = User(
-            telegram_id=telegram_id,
-            first_name=first_name,
-            username=username,
-        )
-        db.add(user)
-        db.flush()
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or "update_id" not in data:
+        raise HTTPException(status_code=400, detail="Invalid update")
 
-        wallet = Wallet(user_id=user.id, balance_cents=0)
-        db.add(wallet)
-        db.commit()
-        db.refresh(user)
+    update = Update.de_json(data, updater.bot)
+    # المعالجة في خيط الـ dispatcher ومسارات lanes؛ نرد على تيليجرام فوراً
+    updater.dispatcher.update_queue.put(update)
+    return {"ok": True}
 
-    return user
+
+# نموذج البيانات القادمة من WebApp
+class TelegramInitData(BaseModel):
+    init_data: str
 
 
 @app.post("/wallet/webapp")
@@ -68,13 +127,20 @@ def wallet_from_webapp(
     if not user_data:
         raise HTTPException(status_code=401, detail="Invalid Telegram init data")
 
-    user = get_or_create_user_from_telegram(user_data, db)
-    wallet = user.wallet
+    # upsert واحد للمستخدم والمحفظة (أو لا شيء إذا كان المستخدم معروفاً في الكاش)
+    _, wallet_id, _ = ensure_user_wallet(
+        db,
+        user_data["id"],
+        first_name=user_data.get("first_name"),
+        username=user_data.get("username"),
+        welcome_bonus=0,
+    )
+    wallet = db.get(Wallet, wallet_id)
 
     return {
-        "telegram_id": user.telegram_id,
-        "first_name": user.first_name,
-        "username": user.username,
+        "telegram_id": user_data["id"],
+        "first_name": user_data.get("first_name"),
+        "username": user_data.get("username"),
         "balance_cents": wallet.balance_cents,
         "balance": wallet.balance_cents / 100,
         "currency": wallet.currency,
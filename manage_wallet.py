@@ -2,8 +2,9 @@
 import sys
 from sqlalchemy.orm import Session
 
+import wallet_service
 from database import SessionLocal
-from models import User, Wallet
+from models import LedgerReason, User, WalletTransaction
 
 
 def get_db() -> Session:
@@ -49,9 +50,7 @@ def add_points(telegram_id: int, delta_points: int):
 
         wallet = user.wallet
         old_balance = wallet.balance_cents
-        new_balance = max(0, old_balance + delta_points)
-        wallet.balance_cents = new_balance
-        db.commit()
+        new_balance = wallet_service.add_points(db, wallet.id, delta_points, LedgerReason.ADMIN)
 
         print("✅ تم تحديث الرصيد بنجاح.")
         print(f"من: {old_balance} -> إلى: {new_balance}")
@@ -72,15 +71,64 @@ def set_points(telegram_id: int, new_points: int):
 
         wallet = user.wallet
         old_balance = wallet.balance_cents
-        wallet.balance_cents = max(0, new_points)
-        db.commit()
+        new_balance = wallet_service.set_balance(db, wallet.id, new_points, LedgerReason.ADMIN)
 
         print("✅ تم ضبط الرصيد بنجاح.")
-        print(f"من: {old_balance} -> إلى: {wallet.balance_cents}")
+        print(f"من: {old_balance} -> إلى: {new_balance}")
+    finally:
+        db.close()
+
+
+def show_history(telegram_id: int, limit: int = 20):
+    """عرض آخر حركات المحفظة من السجل."""
+    db = get_db()
+    try:
+        user = db.query(User).filter(User.telegram_id == telegram_id).first()
+        if not user or not user.wallet:
+            print("❌ لم أجد المستخدم أو محفظته.")
+            return
+
+        rows = (
+            db.query(WalletTransaction)
+            .filter(WalletTransaction.wallet_id == user.wallet.id)
+            .order_by(WalletTransaction.id.desc())
+            .limit(limit)
+            .all()
+        )
+        print(f"===== آخر {len(rows)} حركة للمحفظة {user.wallet.id} =====")
+        for t in rows:
+            print(f"{t.created_at:%Y-%m-%d %H:%M}  {t.delta:+6d}  {t.reason:<14} {t.ref or ''}")
     finally:
         db.close()
 
 
+def reconcile():
+    """مطابقة مجموع السجل مع أرصدة جميع المحافظ."""
+    db = get_db()
+    try:
+        mismatches = wallet_service.reconcile_ledger(db)
+    finally:
+        db.close()
+
+    if not mismatches:
+        print("✅ السجل مطابق لجميع الأرصدة.")
+        return
+
+    print(f"⚠️ عدد المحافظ غير المطابقة: {len(mismatches)}")
+    for wallet_id, balance, ledger_sum in mismatches:
+        print(f"wallet_id={wallet_id}  balance={balance}  ledger_sum={ledger_sum}")
+
+
+def backfill_ledger():
+    """(مرة واحدة) إضافة رصيد افتتاحي في السجل للمحافظ القديمة."""
+    db = get_db()
+    try:
+        added = wallet_service.backfill_opening_balances(db)
+    finally:
+        db.close()
+    print(f"✅ تمت إضافة {added} سطر رصيد افتتاحي.")
+
+
 def usage():
     print(
         """
@@ -105,11 +153,28 @@ def usage():
    مثال:
      جعل رصيد المستخدم 0:
        python manage_wallet.py set 123456789 0
+
+4) عرض آخر حركات المحفظة:
+   python manage_wallet.py history <telegram_id>
+
+5) مطابقة السجل مع الأرصدة:
+   python manage_wallet.py reconcile
+
+6) (مرة واحدة بعد التحديث) رصيد افتتاحي للمحافظ القديمة:
+   python manage_wallet.py backfill-ledger
 """
     )
 
 
 if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == "reconcile":
+        reconcile()
+        sys.exit(0)
+
+    if len(sys.argv) == 2 and sys.argv[1] == "backfill-ledger":
+        backfill_ledger()
+        sys.exit(0)
+
     if len(sys.argv) < 3:
         usage()
         sys.exit(1)
@@ -133,6 +198,8 @@ if __name__ == "__main__":
             sys.exit(1)
         new_points = int(sys.argv[3])
         set_points(telegram_id, new_points)
+    elif command == "history":
+        show_history(telegram_id)
     else:
         print(f"❌ أمر غير معروف: {command}")
         usage()
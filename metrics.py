@@ -0,0 +1,254 @@
+# metrics.py
+"""
+مقاييس داخل العملية بصيغة Prometheus النصية (بدون أي مكتبة خارجية).
+
+- Counter: عدّاد تراكمي بوسوم (labels).
+- Summary: زمن/قيمة مع p50 و p95 من نافذة متحركة لآخر SUMMARY_WINDOW قيمة، ومعها _sum و _count.
+
+main.py يعرضها على /metrics. البوت (إن شُغّل في عملية منفصلة) يمكنه عرضها
+على METRICS_PORT عبر start_metrics_server.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_WINDOW = int(os.environ.get("METRICS_SUMMARY_WINDOW", "1024"))
+QUANTILES = (0.5, 0.95)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+_registry_lock = threading.Lock()
+# دوال ترجع [(name, type, help, {labels: value})] لمقاييس تُحسب عند الطلب
+_collectors = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def inc(self, *label_values, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, total in items:
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {total:g}")
+        return lines
+
+
+class Summary:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def observe(self, *label_values, value: float) -> None:
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [deque(maxlen=SUMMARY_WINDOW), 0.0, 0]
+            series[0].append(value)
+            series[1] += value
+            series[2] += 1
+
+    def quantiles(self, *label_values) -> dict:
+        with self._lock:
+            series = self._series.get(label_values)
+            window = sorted(series[0]) if series else []
+        return {q: _quantile(window, q) for q in QUANTILES}
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} summary"]
+        with self._lock:
+            items = [(k, sorted(v[0]), v[1], v[2]) for k, v in sorted(self._series.items())]
+        for values, window, total, count in items:
+            for q in QUANTILES:
+                labels = _format_labels(self.labels, values, f'quantile="{q}"')
+                lines.append(f"{self.name}{labels} {_quantile(window, q):g}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {total:g}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+def _quantile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return float("nan")
+    # nearest-rank
+    idx = max(0, math.ceil(q * len(sorted_values)) - 1)
+    return sorted_values[idx]
+
+
+def register_collector(func) -> None:
+    """func() ترجع [(name, type, help, {labels_text: value})]؛ labels_text مثل '{layer="lru"}' أو ''."""
+    _collectors.append(func)
+
+
+def render_metrics() -> str:
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        lines.extend(metric.render())
+
+    for collector in _collectors:
+        try:
+            for name, kind, help_text, samples in collector():
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples.items():
+                    lines.append(f"{name}{labels} {value:g}")
+        except Exception as e:
+            logger.warning("Metrics collector %s failed: %s", getattr(collector, "__name__", collector), e)
+    return "\n".join(lines) + "\n"
+
+
+# =============== مقاييس الذكاء الاصطناعي و Runway ===============
+
+AI_REQUESTS = Counter(
+    "ai_requests_total", "AI upstream requests by feature, model and outcome",
+    ("feature", "model", "outcome"),
+)
+AI_LATENCY = Summary(
+    "ai_request_seconds", "AI request latency in seconds (including retries)",
+    ("feature", "model"),
+)
+AI_FIRST_TOKEN = Summary(
+    "ai_first_token_seconds", "Time to first streamed token in seconds",
+    ("feature", "model"),
+)
+AI_TOKENS = Counter(
+    "ai_tokens_total", "AI tokens consumed", ("feature", "model", "kind"),
+)
+AI_TOKENS_PER_REQUEST = Summary(
+    "ai_tokens_per_request", "Total tokens per successful AI request",
+    ("feature", "model"),
+)
+AI_COST = Counter(
+    "ai_cost_usd_total", "Estimated AI spend in USD", ("feature", "model"),
+)
+
+RUNWAY_REQUESTS = Counter(
+    "runway_requests_total", "Runway API requests by operation and outcome",
+    ("operation", "outcome"),
+)
+RUNWAY_LATENCY = Summary(
+    "runway_request_seconds", "Runway API latency in seconds", ("operation",),
+)
+
+# سعر كل مليون token (مدخلات/مخرجات) بالدولار: "gpt-4.1-mini=0.4/1.6,gpt-4.1=2/8"
+_DEFAULT_PRICES = "gpt-4.1-mini=0.4/1.6,gpt-4.1=2/8,gpt-4o-mini=0.15/0.6"
+AI_PRICES = {}
+for _item in os.environ.get("AI_PRICES", _DEFAULT_PRICES).split(","):
+    _model, _, _price = _item.partition("=")
+    if _model.strip() and "/" in _price:
+        _in, _, _out = _price.partition("/")
+        AI_PRICES[_model.strip()] = (float(_in), float(_out))
+# سعر الصورة الواحدة
+AI_IMAGE_PRICE = float(os.environ.get("AI_IMAGE_PRICE", "0.042"))
+
+
+def record_ai_usage(feature: str, model: str, usage) -> None:
+    """usage من رد OpenAI (prompt_tokens / completion_tokens)."""
+    if usage is None:
+        return
+    prompt = getattr(usage, "prompt_tokens", None) or getattr(usage, "input_tokens", None) or 0
+    completion = getattr(usage, "completion_tokens", None) or getattr(usage, "output_tokens", None) or 0
+
+    AI_TOKENS.inc(feature, model, "prompt", amount=prompt)
+    AI_TOKENS.inc(feature, model, "completion", amount=completion)
+    AI_TOKENS_PER_REQUEST.observe(feature, model, value=prompt + completion)
+
+    price = AI_PRICES.get(model)
+    if price:
+        AI_COST.inc(feature, model, amount=(prompt * price[0] + completion * price[1]) / 1_000_000)
+
+
+def record_image_cost(feature: str, model: str, images: int = 1) -> None:
+    AI_COST.inc(feature, model, amount=AI_IMAGE_PRICE * images)
+
+
+@contextmanager
+def observe_ai_call(feature: str, model: str):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        AI_REQUESTS.inc(feature, model, type(e).__name__)
+        raise
+    else:
+        AI_REQUESTS.inc(feature, model, "ok")
+    finally:
+        AI_LATENCY.observe(feature, model, value=time.perf_counter() - started)
+
+
+@contextmanager
+def observe_runway_call(operation: str):
+    """outcome يُضبط من داخل الكتلة: with observe_runway_call("create") as call: call["outcome"] = "http_500"."""
+    call = {"outcome": "ok"}
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception as e:
+        call["outcome"] = type(e).__name__
+        raise
+    finally:
+        RUNWAY_REQUESTS.inc(operation, call["outcome"])
+        RUNWAY_LATENCY.observe(operation, value=time.perf_counter() - started)
+
+
+# =============== خادم /metrics للبوت عند تشغيله منفصلاً ===============
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info("Metrics server listening on %s:%d/metrics", host, port)
+    return server
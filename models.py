@@ -1,4 +1,6 @@
 # models.py
+import enum
+
 from sqlalchemy import (
     Column,
     Integer,
@@ -7,6 +9,9 @@ from sqlalchemy import (
     DateTime,
     ForeignKey,
     Boolean,
+    Index,
+    Text,
+    text,
 )
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -63,3 +68,110 @@ class RedeemCode(Base):
 
     # علاقة اختيارية مع المستخدم الذي استخدم الكود
     redeemed_by_user = relationship("User")
+
+
+class LedgerReason(str, enum.Enum):
+    """سبب تغيّر الرصيد في سجل wallet_transactions."""
+
+    STORY = "story"
+    IMAGE = "image"
+    VIDEO = "video"
+    REDEEM = "redeem"
+    REFUND = "refund"
+    ADMIN = "admin"
+    WELCOME_BONUS = "welcome_bonus"
+    # رصيد افتتاحي للمحافظ التي كانت موجودة قبل إضافة السجل
+    OPENING = "opening"
+
+
+class WalletTransaction(Base):
+    """
+    سجل (ledger) إضافي فقط لكل تغيّر في الرصيد.
+    wallets.balance_cents يبقى هو القراءة السريعة، ومجموع delta لكل محفظة يجب أن يساويه.
+    """
+
+    __tablename__ = "wallet_transactions"
+
+    id = Column(BigInteger, primary_key=True)
+    wallet_id = Column(Integer, ForeignKey("wallets.id"), nullable=False, index=True)
+
+    # موجب = إضافة، سالب = خصم
+    delta = Column(BigInteger, nullable=False)
+
+    # إحدى قيم LedgerReason
+    reason = Column(String(20), nullable=False)
+
+    # مرجع اختياري (رقم الكود، رقم مهمة الفيديو...)
+    ref = Column(String(64), nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class HoldStatus(str, enum.Enum):
+    HELD = "held"
+    COMMITTED = "committed"
+    RELEASED = "released"
+    EXPIRED = "expired"
+
+
+class WalletHold(Base):
+    """
+    حجز نقاط لطلب طويل (قصة/صورة/فيديو).
+    النقاط تُخصم من balance_cents عند الحجز (فيبقى balance_cents هو الرصيد المتاح)،
+    ثم يُثبَّت الحجز عند النجاح أو تُعاد النقاط عند الفشل أو انتهاء المهلة.
+    """
+
+    __tablename__ = "wallet_holds"
+
+    id = Column(BigInteger, primary_key=True)
+    wallet_id = Column(Integer, ForeignKey("wallets.id"), nullable=False)
+    amount = Column(BigInteger, nullable=False)
+
+    # LedgerReason للخدمة التي حُجزت لها النقاط
+    reason = Column(String(20), nullable=False)
+
+    # مرجع اختياري (مثلاً رقم مهمة الفيديو بعد إرسالها)
+    ref = Column(String(64), nullable=True)
+
+    # إحدى قيم HoldStatus
+    status = Column(String(12), nullable=False, default=HoldStatus.HELD.value)
+
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    settled_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # فهارس جزئية على الحجوزات النشطة فقط: لعرض "المحجوز" وللـ sweeper
+        Index(
+            "ix_wallet_holds_active_wallet",
+            "wallet_id",
+            postgresql_where=text("status = 'held'"),
+        ),
+        Index(
+            "ix_wallet_holds_active_expiry",
+            "expires_at",
+            postgresql_where=text("status = 'held'"),
+        ),
+    )
+
+
+class ReviewCacheEntry(Base):
+    """
+    نتيجة مراجعة (قصة/مقال) محفوظة حسب بصمة النص + نسخة البرومبت + الموديل،
+    حتى لا ندفع مرة أخرى عند إعادة إرسال نفس النص.
+    """
+
+    __tablename__ = "review_cache"
+
+    # sha256 بصيغة hex
+    key = Column(String(64), primary_key=True)
+
+    # story / article
+    kind = Column(String(20), nullable=False)
+    model = Column(String(64), nullable=False)
+
+    # نتيجة المراجعة كـ JSON
+    verdict = Column(Text, nullable=False)
+
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
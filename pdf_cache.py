@@ -0,0 +1,206 @@
+# pdf_cache.py
+"""
+كاش نص ملفات PDF المستخرج، بمفتاح file_unique_id من تيليجرام.
+
+نفس الملف يُرسل كثيراً مرتين (/publish ثم /article) أو يُعاد إرساله بعد تعديل الوصف فقط،
+و file_unique_id ثابت لنفس المحتوى، فالإصابة توفّر التحميل والتحليل معاً.
+
+طبقتان:
+    1) LRU داخل العملية محدود بالحجم (PDF_CACHE_MAX_MB) وليس بعدد الملفات
+    2) ملفات JSON مضغوطة (gzip) على القرص في PDF_CACHE_DIR (افتراضياً /var/data/pdf_cache
+       إذا كان ديسك Render موجوداً، مثل generate_codes.py)، تُحذف بعد PDF_CACHE_DISK_DAYS
+
+القيمة المحفوظة: النص (الصفحات مفصولة بـ PAGE_BREAK) وعدد الصفحات وعدد الكلمات.
+"""
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+# الصفحات في النص المحفوظ مفصولة بهذا الحرف، وكل مسار يعيد تجميعها بفاصله
+PAGE_BREAK = "\f"
+
+
+def _default_cache_dir() -> str:
+    if os.path.isdir("/var/data"):
+        return "/var/data/pdf_cache"
+    return ""
+
+
+PDF_CACHE_ENABLED = os.environ.get("PDF_CACHE_ENABLED", "1") == "1"
+PDF_CACHE_MAX_MB = float(os.environ.get("PDF_CACHE_MAX_MB", "64"))
+# فارغ = بدون طبقة القرص
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR", _default_cache_dir())
+PDF_CACHE_DISK_DAYS = float(os.environ.get("PDF_CACHE_DISK_DAYS", "30"))
+
+_MAX_BYTES = int(PDF_CACHE_MAX_MB * 1024 * 1024)
+_SAFE_KEY_RE = re.compile(r"^[A-Za-z0-9_-]{1,128}$")
+
+_lru = OrderedDict()          # key -> (entry, size)
+_lru_bytes = 0
+_lru_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "errors": 0}
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def pdf_cache_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    with _lru_lock:
+        stats["memory_bytes"] = _lru_bytes
+        stats["memory_entries"] = len(_lru)
+    return stats
+
+
+def _pdf_cache_metrics() -> list:
+    stats = pdf_cache_stats()
+    events = ("memory_hits", "disk_hits", "misses", "stores", "errors")
+    return [
+        (
+            "pdf_cache_events_total",
+            "counter",
+            "PDF extraction cache lookups and stores by event",
+            {f'{{event="{name}"}}': stats[name] for name in events},
+        ),
+        (
+            "pdf_cache_memory_bytes",
+            "gauge",
+            "Approximate size of extracted PDF text held in memory",
+            {"": stats["memory_bytes"]},
+        ),
+    ]
+
+
+register_collector(_pdf_cache_metrics)
+
+
+def _entry_size(entry: dict) -> int:
+    return sys.getsizeof(entry["text"]) + 200
+
+
+def _memory_get(key: str):
+    with _lru_lock:
+        item = _lru.get(key)
+        if item is None:
+            return None
+        _lru.move_to_end(key)
+        return item[0]
+
+
+def _memory_put(key: str, entry: dict) -> None:
+    global _lru_bytes
+    size = _entry_size(entry)
+    # ملف واحد يأخذ أكثر من ربع الكاش يُخرج الكثير من غيره، فيبقى على القرص فقط
+    if size > _MAX_BYTES // 4:
+        return
+    with _lru_lock:
+        old = _lru.pop(key, None)
+        if old is not None:
+            _lru_bytes -= old[1]
+        _lru[key] = (entry, size)
+        _lru_bytes += size
+        while _lru_bytes > _MAX_BYTES and _lru:
+            _, (_, evicted_size) = _lru.popitem(last=False)
+            _lru_bytes -= evicted_size
+
+
+def _disk_path(key: str) -> str:
+    return os.path.join(PDF_CACHE_DIR, f"{key}.json.gz")
+
+
+def _disk_get(key: str):
+    path = _disk_path(key)
+    try:
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            entry = json.load(f)
+        # مدة البقاء على القرص تُحسب من آخر استخدام
+        os.utime(path)
+        return entry
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        _count("errors")
+        logger.warning("PDF cache read failed (%s): %s", path, e)
+        return None
+
+
+def _disk_put(key: str, entry: dict) -> None:
+    path = _disk_path(key)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        _count("errors")
+        logger.warning("PDF cache write failed (%s): %s", path, e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def get_cached_extraction(key: str):
+    """يرجع القاموس المحفوظ (text, pages, total_pages, word_count, truncated) أو None."""
+    if not PDF_CACHE_ENABLED or not key or not _SAFE_KEY_RE.match(key):
+        return None
+
+    entry = _memory_get(key)
+    if entry is not None:
+        _count("memory_hits")
+        return entry
+
+    if PDF_CACHE_DIR:
+        entry = _disk_get(key)
+        if entry is not None:
+            _memory_put(key, entry)
+            _count("disk_hits")
+            return entry
+
+    _count("misses")
+    return None
+
+
+def store_extraction(key: str, entry: dict) -> None:
+    if not PDF_CACHE_ENABLED or not key or not _SAFE_KEY_RE.match(key):
+        return
+    _memory_put(key, entry)
+    if PDF_CACHE_DIR:
+        _disk_put(key, entry)
+    _count("stores")
+
+
+def purge_pdf_cache_dir(max_age_days: float = PDF_CACHE_DISK_DAYS) -> int:
+    """حذف ملفات الكاش الأقدم من max_age_days؛ يرجع عدد الملفات المحذوفة."""
+    if not PDF_CACHE_DIR or not os.path.isdir(PDF_CACHE_DIR):
+        return 0
+
+    cutoff = time.time() - max_age_days * 86400
+    removed = 0
+    with os.scandir(PDF_CACHE_DIR) as entries:
+        for item in entries:
+            if not item.name.endswith((".json.gz", ".tmp")):
+                continue
+            try:
+                if item.stat().st_mtime < cutoff:
+                    os.remove(item.path)
+                    removed += 1
+            except OSError:
+                pass
+    return removed
@@ -0,0 +1,354 @@
+# pdf_ingest.py
+"""
+قراءة نص ملفات PDF المرسلة للبوت (القصص والمقالات) من مكان واحد.
+
+- حجم الملف يُفحص من doc.file_size قبل التحميل، فلا نحمّل ملفاً سنرفضه.
+- التحميل يتم على دفعات إلى SpooledTemporaryFile ينتقل للقرص فوق PDF_SPOOL_MAX_MEMORY،
+  و PyPDF2 يقرأ من الملف نفسه بدل نسخة كاملة في الذاكرة.
+  (mmap لا يفيد هنا: PyPDF2 يمر على كل كائنات الصفحات فيلمس الملف كله)
+  (File.download في PTB 13 يحمّل الملف كاملاً في الذاكرة قبل كتابته في out، لذلك نحمّل من الرابط مباشرة)
+- نص الصفحات يُقرأ صفحة بصفحة (generator) ويُجمع في قائمة ثم join مرة واحدة.
+- القراءة تتوقف مبكراً عند تجاوز ميزانية الكلمات/الحروف التي يحتاجها المراجع:
+  ما بعدها لن يُراجع أصلاً، فلا داعي لاستخراجه.
+- النتيجة تُحفظ بمفتاح file_unique_id (pdf_cache.py)، فإعادة إرسال نفس الملف لا تحمّله ولا تحلله.
+- PyPDF2 بطيء ويحجز الـ GIL، فالتحميل والتحليل يتمان في عمليات منفصلة (ProcessPoolExecutor محدود)
+  مع مهلة وحد ذاكرة لكل ملف، والعمليات تُستبدل بعد PDF_WORKER_MAX_DOCS ملف.
+  خيط الـ handler ينتظر النتيجة فقط، وعملية البوت لا تحمل بايتات الملف أبداً.
+"""
+import logging
+import multiprocessing
+import os
+import signal
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass, replace
+
+import httpx
+import PyPDF2
+
+from pdf_cache import PAGE_BREAK, get_cached_extraction, store_extraction
+from story_prescreen import count_words
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# حد تيليجرام لتحميل الملفات عبر Bot API هو 20 ميجابايت
+PDF_MAX_BYTES = int(os.environ.get("PDF_MAX_BYTES", str(20 * 1024 * 1024)))
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", "1000"))
+# الملفات الأصغر من هذا تبقى في الذاكرة، والأكبر تنتقل لملف مؤقت على القرص
+PDF_SPOOL_MAX_MEMORY = int(os.environ.get("PDF_SPOOL_MAX_MEMORY", str(1024 * 1024)))
+PDF_SPOOL_DIR = os.environ.get("PDF_SPOOL_DIR") or None
+PDF_DOWNLOAD_CHUNK = 64 * 1024
+
+# 0 = التحليل داخل خيط الـ handler نفسه (للتشغيل المحلي أو أنظمة بدون forkserver)
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", "2"))
+# مهلة كل ملف (التحميل + التحليل)
+PDF_PARSE_TIMEOUT = float(os.environ.get("PDF_PARSE_TIMEOUT", "60"))
+# الذاكرة الإضافية المسموحة لكل عملية فوق حجمها عند البداية (0 = بلا حد)
+PDF_WORKER_MEMORY_MB = int(os.environ.get("PDF_WORKER_MEMORY_MB", "512"))
+PDF_WORKER_MAX_DOCS = int(os.environ.get("PDF_WORKER_MAX_DOCS", "25"))
+# أقصى انتظار لعملية متاحة قبل رفض الملف
+PDF_QUEUE_TIMEOUT = float(os.environ.get("PDF_QUEUE_TIMEOUT", "60"))
+
+
+class PdfParseError(Exception):
+    """تعذر تحميل الملف أو تحليله: تجاوز المهلة أو حد الذاكرة أو توقف العملية."""
+
+
+class PdfTooLarge(ValueError):
+    """حجم الملف أكبر من PDF_MAX_BYTES."""
+
+    def __init__(self, size: int, limit: int):
+        super().__init__(f"PDF is {size} bytes, limit is {limit}")
+        self.size = size
+        self.limit = limit
+
+    def __reduce__(self):
+        # يُرفع داخل عمليات التحليل ويُنقل للبوت بـ pickle
+        return PdfTooLarge, (self.size, self.limit)
+
+
+@dataclass
+class PdfText:
+    text: str
+    pages: int            # الصفحات التي قُرئت فعلاً
+    total_pages: int
+    word_count: int
+    truncated: bool       # توقفت القراءة قبل آخر صفحة (الميزانية أو PDF_MAX_PAGES)
+
+
+def check_document_size(doc, max_bytes: int = PDF_MAX_BYTES) -> None:
+    """يرفع PdfTooLarge قبل أي تحميل إذا أعلن تيليجرام حجماً أكبر من الحد."""
+    size = getattr(doc, "file_size", None) or 0
+    if size > max_bytes:
+        raise PdfTooLarge(size, max_bytes)
+
+
+def download_to_spool(url: str, max_bytes: int = PDF_MAX_BYTES) -> tempfile.SpooledTemporaryFile:
+    """
+    تحميل الرابط على دفعات إلى SpooledTemporaryFile؛ يرفع PdfTooLarge بمجرد تجاوز max_bytes
+    (file_size قد لا يرسله تيليجرام). أخطاء الشبكة تصبح PdfParseError بدون الرابط
+    لأنه يحتوي على توكن البوت.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=PDF_SPOOL_MAX_MEMORY, dir=PDF_SPOOL_DIR)
+    try:
+        size = 0
+        with httpx.stream("GET", url, timeout=httpx.Timeout(PDF_PARSE_TIMEOUT, connect=10)) as response:
+            if response.status_code >= 400:
+                raise PdfParseError(f"PDF download failed: HTTP {response.status_code}")
+            for chunk in response.iter_bytes(PDF_DOWNLOAD_CHUNK):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise PdfTooLarge(size, max_bytes)
+                spool.write(chunk)
+    except httpx.HTTPError as e:
+        spool.close()
+        raise PdfParseError(f"PDF download failed: {type(e).__name__}") from None
+    except Exception:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+def fetch_pdf_text(file_path: str, max_bytes: int = PDF_MAX_BYTES, **kwargs) -> PdfText:
+    """
+    file_path من doc.get_file(): رابط تحميل، أو مسار محلي عند تشغيل Bot API Server بوضع local.
+    يُستدعى داخل عمليات التحليل.
+    """
+    if not file_path.startswith(("http://", "https://")):
+        size = os.path.getsize(file_path)
+        if size > max_bytes:
+            raise PdfTooLarge(size, max_bytes)
+        with open(file_path, "rb") as f:
+            return extract_pdf_text(f, **kwargs)
+
+    with download_to_spool(file_path, max_bytes) as spool:
+        return extract_pdf_text(spool, **kwargs)
+
+
+def iter_page_texts(reader: PyPDF2.PdfReader, max_pages: int = PDF_MAX_PAGES):
+    """نص كل صفحة عند طلبه فقط؛ لا شيء يُستخرج من صفحات لن نصل إليها."""
+    for index, page in enumerate(reader.pages):
+        if index >= max_pages:
+            return
+        yield page.extract_text() or ""
+
+
+def _assemble(
+    page_texts,
+    total_pages: int,
+    separator: str,
+    max_words: int | None,
+    max_chars: int | None,
+) -> PdfText:
+    parts = []
+    words = chars = 0
+    for page_text in page_texts:
+        parts.append(page_text)
+        words += count_words(page_text)
+        chars += len(page_text) + len(separator)
+        if (max_words is not None and words > max_words) or (max_chars is not None and chars > max_chars):
+            break
+
+    return PdfText(
+        text=separator.join(parts),
+        pages=len(parts),
+        total_pages=total_pages,
+        word_count=words,
+        truncated=len(parts) < total_pages,
+    )
+
+
+def extract_pdf_text(
+    stream,
+    separator: str = "\n",
+    max_words: int | None = None,
+    max_chars: int | None = None,
+    max_pages: int = PDF_MAX_PAGES,
+) -> PdfText:
+    """
+    يستخرج النص حتى تتجاوز الصفحات المقروءة max_words كلمة أو max_chars حرفاً.
+    الصفحة التي تتجاوز الحد تُضاف كاملة، فالنص الناتج أطول من الحد إذا كان الملف أطول منه
+    (وهذا يكفي الفحص المحلي ليرفض النص الطويل).
+    """
+    reader = PyPDF2.PdfReader(stream)
+    return _assemble(iter_page_texts(reader, max_pages), len(reader.pages), separator, max_words, max_chars)
+
+
+def _cached_covers(entry: dict, max_words: int | None, max_chars: int | None) -> bool:
+    """هل النص المحفوظ يكفي هذا الطلب؟ (قُرئ كاملاً، أو تجاوز ميزانية هذا الطلب أيضاً)"""
+    if entry["pages"] >= min(entry["total_pages"], PDF_MAX_PAGES):
+        return True
+    return (
+        (max_chars is not None and len(entry["text"]) >= max_chars)
+        or (max_words is not None and entry["word_count"] > max_words)
+    )
+
+
+def read_pdf_document(
+    doc,
+    separator: str = "\n",
+    max_words: int | None = None,
+    max_chars: int | None = None,
+) -> PdfText:
+    """
+    نص ملف Document من تيليجرام: من الكاش (file_unique_id) إن وُجد،
+    وإلا فحص الحجم ثم التحميل ثم الاستخراج في عملية منفصلة.
+    """
+    key = getattr(doc, "file_unique_id", None)
+    cached = get_cached_extraction(key)
+    if cached is not None and _cached_covers(cached, max_words, max_chars):
+        # نعيد تطبيق ميزانية هذا الطلب وفاصله على صفحات النص المحفوظ
+        pages = cached["text"].split(PAGE_BREAK)
+        return _assemble(pages, cached["total_pages"], separator, max_words, max_chars)
+
+    check_document_size(doc)
+    # getFile فقط (بدون تحميل)؛ التحميل نفسه داخل عملية التحليل
+    file_path = doc.get_file().file_path
+
+    # نخزّن الصفحات بفاصل PAGE_BREAK حتى يستفيد منها المسار الآخر (قصة/مقال) أيضاً
+    parsed = parse_pdf(
+        file_path,
+        separator=PAGE_BREAK,
+        max_words=max_words,
+        max_chars=max_chars,
+    )
+    store_extraction(key, asdict(parsed))
+
+    if separator != PAGE_BREAK:
+        parsed = replace(parsed, text=parsed.text.replace(PAGE_BREAK, separator))
+    return parsed
+
+
+# =============== تحليل PDF في عمليات منفصلة ===============
+
+_pool_lock = threading.Lock()
+_executor = None
+_executor_docs = 0
+# لا نرسل للـ pool أكثر من عدد عملياته: كل ملف يبدأ فوراً فتقيس المهلة ملفه وحده،
+# وقتل pool بعد تجاوز المهلة لا يصيب ملفات ما زالت تنتظر في طابوره الداخلي
+_slots = threading.BoundedSemaphore(max(PDF_WORKERS, 1))
+# executor -> SimpleQueue فيها أرقام عملياته (يضعها _init_worker)
+_worker_pids = weakref.WeakKeyDictionary()
+
+
+def _limit_worker_memory(extra_mb: int) -> None:
+    """
+    حد لمساحة العناوين = حجم العملية عند بدايتها + extra_mb.
+    (حد مطلق لا يصلح: العملية ترث من forkserver ما حمّله مسبقاً من مكتبات)
+    """
+    if not extra_mb or resource is None:
+        return
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return
+    limit = current + extra_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _init_worker(extra_mb: int, pids) -> None:
+    """initializer لكل عملية: حد الذاكرة، وإبلاغ البوت برقم العملية حتى يستطيع قتلها عند المهلة."""
+    _limit_worker_memory(extra_mb)
+    pids.put(os.getpid())
+
+
+def _parse_in_worker(file_path: str, limits: dict) -> PdfText:
+    return fetch_pdf_text(file_path, **limits)
+
+
+def _new_executor() -> ProcessPoolExecutor:
+    # forkserver: العمليات تُنشأ من عملية نظيفة بلا خيوط البوت (PTB و lanes و pools) ولا اتصالاته
+    # المفتوحة (Telegram و psycopg2 و socket الـ uvicorn)، فلا ترث قفلاً محجوزاً ولا ملفات مفتوحة.
+    # ملاحظة: multiprocessing يعيد استيراد السكربت الرئيسي في كل عملية باسم __mp_main__؛
+    # مع uvicorn هذا هو ملف التشغيل المحمي بـ __main__، أما مع python bot.py (polling محلي)
+    # فيُنفَّذ أعلى bot.py في كل عملية (PDF_WORKERS=0 يتجنب ذلك محلياً).
+    ctx = multiprocessing.get_context("forkserver")
+    ctx.set_forkserver_preload(["pdf_ingest"])
+    pids = ctx.SimpleQueue()
+    executor = ProcessPoolExecutor(
+        max_workers=PDF_WORKERS,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(PDF_WORKER_MEMORY_MB, pids),
+    )
+    _worker_pids[executor] = pids
+    return executor
+
+
+def _acquire_executor() -> ProcessPoolExecutor:
+    """الـ pool الحالي؛ بعد PDF_WORKER_MAX_DOCS ملف نبدأ pool جديداً ونترك القديم يُنهي ما عنده."""
+    global _executor, _executor_docs
+    with _pool_lock:
+        if _executor is None or _executor_docs >= PDF_WORKER_MAX_DOCS:
+            old = _executor
+            _executor, _executor_docs = _new_executor(), 0
+            if old is not None:
+                old.shutdown(wait=False)
+        _executor_docs += 1
+        return _executor
+
+
+def _kill_workers(executor: ProcessPoolExecutor) -> None:
+    # لا توجد طريقة عامة لإيقاف مهمة بدأت في ProcessPoolExecutor، فنقتل عملياته بأرقامها
+    pids = _worker_pids.get(executor)
+    if pids is None:
+        return
+    while not pids.empty():
+        pid = pids.get()
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+
+def _discard_executor(executor: ProcessPoolExecutor, kill: bool = False) -> None:
+    global _executor
+    with _pool_lock:
+        if _executor is executor:
+            _executor = None
+    if kill:
+        _kill_workers(executor)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_pdf(file_path: str, **kwargs) -> PdfText:
+    """
+    fetch_pdf_text (تحميل + استخراج) في عملية منفصلة بمهلة PDF_PARSE_TIMEOUT.
+    يرفع PdfParseError عند المهلة أو تجاوز الذاكرة أو عدم توفر عملية خلال PDF_QUEUE_TIMEOUT.
+    """
+    if PDF_WORKERS <= 0:
+        return fetch_pdf_text(file_path, **kwargs)
+
+    if not _slots.acquire(timeout=PDF_QUEUE_TIMEOUT):
+        raise PdfParseError("no PDF worker available")
+    try:
+        for attempt in (1, 2):
+            executor = _acquire_executor()
+            try:
+                future = executor.submit(_parse_in_worker, file_path, kwargs)
+                return future.result(timeout=PDF_PARSE_TIMEOUT)
+            except FutureTimeout:
+                logger.warning("PDF parse timed out after %gs", PDF_PARSE_TIMEOUT)
+                _discard_executor(executor, kill=True)
+                raise PdfParseError("PDF parse timed out")
+            except MemoryError:
+                logger.warning("PDF parse hit the memory ceiling (%d MB)", PDF_WORKER_MEMORY_MB)
+                raise PdfParseError("PDF parse exceeded memory limit")
+            except BrokenProcessPool:
+                # عملية ماتت (ملف آخر تجاوز مهلته أو قتلها النظام)؛ نعيد مرة واحدة على pool جديد
+                _discard_executor(executor)
+                if attempt == 2:
+                    raise PdfParseError("PDF worker crashed")
+    finally:
+        _slots.release()
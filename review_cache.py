@@ -0,0 +1,207 @@
+# review_cache.py
+"""
+كاش نتائج مراجعة القصص والمقالات بالذكاء الاصطناعي.
+
+المفتاح = sha256(نوع المراجعة + نسخة البرومبت + الموديل + النص بعد التطبيع)،
+فإعادة إرسال نفس النص (أو نفس الـ PDF) ترجع النتيجة المحفوظة فوراً وبدون أي tokens.
+
+طبقتان:
+    1) LRU داخل العملية (سريع، يضيع عند إعادة التشغيل)
+    2) جدول review_cache في Postgres مع مدة صلاحية (REVIEW_CACHE_TTL_DAYS)
+
+تغيير نص البرومبت يغيّر بصمته (prompt_version) فتتجاهل المفاتيح القديمة تلقائياً.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import text
+
+from database import current_session, release_connection
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+REVIEW_CACHE_SIZE = int(os.environ.get("REVIEW_CACHE_SIZE", "2000"))
+REVIEW_CACHE_TTL_DAYS = float(os.environ.get("REVIEW_CACHE_TTL_DAYS", "30"))
+REVIEW_CACHE_ENABLED = os.environ.get("REVIEW_CACHE_ENABLED", "1") == "1"
+
+# التشكيل العربي والتطويل لا يغيّران حكم المراجعة
+_ARABIC_MARKS_RE = re.compile("[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {"lru_hits": 0, "db_hits": 0, "misses": 0, "stores": 0, "errors": 0}
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def review_cache_stats() -> dict:
+    """عدد الإصابات (من كل طبقة) والإخفاقات منذ تشغيل العملية."""
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _review_cache_metrics() -> list:
+    stats = review_cache_stats()
+    return [(
+        "review_cache_events_total",
+        "counter",
+        "Review cache lookups and stores by event",
+        {f'{{event="{name}"}}': value for name, value in stats.items()},
+    )]
+
+
+register_collector(_review_cache_metrics)
+
+
+def prompt_version(prompt: str) -> str:
+    """بصمة قصيرة لنص البرومبت تُستخدم كنسخة له داخل المفتاح."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def normalize_review_text(raw: str) -> str:
+    normalized = unicodedata.normalize("NFKC", raw or "")
+    normalized = _ARABIC_MARKS_RE.sub("", normalized)
+    return _WHITESPACE_RE.sub(" ", normalized).strip()
+
+
+def review_cache_key(kind: str, version: str, model: str, raw_text: str) -> str:
+    h = hashlib.sha256()
+    for part in (kind, version, model):
+        h.update(part.encode("utf-8"))
+        h.update(b"\x00")
+    h.update(normalize_review_text(raw_text).encode("utf-8"))
+    return h.hexdigest()
+
+
+def _lru_get(key: str):
+    now = datetime.utcnow()
+    with _lru_lock:
+        entry = _lru.get(key)
+        if entry is None:
+            return None
+        verdict, expires_at = entry
+        if expires_at <= now:
+            del _lru[key]
+            return None
+        _lru.move_to_end(key)
+        return verdict
+
+
+def _lru_put(key: str, verdict: dict, expires_at: datetime) -> None:
+    with _lru_lock:
+        _lru[key] = (verdict, expires_at)
+        _lru.move_to_end(key)
+        while len(_lru) > REVIEW_CACHE_SIZE:
+            _lru.popitem(last=False)
+
+
+def get_cached_review(key: str):
+    """يرجع نسخة من نتيجة المراجعة المحفوظة أو None."""
+    if not REVIEW_CACHE_ENABLED:
+        return None
+
+    verdict = _lru_get(key)
+    if verdict is not None:
+        _count("lru_hits")
+        return dict(verdict)
+
+    db = current_session()
+    try:
+        row = db.execute(
+            text(
+                "SELECT verdict, expires_at FROM review_cache "
+                "WHERE key = :key AND expires_at > :now"
+            ),
+            {"key": key, "now": datetime.utcnow()},
+        ).first()
+        release_connection(db)
+    except Exception as e:
+        # الكاش لا يجب أن يعطّل المراجعة: نعامل الخطأ كإخفاق
+        db.rollback()
+        _count("errors")
+        logger.warning("Review cache lookup failed: %s", e)
+        row = None
+
+    if row is None:
+        _count("misses")
+        return None
+
+    verdict = json.loads(row.verdict)
+    _lru_put(key, verdict, row.expires_at)
+    _count("db_hits")
+    return dict(verdict)
+
+
+def store_review(key: str, kind: str, model: str, verdict: dict) -> None:
+    """حفظ نتيجة مراجعة ناجحة في الطبقتين (أخطاء الخدمة لا تُحفظ)."""
+    if not REVIEW_CACHE_ENABLED:
+        return
+
+    expires_at = datetime.utcnow() + timedelta(days=REVIEW_CACHE_TTL_DAYS)
+    _lru_put(key, dict(verdict), expires_at)
+
+    db = current_session()
+    try:
+        db.execute(
+            text(
+                """
+                INSERT INTO review_cache (key, kind, model, verdict, created_at, expires_at)
+                VALUES (:key, :kind, :model, :verdict, :now, :expires_at)
+                ON CONFLICT (key) DO UPDATE
+                   SET verdict = EXCLUDED.verdict,
+                       created_at = EXCLUDED.created_at,
+                       expires_at = EXCLUDED.expires_at
+                """
+            ),
+            {
+                "key": key,
+                "kind": kind,
+                "model": model,
+                "verdict": json.dumps(verdict, ensure_ascii=False),
+                "now": datetime.utcnow(),
+                "expires_at": expires_at,
+            },
+        )
+        db.commit()
+        _count("stores")
+    except Exception as e:
+        db.rollback()
+        _count("errors")
+        logger.warning("Review cache store failed: %s", e)
+
+
+def purge_expired_reviews(db, limit: int = 5000) -> int:
+    """حذف النتائج المنتهية من Postgres على دفعات؛ يرجع عدد الصفوف المحذوفة."""
+    total = 0
+    while True:
+        deleted = db.execute(
+            text(
+                """
+                DELETE FROM review_cache
+                 WHERE key IN (
+                       SELECT key FROM review_cache
+                        WHERE expires_at <= :now
+                        LIMIT :limit
+                 )
+                """
+            ),
+            {"now": datetime.utcnow(), "limit": limit},
+        ).rowcount
+        db.commit()
+        total += deleted
+        if deleted < limit:
+            return total
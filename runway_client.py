@@ -0,0 +1,215 @@
+# runway_client.py
+"""
+عميل Runway بمجموعة اتصالات (pool) مع keep-alive، بنسخة متزامنة وأخرى async.
+
+- الـ headers تُبنى مرة واحدة عند إنشاء العميل.
+- متابعة عشرات المهام تعيد استخدام عدد قليل من الاتصالات بدل فتح اتصال TLS لكل استعلام.
+- الردود تتحول إلى RunwayTask بدل قواميس خام في كل مكان.
+- مهلة الاتصال والقراءة وحجم الـ pool من متغيرات البيئة (RUNWAY_*).
+
+fake_runway.py خادم Runway محلي للاختبار والقياس (bench_runway_client.py).
+"""
+import logging
+import os
+from dataclasses import dataclass, field
+
+import httpx
+
+from metrics import observe_runway_call
+
+logger = logging.getLogger(__name__)
+
+RUNWAY_BASE_URL = os.environ.get("RUNWAY_BASE_URL", "https://api.dev.runwayml.com/v1")
+RUNWAY_API_VERSION = os.environ.get("RUNWAY_API_VERSION", "2024-11-06")
+
+RUNWAY_CONNECT_TIMEOUT = float(os.environ.get("RUNWAY_CONNECT_TIMEOUT", "5"))
+RUNWAY_READ_TIMEOUT = float(os.environ.get("RUNWAY_READ_TIMEOUT", "30"))
+RUNWAY_MAX_CONNECTIONS = int(os.environ.get("RUNWAY_MAX_CONNECTIONS", "10"))
+# كل اتصال زائد عن الـ keep-alive يُغلق بعد طلبه، فنبقيهما متساويين افتراضياً
+RUNWAY_MAX_KEEPALIVE = int(os.environ.get("RUNWAY_MAX_KEEPALIVE", str(RUNWAY_MAX_CONNECTIONS)))
+RUNWAY_KEEPALIVE_EXPIRY = float(os.environ.get("RUNWAY_KEEPALIVE_EXPIRY", "60"))
+
+RUNWAY_TERMINAL_STATUSES = ("SUCCEEDED", "FAILED", "ABORTED", "CANCELED", "CANCELLED")
+
+
+class RunwayError(Exception):
+    """فشل طلب Runway؛ status_code = None عند فشل الاتصال نفسه."""
+
+    def __init__(self, message: str, status_code: int | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class RunwayTask:
+    id: str
+    status: str = ""
+    progress: float | None = None
+    output: list = field(default_factory=list)
+    failure: str = ""
+    raw: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "RunwayTask":
+        if not isinstance(data, dict) or not data.get("id"):
+            raise RunwayError(f"unexpected task payload: {str(data)[:200]}")
+
+        progress = data.get("progress")
+        output = data.get("output")
+        if isinstance(output, str):
+            output = [output]
+        return cls(
+            id=str(data["id"]),
+            status=str(data.get("status") or "").upper(),
+            progress=float(progress) if isinstance(progress, (int, float)) else None,
+            output=list(output or []),
+            failure=str(data.get("failure") or ""),
+            raw=data,
+        )
+
+    @property
+    def is_terminal(self) -> bool:
+        return self.status in RUNWAY_TERMINAL_STATUSES
+
+    @property
+    def succeeded(self) -> bool:
+        return self.status == "SUCCEEDED"
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=RUNWAY_MAX_CONNECTIONS,
+        max_keepalive_connections=RUNWAY_MAX_KEEPALIVE,
+        keepalive_expiry=RUNWAY_KEEPALIVE_EXPIRY,
+    )
+
+
+class _RunwayBase:
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = RUNWAY_BASE_URL,
+        version: str = RUNWAY_API_VERSION,
+        connect_timeout: float = RUNWAY_CONNECT_TIMEOUT,
+        read_timeout: float = RUNWAY_READ_TIMEOUT,
+    ):
+        if not api_key:
+            raise RunwayError("Video AI service key is not set.")
+        self.base_url = base_url.rstrip("/")
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "X-Runway-Version": version,
+        }
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+
+    @staticmethod
+    def _text_to_video_payload(prompt: str, model: str, ratio: str, duration: int, audio: bool) -> dict:
+        return {
+            "model": model,
+            "promptText": prompt,
+            "ratio": ratio,
+            "audio": audio,
+            "duration": duration,
+        }
+
+    @staticmethod
+    def _parse(response: httpx.Response, call: dict) -> dict:
+        if response.status_code >= 400:
+            call["outcome"] = f"http_{response.status_code}"
+            raise RunwayError(
+                f"Video AI service error: {response.status_code} {response.text[:500]}",
+                status_code=response.status_code,
+            )
+        try:
+            return response.json()
+        except ValueError:
+            call["outcome"] = "bad_json"
+            raise RunwayError("Video AI service returned invalid JSON", status_code=response.status_code)
+
+
+class RunwayClient(_RunwayBase):
+    """عميل متزامن (للـ handlers والـ poller في خيوط PTB)، آمن للاستخدام من عدة خيوط."""
+
+    def __init__(self, api_key: str, transport: httpx.BaseTransport | None = None, **kwargs):
+        super().__init__(api_key, **kwargs)
+        self._http = httpx.Client(
+            base_url=self.base_url,
+            headers=self.headers,
+            timeout=self.timeout,
+            limits=_limits(),
+            transport=transport,
+        )
+
+    def _request(self, operation: str, method: str, path: str, **kwargs) -> dict:
+        with observe_runway_call(operation) as call:
+            try:
+                response = self._http.request(method, path, **kwargs)
+            except httpx.HTTPError as e:
+                call["outcome"] = type(e).__name__
+                raise RunwayError(f"Video AI connection error: {e}") from e
+            return self._parse(response, call)
+
+    def create_text_to_video(
+        self, prompt: str, model: str, ratio: str, duration: int, audio: bool = False,
+    ) -> RunwayTask:
+        data = self._request(
+            "create", "POST", "/text_to_video",
+            json=self._text_to_video_payload(prompt, model, ratio, duration, audio),
+        )
+        return RunwayTask.from_dict(data)
+
+    def get_task(self, task_id: str) -> RunwayTask:
+        return RunwayTask.from_dict(self._request("status", "GET", f"/tasks/{task_id}"))
+
+    def close(self) -> None:
+        self._http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncRunwayClient(_RunwayBase):
+    """نفس العميل فوق httpx.AsyncClient لمتابعة مهام كثيرة في event loop واحد."""
+
+    def __init__(self, api_key: str, transport: httpx.AsyncBaseTransport | None = None, **kwargs):
+        super().__init__(api_key, **kwargs)
+        self._http = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers=self.headers,
+            timeout=self.timeout,
+            limits=_limits(),
+            transport=transport,
+        )
+
+    async def _request(self, operation: str, method: str, path: str, **kwargs) -> dict:
+        with observe_runway_call(operation) as call:
+            try:
+                response = await self._http.request(method, path, **kwargs)
+            except httpx.HTTPError as e:
+                call["outcome"] = type(e).__name__
+                raise RunwayError(f"Video AI connection error: {e}") from e
+            return self._parse(response, call)
+
+    async def create_text_to_video(
+        self, prompt: str, model: str, ratio: str, duration: int, audio: bool = False,
+    ) -> RunwayTask:
+        data = await self._request(
+            "create", "POST", "/text_to_video",
+            json=self._text_to_video_payload(prompt, model, ratio, duration, audio),
+        )
+        return RunwayTask.from_dict(data)
+
+    async def get_task(self, task_id: str) -> RunwayTask:
+        return RunwayTask.from_dict(await self._request("status", "GET", f"/tasks/{task_id}"))
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
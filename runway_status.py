@@ -0,0 +1,138 @@
+# runway_status.py
+"""
+كاش لحالة مهام Runway مع دمج الطلبات المتزامنة (single-flight).
+
+- المهمة قيد التنفيذ: الحالة تُحفظ RUNWAY_STATUS_TTL ثانية فقط.
+- المهمة المنتهية (SUCCEEDED / FAILED ...): الحالة لا تتغير بعدها، فتبقى في الكاش
+  (بحد أقصى RUNWAY_STATUS_CACHE_SIZE مهمة، الأقدم استخداماً يُحذف أولاً).
+- عدة استعلامات متزامنة عن نفس الرقم = طلب واحد فقط إلى Runway، والباقي ينتظر نتيجته.
+
+الـ poller و /video_status يستخدمان نفس الكاش.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import register_collector
+from runway_client import RUNWAY_TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+RUNWAY_STATUS_TTL = float(os.environ.get("RUNWAY_STATUS_TTL", "5"))
+RUNWAY_STATUS_CACHE_SIZE = int(os.environ.get("RUNWAY_STATUS_CACHE_SIZE", "2000"))
+# 0 = المهام المنتهية لا تنتهي صلاحيتها في الكاش
+RUNWAY_TERMINAL_TTL = float(os.environ.get("RUNWAY_TERMINAL_TTL", "0"))
+# أقصى انتظار لنتيجة طلب يقوم به خيط آخر (أطول من مهلة طلب Runway نفسه)
+RUNWAY_STATUS_WAIT = float(os.environ.get("RUNWAY_STATUS_WAIT", "40"))
+
+
+class _Flight:
+    """طلب جارٍ إلى Runway لرقم مهمة؛ من يأتي بعده ينتظر event."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+_lock = threading.Lock()
+_entries = OrderedDict()     # task_id -> (expires_at أو None, result)
+_flights = {}                # task_id -> _Flight
+_stats = {"hit": 0, "miss": 0, "coalesced": 0}
+
+
+def _ttl_for(result: dict):
+    """مدة بقاء النتيجة في الكاش؛ None = دائمة، 0 = لا تُحفظ."""
+    if not result.get("ok"):
+        # رقم غير موجود لن يظهر بعد ثوانٍ، فنحفظه قليلاً ضد تكرار نفس الرقم الخاطئ
+        return RUNWAY_STATUS_TTL if result.get("status_code") == 404 else 0
+
+    data = result.get("data") or {}
+    status = str(data.get("status", "")).upper()
+    if status in RUNWAY_TERMINAL_STATUSES:
+        return RUNWAY_TERMINAL_TTL or None
+    return RUNWAY_STATUS_TTL
+
+
+def _store(task_id: str, result: dict) -> None:
+    ttl = _ttl_for(result)
+    if ttl == 0:
+        _entries.pop(task_id, None)
+        return
+    expires_at = None if ttl is None else time.monotonic() + ttl
+    _entries[task_id] = (expires_at, result)
+    _entries.move_to_end(task_id)
+    while len(_entries) > RUNWAY_STATUS_CACHE_SIZE:
+        _entries.popitem(last=False)
+
+
+def get_task_status(task_id: str, fetch) -> dict:
+    """
+    يرجع نتيجة fetch(task_id) بنفس الشكل ({"ok": ..., "data"/"error": ...})،
+    من الكاش إن كانت صالحة، وإلا بطلب واحد مهما كان عدد المستعلمين في نفس اللحظة.
+    النتيجة مشتركة بين المستعلمين فلا تُعدَّل.
+    """
+    with _lock:
+        entry = _entries.get(task_id)
+        if entry is not None:
+            expires_at, result = entry
+            if expires_at is None or expires_at > time.monotonic():
+                _entries.move_to_end(task_id)
+                _stats["hit"] += 1
+                return result
+            del _entries[task_id]
+
+        flight = _flights.get(task_id)
+        leader = flight is None
+        if leader:
+            flight = _flights[task_id] = _Flight()
+            _stats["miss"] += 1
+        else:
+            _stats["coalesced"] += 1
+
+    if not leader:
+        if flight.event.wait(RUNWAY_STATUS_WAIT) and flight.result is not None:
+            return flight.result
+        return {"ok": False, "error": "انتهت مهلة انتظار حالة مهمة الفيديو."}
+
+    result = None
+    try:
+        result = fetch(task_id)
+    except Exception as e:
+        logger.exception("Runway status fetch failed (%s): %s", task_id, e)
+        result = {"ok": False, "error": "فشل جلب حالة مهمة إنشاء الفيديو."}
+    finally:
+        with _lock:
+            if result is not None:
+                _store(task_id, result)
+            _flights.pop(task_id, None)
+        flight.result = result
+        flight.event.set()
+    return result
+
+
+def runway_status_stats() -> dict:
+    with _lock:
+        return dict(_stats, size=len(_entries), inflight=len(_flights))
+
+
+def _runway_status_metrics() -> list:
+    stats = runway_status_stats()
+    return [
+        (
+            "runway_status_lookups_total",
+            "counter",
+            "Runway task status lookups (coalesced = waited on an in-flight request)",
+            {f'{{result="{name}"}}': stats[name] for name in ("hit", "miss", "coalesced")},
+        ),
+        (
+            "runway_status_cache_entries",
+            "gauge",
+            "Runway task statuses currently cached",
+            {"": stats["size"]},
+        ),
+    ]
+
+
+register_collector(_runway_status_metrics)
@@ -0,0 +1,139 @@
+# scheduler.py
+"""
+جدولة عادلة لطلبات الذكاء الاصطناعي بين المستخدمين (weighted fair queuing).
+
+كل مستخدم له "وقت افتراضي" يتقدم بقدر تكلفة طلباته (start-time fair queuing)،
+والعامل التالي يأخذ دائماً الطلب ذا علامة البداية الأصغر. فمن يرسل /image ثم /write ثم /video متتالية
+لا يحجز كل العمال: طلبه الثاني يأتي بعد الطلب الأول لكل مستخدم آخر في الطابور.
+
+بالإضافة إلى حد أقصى لعدد الطلبات (قيد التنفيذ + في الطابور) لكل مستخدم عبر كل المسارات.
+"""
+import heapq
+import itertools
+import logging
+import os
+import threading
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+AI_MAX_INFLIGHT_PER_USER = int(os.environ.get("AI_MAX_INFLIGHT_PER_USER", "2"))
+
+
+class SchedulerRejected(Exception):
+    """رفض الطلب: الطابور ممتلئ أو تجاوز المستخدم حده."""
+
+    QUEUE_FULL = "queue_full"
+    USER_LIMIT = "user_limit"
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class _UserInflight:
+    """عدد طلبات كل مستخدم الحالية (مشترك بين كل الجداول)."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._counts = Counter()
+        self._lock = threading.Lock()
+
+    def acquire(self, user_id) -> bool:
+        with self._lock:
+            if self._counts[user_id] >= self.limit:
+                return False
+            self._counts[user_id] += 1
+            return True
+
+    def release(self, user_id) -> None:
+        with self._lock:
+            self._counts[user_id] -= 1
+            if self._counts[user_id] <= 0:
+                del self._counts[user_id]
+
+
+USER_INFLIGHT = _UserInflight(AI_MAX_INFLIGHT_PER_USER)
+
+
+class FairScheduler:
+    """
+    workers  : عدد الخيوط العاملة
+    max_queue: أقصى عدد طلبات منتظرة (غير قيد التنفيذ)
+    """
+
+    def __init__(self, name: str, workers: int, max_queue: int, inflight: _UserInflight = USER_INFLIGHT):
+        self.name = name
+        self.workers = workers
+        self.max_queue = max_queue
+        self._inflight = inflight
+
+        self._cv = threading.Condition()
+        self._heap = []              # (start_tag, seq, user_id, func)
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish = {}       # user_id -> آخر علامة انتهاء
+        self._running = 0
+
+        for i in range(workers):
+            threading.Thread(
+                target=self._worker,
+                name=f"fair-{name}-{i}",
+                daemon=True,
+            ).start()
+
+    def submit(self, user_id, func, cost: float = 1.0) -> int:
+        """
+        يضيف func للطابور ويرجع ترتيبه (0 = سيبدأ فوراً لوجود عامل متاح).
+        يرفع SchedulerRejected إذا امتلأ الطابور أو تجاوز المستخدم حده.
+        """
+        with self._cv:
+            if len(self._heap) >= self.max_queue and self._running >= self.workers:
+                raise SchedulerRejected(SchedulerRejected.QUEUE_FULL)
+            if not self._inflight.acquire(user_id):
+                raise SchedulerRejected(SchedulerRejected.USER_LIMIT)
+
+            start = max(self._virtual_time, self._last_finish.get(user_id, 0.0))
+            self._last_finish[user_id] = start + cost
+
+            entry = (start, next(self._seq), user_id, func)
+            heapq.heappush(self._heap, entry)
+
+            idle = self.workers - self._running
+            ahead = sum(1 for other in self._heap if other[:2] < entry[:2])
+            position = 0 if ahead < idle else ahead - idle + 1
+
+            self._cv.notify()
+            return position
+
+    def stats(self) -> dict:
+        with self._cv:
+            return {"queued": len(self._heap), "running": self._running, "users": len(self._last_finish)}
+
+    def _worker(self) -> None:
+        while True:
+            with self._cv:
+                while not self._heap:
+                    self._cv.wait()
+                start, _, user_id, func = heapq.heappop(self._heap)
+                # الوقت الافتراضي = علامة بداية آخر طلب بدأ تنفيذه
+                self._virtual_time = max(self._virtual_time, start)
+                self._running += 1
+                self._forget_idle_users()
+
+            try:
+                func()
+            except Exception:
+                logger.exception("Scheduled job failed in %s", self.name)
+            finally:
+                self._inflight.release(user_id)
+                with self._cv:
+                    self._running -= 1
+
+    def _forget_idle_users(self) -> None:
+        # مستخدم علامته أقدم من الوقت الافتراضي لا يكسب شيئاً من بقائه في القاموس
+        if len(self._last_finish) > 4 * (self.max_queue + self.workers):
+            queued = {entry[2] for entry in self._heap}
+            for user_id, tag in list(self._last_finish.items()):
+                if tag <= self._virtual_time and user_id not in queued:
+                    del self._last_finish[user_id]
@@ -0,0 +1,136 @@
+# story_prescreen.py
+"""
+فحص محلي سريع للقصص قبل إرسالها لمراجعة الذكاء الاصطناعي.
+
+يرفض فوراً (وبدون أي tokens) القصص التي لا يمكن قبولها أصلاً:
+قصيرة جداً، أو ليست بالعربية، أو فيها أسطر مكررة كثيرة، أو نص تالف من PDF، أو طويلة جداً.
+الأرقام المحسوبة هنا تُمرَّر للموديل حتى لا يعيد عدّ الكلمات.
+"""
+import os
+import re
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+
+STORY_MIN_WORDS = int(os.environ.get("STORY_MIN_WORDS", "900"))
+STORY_MAX_CHARS = int(os.environ.get("STORY_MAX_CHARS", "120000"))
+STORY_MIN_ARABIC_RATIO = float(os.environ.get("STORY_MIN_ARABIC_RATIO", "0.6"))
+STORY_MAX_REPEATED_LINES = float(os.environ.get("STORY_MAX_REPEATED_LINES", "0.3"))
+STORY_MIN_LETTER_RATIO = float(os.environ.get("STORY_MIN_LETTER_RATIO", "0.7"))
+
+# الحروف العربية الأساسية والموسّعة (بدون التشكيل والتطويل)
+_ARABIC_LETTER = "\u0621-\u063A\u0641-\u064A\u0671-\u06D3\u06FA-\u06FC"
+_ARABIC_MARKS = "\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06ED\u0640"
+
+# الكلمة: حروف (عربية أو لاتينية) وأرقام، والتشكيل داخلها لا يقطعها
+_WORD_RE = re.compile(f"[{_ARABIC_LETTER}{_ARABIC_MARKS}A-Za-z0-9\u0660-\u0669]+")
+_ARABIC_RE = re.compile(f"[{_ARABIC_LETTER}]")
+_LATIN_RE = re.compile("[A-Za-z]")
+# التشكيل والأرقام جزء طبيعي من النص وليست "رموزاً"
+_MARK_OR_DIGIT_RE = re.compile(f"[{_ARABIC_MARKS}0-9\u0660-\u0669]")
+_SPACE_RE = re.compile(r"\s+")
+# أحرف تدل على استخراج تالف من PDF: حرف الاستبدال، أحرف التحكم، والمنطقة الخاصة
+_GARBAGE_RE = re.compile("[\ufffd\u0000-\u0008\u000e-\u001f\ue000-\uf8ff]")
+# 30 تكراراً متتالياً لنفس الحرف/الرقم؛ المسافات والترقيم والتطويل مستثناة لأنها طبيعية في
+# نص PDF (عناوين في الوسط، فواصل ----، نقاط ……، تطويل للزخرفة)
+_LONG_RUN_RE = re.compile(r"([^\s\W\u0640])\1{29,}")
+
+
+@dataclass
+class PrescreenResult:
+    ok: bool
+    reason: str
+    word_count: int
+    char_count: int
+    arabic_ratio: float
+    repeated_line_ratio: float
+    letter_ratio: float
+
+    def prompt_facts(self) -> str:
+        """الأرقام المحسوبة محلياً بصيغة تُضاف إلى رسالة المراجعة."""
+        return (
+            "معلومات محسوبة مسبقاً عن النص (استخدمها كما هي ولا تُعِد حسابها):\n"
+            f"- عدد الكلمات: {self.word_count}\n"
+            f"- نسبة الحروف العربية: {self.arabic_ratio:.0%}"
+        )
+
+
+def normalize_text(text: str) -> str:
+    """
+    NFKC: أشكال العرض العربية (U+FB50–U+FDFF و U+FE70–U+FEFF) التي يرجعها PyPDF2 كثيراً
+    تتحول إلى الحروف الأساسية، وإلا لا تُعدّ كلمات ويُرفض النص كأنه تالف.
+    """
+    return unicodedata.normalize("NFKC", text)
+
+
+def count_words(text: str) -> int:
+    return sum(1 for _ in _WORD_RE.finditer(normalize_text(text)))
+
+
+def _repeated_line_ratio(text: str) -> float:
+    lines = [_SPACE_RE.sub(" ", ln).strip() for ln in text.splitlines()]
+    lines = [ln for ln in lines if len(ln) > 3]
+    if len(lines) < 10:
+        return 0.0
+    counts = Counter(lines)
+    repeated = sum(c - 1 for c in counts.values() if c > 1)
+    return repeated / len(lines)
+
+
+def prescreen_story(text: str) -> PrescreenResult:
+    """يرجع PrescreenResult؛ ok=False مع سبب جاهز للعرض إذا كان النص مرفوضاً محلياً."""
+    text = normalize_text(text or "")
+    char_count = len(text)
+    word_count = sum(1 for _ in _WORD_RE.finditer(text))
+
+    arabic = len(_ARABIC_RE.findall(text))
+    latin = len(_LATIN_RE.findall(text))
+    letters = arabic + latin
+    arabic_ratio = arabic / letters if letters else 0.0
+
+    non_space = char_count - sum(len(m) for m in _SPACE_RE.findall(text))
+    readable = letters + len(_MARK_OR_DIGIT_RE.findall(text))
+    letter_ratio = readable / non_space if non_space else 0.0
+
+    repeated = _repeated_line_ratio(text)
+
+    def result(ok: bool, reason: str = "") -> PrescreenResult:
+        return PrescreenResult(
+            ok=ok,
+            reason=reason,
+            word_count=word_count,
+            char_count=char_count,
+            arabic_ratio=arabic_ratio,
+            repeated_line_ratio=repeated,
+            letter_ratio=letter_ratio,
+        )
+
+    if char_count > STORY_MAX_CHARS:
+        return result(False, f"النص أطول من الحد المسموح ({STORY_MAX_CHARS} حرف تقريباً).")
+
+    garbage = len(_GARBAGE_RE.findall(text))
+    if (
+        (non_space and letter_ratio < STORY_MIN_LETTER_RATIO)
+        or garbage > max(5, char_count // 200)
+        or _LONG_RUN_RE.search(text)
+    ):
+        return result(
+            False,
+            "النص المستخرج يبدو تالفاً أو غير مقروء (رموز كثيرة أو أحرف غير مفهومة).\n"
+            "إذا كان ملف PDF فجرّب حفظه من جديد كنص وليس كصورة.",
+        )
+
+    if word_count < STORY_MIN_WORDS:
+        return result(
+            False,
+            f"القصة قصيرة جداً: حوالي {word_count} كلمة، "
+            f"والحد الأدنى للنشر حوالي {STORY_MIN_WORDS} كلمة.",
+        )
+
+    if arabic_ratio < STORY_MIN_ARABIC_RATIO:
+        return result(False, "يجب أن تكون القصة مكتوبة باللغة العربية.")
+
+    if repeated > STORY_MAX_REPEATED_LINES:
+        return result(False, "النص يحتوي على أسطر مكررة كثيرة.")
+
+    return result(True)
@@ -0,0 +1,123 @@
+# stream_edit.py
+"""
+عرض نص يصل تدريجياً (stream) في رسالة تيليجرام واحدة تُعدَّل في مكانها.
+
+تيليجرام يحد من عدد التعديلات على الرسائل (تقريباً تعديل في الثانية لكل محادثة)،
+لذلك نجمع الأجزاء الواصلة ونعدّل الرسالة بحد أقصى مرة كل STREAM_EDIT_INTERVAL ثانية.
+عند وصول الرسالة إلى MAX_LEN حرف نثبّتها ونفتح رسالة جديدة للجزء التالي.
+"""
+import logging
+import os
+import time
+
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+STREAM_EDIT_INTERVAL = float(os.environ.get("STREAM_EDIT_INTERVAL", "1.2"))
+STREAM_MAX_MESSAGE_LEN = 3500
+STREAM_CURSOR = " ▌"
+
+
+def _split_point(text: str, max_len: int) -> int:
+    """أفضل موضع لقطع النص قبل max_len: نهاية فقرة، ثم سطر، ثم مسافة."""
+    for sep in ("\n\n", "\n", " "):
+        idx = text.rfind(sep, 0, max_len)
+        if idx > max_len // 2:
+            return idx
+    return max_len
+
+
+class StreamingMessage:
+    """رسالة (أو عدة رسائل) تُحدَّث أثناء وصول النص."""
+
+    def __init__(
+        self,
+        bot,
+        chat_id: int,
+        max_len: int = STREAM_MAX_MESSAGE_LEN,
+        min_interval: float = STREAM_EDIT_INTERVAL,
+    ):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.max_len = max_len
+        self.min_interval = min_interval
+
+        self.text = ""           # النص الكامل الواصل حتى الآن
+        self._part = ""          # نص الرسالة الحالية
+        self._part_no = 1
+        self._multipart = False
+        self._message_id = None
+        self._shown = ""         # آخر نص ظاهر فعلاً في الرسالة الحالية
+        self._next_edit_at = 0.0
+        self.edits = 0
+
+    def start(self, placeholder: str) -> None:
+        """إرسال الرسالة الأولى فوراً حتى يرى المستخدم أن العمل بدأ."""
+        msg = self.bot.send_message(chat_id=self.chat_id, text=placeholder)
+        self._message_id = msg.message_id
+        self._shown = placeholder
+        self._next_edit_at = time.monotonic() + self.min_interval / 2
+
+    def append(self, delta: str) -> None:
+        self.text += delta
+        self._part += delta
+
+        while len(self._part) > self.max_len:
+            cut = _split_point(self._part, self.max_len)
+            head, self._part = self._part[:cut].rstrip(), self._part[cut:].lstrip()
+            self._multipart = True
+            self._edit(self._render(head), force=True)
+
+            self._part_no += 1
+            msg = self.bot.send_message(chat_id=self.chat_id, text=self._render("") + "…")
+            self._message_id = msg.message_id
+            self._shown = ""
+            self._next_edit_at = time.monotonic() + self.min_interval
+
+        if time.monotonic() >= self._next_edit_at:
+            self._edit(self._render(self._part) + STREAM_CURSOR)
+
+    def finish(self, suffix: str = "") -> None:
+        """التعديل الأخير: النص كاملاً بدون مؤشر الكتابة."""
+        final = self._render(self._part).rstrip()
+        if suffix:
+            final = f"{final}\n\n{suffix}" if final else suffix
+        if final:
+            self._edit(final, force=True)
+
+    def _render(self, body: str) -> str:
+        header = f"الجزء {self._part_no}:\n\n" if self._multipart else ""
+        return header + body
+
+    def _edit(self, text: str, force: bool = False) -> None:
+        if text == self._shown or self._message_id is None:
+            return
+
+        for _ in range(3 if force else 1):
+            try:
+                self.bot.edit_message_text(
+                    chat_id=self.chat_id,
+                    message_id=self._message_id,
+                    text=text,
+                )
+                self._shown = text
+                self.edits += 1
+                break
+            except RetryAfter as e:
+                # تجاوزنا حد التعديلات: التعديلات العادية تُؤجَّل، والإجبارية تنتظر
+                self._next_edit_at = time.monotonic() + float(e.retry_after)
+                if not force:
+                    return
+                time.sleep(float(e.retry_after))
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    self._shown = text
+                    break
+                logger.warning("Stream edit rejected: %s", e)
+                break
+            except TelegramError as e:
+                logger.warning("Stream edit failed: %s", e)
+                break
+
+        self._next_edit_at = max(self._next_edit_at, time.monotonic() + self.min_interval)
@@ -0,0 +1,229 @@
+# structured_output.py
+"""
+مخرجات JSON منظمة من الذكاء الاصطناعي.
+
+كل طلب يرجع JSON يرسل response_format مع schema معلن (json_schema صارم)،
+فيلتزم الموديل بالشكل من الأصل. ومع ذلك نقرأ الرد بمستخرج متسامح
+(يتجاوز ```json أو أي نص قبل/بعد الـ JSON) حتى لا يضيع طلب مدفوع بسبب سطر زائد.
+
+كل نوع رد له dataclass يتحقق من الحقول ويطبّعها.
+AI_JSON_SCHEMA=0 يرجع إلى json_object العادي (لموديلات لا تدعم json_schema).
+"""
+import json
+import logging
+import os
+import threading
+from dataclasses import asdict, dataclass, field
+
+from ai_gateway import chat
+from metrics import register_collector
+
+logger = logging.getLogger(__name__)
+
+AI_JSON_SCHEMA = os.environ.get("AI_JSON_SCHEMA", "1") == "1"
+
+_decoder = json.JSONDecoder()
+
+_stats_lock = threading.Lock()
+# direct: JSON نظيف، repaired: احتاج المستخرج المتسامح، failed: طلب مدفوع ضاع
+_stats = {"direct": 0, "repaired": 0, "failed": 0}
+
+
+class StructuredOutputError(ValueError):
+    """رد الموديل ليس JSON صالحاً أو لا يطابق الـ schema."""
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def structured_output_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _structured_output_metrics() -> list:
+    return [(
+        "ai_structured_parses_total",
+        "counter",
+        "Structured AI replies by parse result (failed = wasted paid call)",
+        {f'{{result="{name}"}}': value for name, value in structured_output_stats().items()},
+    )]
+
+
+register_collector(_structured_output_metrics)
+
+
+def extract_json(raw: str) -> tuple[dict, bool]:
+    """
+    يرجع (الكائن, هل احتاج إصلاحاً).
+    المسار السريع json.loads مباشرة؛ وإلا نبدأ من أول "{" ونتجاهل ما بعد نهاية الكائن.
+    """
+    text = (raw or "").strip()
+    if text.startswith("{"):
+        try:
+            return json.loads(text), False
+        except ValueError:
+            pass
+
+    start = text.find("{")
+    attempts = 0
+    while start != -1 and attempts < 5:
+        try:
+            obj, _ = _decoder.raw_decode(text, start)
+            if isinstance(obj, dict):
+                return obj, True
+        except ValueError:
+            pass
+        start = text.find("{", start + 1)
+        attempts += 1
+
+    raise StructuredOutputError("no JSON object in model output")
+
+
+def _as_bool(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "yes", "1", "نعم")
+    return bool(value)
+
+
+def _as_int(value, default: int = 0) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _strict_schema(properties: dict) -> dict:
+    return {
+        "type": "object",
+        "properties": properties,
+        "required": list(properties),
+        "additionalProperties": False,
+    }
+
+
+@dataclass
+class StoryReview:
+    approved: bool
+    word_count: int = 0
+    title: str = ""
+    reasons: str = ""
+    suggestions: str = ""
+
+    SCHEMA = _strict_schema({
+        "approved": {"type": "boolean"},
+        "word_count": {"type": "integer"},
+        "title": {"type": "string"},
+        "reasons": {"type": "string"},
+        "suggestions": {"type": "string"},
+    })
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StoryReview":
+        if "approved" not in data:
+            raise StructuredOutputError("story review without 'approved'")
+        return cls(
+            approved=_as_bool(data["approved"]),
+            word_count=_as_int(data.get("word_count")),
+            title=str(data.get("title") or ""),
+            reasons=str(data.get("reasons") or ""),
+            suggestions=str(data.get("suggestions") or ""),
+        )
+
+
+@dataclass
+class ArticleReview:
+    approved: bool
+    reasons: str = ""
+
+    SCHEMA = _strict_schema({
+        "approved": {"type": "boolean"},
+        "reasons": {"type": "string"},
+    })
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ArticleReview":
+        if "approved" not in data:
+            raise StructuredOutputError("article review without 'approved'")
+        return cls(approved=_as_bool(data["approved"]), reasons=str(data.get("reasons") or ""))
+
+
+@dataclass
+class VideoPrompt:
+    status: str
+    questions: list = field(default_factory=list)
+    final_prompt: str = ""
+    duration_seconds: int = 0
+    aspect_ratio: str = ""
+
+    SCHEMA = _strict_schema({
+        "status": {"type": "string", "enum": ["ok", "need_more"]},
+        "questions": {"type": "array", "items": {"type": "string"}},
+        "final_prompt": {"type": "string"},
+        "duration_seconds": {"type": "integer"},
+        "aspect_ratio": {"type": "string"},
+    })
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "VideoPrompt":
+        status = data.get("status")
+        questions = [str(q) for q in (data.get("questions") or []) if q]
+        final_prompt = str(data.get("final_prompt") or "").strip()
+
+        if status == "ok" and not final_prompt:
+            raise StructuredOutputError("video prompt 'ok' without final_prompt")
+        if status not in ("ok", "need_more"):
+            raise StructuredOutputError(f"unexpected video prompt status: {status!r}")
+
+        return cls(
+            status=status,
+            questions=questions,
+            final_prompt=final_prompt,
+            duration_seconds=_as_int(data.get("duration_seconds")),
+            aspect_ratio=str(data.get("aspect_ratio") or ""),
+        )
+
+
+def to_dict(result) -> dict:
+    return asdict(result)
+
+
+def response_format_for(result_type) -> dict:
+    if not AI_JSON_SCHEMA:
+        return {"type": "json_object"}
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": result_type.__name__,
+            "strict": True,
+            "schema": result_type.SCHEMA,
+        },
+    }
+
+
+def parse_structured(raw: str, result_type):
+    """يحوّل نص رد الموديل إلى result_type، ويعدّ الردود التي احتاجت إصلاحاً أو فشلت."""
+    try:
+        data, repaired = extract_json(raw)
+        result = result_type.from_dict(data)
+    except StructuredOutputError:
+        _count("failed")
+        logger.error("Structured output failed for %s, raw=%r", result_type.__name__, (raw or "")[:500])
+        raise
+
+    _count("repaired" if repaired else "direct")
+    return result
+
+
+def chat_structured(operation: str, messages: list, model: str, result_type, **kwargs):
+    """طلب chat عبر ai_gateway مع response_format، ويرجع result_type بعد التحقق."""
+    completion = chat(
+        operation,
+        messages,
+        model=model,
+        response_format=response_format_for(result_type),
+        **kwargs,
+    )
+    return parse_structured(completion.choices[0].message.content, result_type)
@@ -0,0 +1,52 @@
+# throttle.py
+"""
+Token bucket بسيط في الذاكرة لكل مفتاح (مثلاً telegram_id).
+يُستخدم لمنع المحاولات المتكررة (تخمين أكواد الشحن) من الوصول لقاعدة البيانات.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class KeyedTokenBucket:
+    """
+    capacity    : أقصى عدد محاولات متتالية مسموح (الـ burst)
+    refill_every: عدد الثواني لاسترجاع محاولة واحدة
+    max_keys    : أقصى عدد مفاتيح نحتفظ بها (الأقدم استخداماً يُحذف أولاً)
+    """
+
+    def __init__(self, capacity: int, refill_every: float, max_keys: int = 100000):
+        self.capacity = capacity
+        self.refill_every = refill_every
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[object, tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _current(self, key, now: float) -> float:
+        tokens, last = self._buckets.get(key, (float(self.capacity), now))
+        return min(self.capacity, tokens + (now - last) / self.refill_every)
+
+    def try_acquire(self, key) -> bool:
+        """يستهلك محاولة واحدة إن وُجدت، ويرجع False إذا نفدت المحاولات."""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._current(key, now)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+
+            return allowed
+
+    def retry_after(self, key) -> int:
+        """عدد الثواني التقريبي حتى تتوفر محاولة جديدة."""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._current(key, now)
+        if tokens >= 1:
+            return 0
+        return int((1 - tokens) * self.refill_every) + 1
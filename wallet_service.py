@@ -0,0 +1,604 @@
+# wallet_service.py
+"""
+عمليات المحفظة على مستوى قاعدة البيانات.
+كل عملية هنا تُنفَّذ بجملة SQL واحدة قدر الإمكان لتقليل الـ round trips
+ولتكون آمنة مع الطلبات المتزامنة لنفس المستخدم.
+
+كل تغيّر في wallets.balance_cents يُكتب معه سطر في wallet_transactions
+داخل نفس الجملة، فيبقى balance_cents قراءة O(1) والسجل هو المرجع.
+"""
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import Session
+
+from models import HoldStatus, LedgerReason, User, Wallet, WalletHold
+
+# 🎁 مكافأة ترحيبية للمستخدم الجديد (تُضاف عند إنشاء المحفظة فقط)
+WELCOME_BONUS_POINTS = 5
+
+# أقصى عدد من المستخدمين المعروفين (telegram_id -> user_id, wallet_id) في الذاكرة
+KNOWN_WALLETS_CACHE_SIZE = int(os.environ.get("KNOWN_WALLETS_CACHE_SIZE", "50000"))
+
+_known_wallets: "OrderedDict[int, tuple[int, int]]" = OrderedDict()
+_known_wallets_lock = threading.Lock()
+
+# إنشاء المستخدم والمحفظة (إن لم يوجدا) وإرجاع المعرّفات في جملة واحدة
+_UPSERT_USER_AND_WALLET_SQL = text(
+    """
+    WITH new_user AS (
+        INSERT INTO users (telegram_id, first_name, username, created_at)
+        VALUES (:telegram_id, :first_name, :username, :now)
+        ON CONFLICT (telegram_id) DO NOTHING
+        RETURNING id
+    ),
+    u AS (
+        SELECT id FROM new_user
+        UNION ALL
+        SELECT id FROM users WHERE telegram_id = :telegram_id
+    ),
+    new_wallet AS (
+        INSERT INTO wallets (user_id, balance_cents, currency, updated_at)
+        SELECT id, :welcome_bonus, 'USD', :now FROM u
+        ON CONFLICT (user_id) DO NOTHING
+        RETURNING id, user_id
+    ),
+    bonus_tx AS (
+        INSERT INTO wallet_transactions (wallet_id, delta, reason, created_at)
+        SELECT id, :welcome_bonus, 'welcome_bonus', :now FROM new_wallet
+        WHERE :welcome_bonus > 0
+    )
+    SELECT u.id AS user_id,
+           COALESCE(new_wallet.id, w.id) AS wallet_id,
+           new_wallet.id IS NOT NULL AS created
+    FROM u
+    LEFT JOIN new_wallet ON new_wallet.user_id = u.id
+    LEFT JOIN wallets w ON w.user_id = u.id
+    """
+)
+
+
+def _remember_wallet(telegram_id: int, user_id: int, wallet_id: int) -> None:
+    with _known_wallets_lock:
+        _known_wallets[telegram_id] = (user_id, wallet_id)
+        _known_wallets.move_to_end(telegram_id)
+        while len(_known_wallets) > KNOWN_WALLETS_CACHE_SIZE:
+            _known_wallets.popitem(last=False)
+
+
+def forget_known_wallet(telegram_id: int) -> None:
+    """إزالة المستخدم من الكاش (مثلاً بعد حذف محفظته يدوياً)."""
+    with _known_wallets_lock:
+        _known_wallets.pop(telegram_id, None)
+
+
+def ensure_user_wallet(
+    db: Session,
+    telegram_id: int,
+    first_name: str | None = None,
+    username: str | None = None,
+    welcome_bonus: int = WELCOME_BONUS_POINTS,
+) -> tuple[int, int, bool]:
+    """
+    يرجع (user_id, wallet_id, created) للمستخدم، وينشئ المستخدم والمحفظة إن لزم.
+
+    المستخدم المعروف مسبقاً يُخدم من كاش LRU في الذاكرة بدون أي استعلام،
+    وغير ذلك INSERT ... ON CONFLICT DO NOTHING RETURNING واحد للصفّين معاً.
+    created = True فقط إذا أُنشئت المحفظة الآن (وأُضيفت المكافأة الترحيبية).
+    """
+    with _known_wallets_lock:
+        known = _known_wallets.get(telegram_id)
+        if known is not None:
+            _known_wallets.move_to_end(telegram_id)
+            return known[0], known[1], False
+
+    params = {
+        "telegram_id": telegram_id,
+        "first_name": first_name,
+        "username": username,
+        "welcome_bonus": welcome_bonus,
+        "now": datetime.utcnow(),
+    }
+
+    row = db.execute(_UPSERT_USER_AND_WALLET_SQL, params).first()
+    if row is None:
+        # سباق نادر: طلب متزامن أنشأ المستخدم بعد بداية جملتنا، نعيد مرة واحدة
+        db.rollback()
+        row = db.execute(_UPSERT_USER_AND_WALLET_SQL, params).first()
+    db.commit()
+
+    if row is None:
+        raise RuntimeError(f"Could not create wallet for telegram_id={telegram_id}")
+
+    _remember_wallet(telegram_id, row.user_id, row.wallet_id)
+    return row.user_id, row.wallet_id, bool(row.created)
+
+
+def get_balance(db: Session, wallet_id: int) -> int | None:
+    """قراءة الرصيد بالمفتاح الأساسي للمحفظة."""
+    return db.execute(
+        select(Wallet.balance_cents).where(Wallet.id == wallet_id)
+    ).scalar_one_or_none()
+
+
+# تغيير الرصيد (إضافة مع حد أدنى صفر، أو ضبط قيمة) + سطر في السجل بالفرق الفعلي.
+# FOR UPDATE في old يضمن أن الفرق المسجّل هو الفرق الحقيقي حتى مع التزامن.
+_CHANGE_BALANCE_SQL = """
+    WITH old AS (
+        SELECT id, balance_cents FROM wallets WHERE id = :wallet_id FOR UPDATE
+    ),
+    w AS (
+        UPDATE wallets
+        SET balance_cents = {new_balance},
+            updated_at = :now
+        FROM old
+        WHERE wallets.id = old.id
+        RETURNING wallets.id, wallets.balance_cents, old.balance_cents AS old_balance
+    ),
+    tx AS (
+        INSERT INTO wallet_transactions (wallet_id, delta, reason, ref, created_at)
+        SELECT id, balance_cents - old_balance, :reason, :ref, :now FROM w
+        WHERE balance_cents <> old_balance
+    )
+    SELECT balance_cents FROM w
+"""
+_ADD_POINTS_SQL = text(
+    _CHANGE_BALANCE_SQL.format(new_balance="GREATEST(wallets.balance_cents + :delta, 0)")
+)
+_SET_BALANCE_SQL = text(
+    _CHANGE_BALANCE_SQL.format(new_balance="GREATEST(:new_balance, 0)")
+)
+
+
+def add_points(
+    db: Session,
+    wallet_id: int,
+    delta: int,
+    reason: LedgerReason,
+    ref: str | None = None,
+) -> int | None:
+    """إضافة/خصم نقاط بدون شرط (لا ينزل الرصيد تحت الصفر)، ويرجع الرصيد الجديد."""
+    new_balance = db.execute(
+        _ADD_POINTS_SQL,
+        {
+            "wallet_id": wallet_id,
+            "delta": delta,
+            "reason": LedgerReason(reason).value,
+            "ref": ref,
+            "now": datetime.utcnow(),
+        },
+    ).scalar_one_or_none()
+    db.commit()
+    return new_balance
+
+
+def set_balance(
+    db: Session,
+    wallet_id: int,
+    new_balance: int,
+    reason: LedgerReason = LedgerReason.ADMIN,
+    ref: str | None = None,
+) -> int | None:
+    """ضبط الرصيد لقيمة محددة مع تسجيل الفرق في السجل."""
+    balance = db.execute(
+        _SET_BALANCE_SQL,
+        {
+            "wallet_id": wallet_id,
+            "new_balance": new_balance,
+            "reason": LedgerReason(reason).value,
+            "ref": ref,
+            "now": datetime.utcnow(),
+        },
+    ).scalar_one_or_none()
+    db.commit()
+    return balance
+
+
+# الخصم المشروط بكفاية الرصيد + سطر السجل في جملة واحدة
+_DEBIT_POINTS_SQL = text(
+    """
+    WITH w AS (
+        UPDATE wallets
+        SET balance_cents = balance_cents - :amount,
+            updated_at = :now
+        WHERE user_id = (SELECT id FROM users WHERE telegram_id = :telegram_id)
+          AND balance_cents >= :amount
+        RETURNING id, balance_cents
+    ),
+    tx AS (
+        INSERT INTO wallet_transactions (wallet_id, delta, reason, ref, created_at)
+        SELECT id, -:amount, :reason, :ref, :now FROM w
+    )
+    SELECT balance_cents FROM w
+    """
+)
+
+
+def debit_points(
+    db: Session,
+    telegram_id: int,
+    amount: int,
+    reason: LedgerReason,
+    ref: str | None = None,
+) -> int | None:
+    """
+    يخصم amount من محفظة المستخدم فقط إذا كان الرصيد كافياً، بجملة واحدة:
+
+        UPDATE wallets SET balance_cents = balance_cents - :n
+        WHERE user_id = (SELECT id FROM users WHERE telegram_id = :tg)
+          AND balance_cents >= :n
+        RETURNING balance_cents
+
+    (مع إضافة سطر الخصم في wallet_transactions ضمن نفس الجملة)
+    المحفظة تُنشأ أولاً إن لم توجد (بالمكافأة الترحيبية)، كما في باقي العمليات.
+    يرجع الرصيد الجديد، أو None إذا كان الرصيد غير كافٍ.
+    """
+    ensure_user_wallet(db, telegram_id)
+    new_balance = db.execute(
+        _DEBIT_POINTS_SQL,
+        {
+            "telegram_id": telegram_id,
+            "amount": amount,
+            "reason": LedgerReason(reason).value,
+            "ref": ref,
+            "now": datetime.utcnow(),
+        },
+    ).scalar_one_or_none()
+    db.commit()
+    return new_balance
+
+
+# نتائج شحن المحفظة بكود
+REDEEM_OK = "ok"
+REDEEM_INVALID = "invalid"
+REDEEM_ALREADY_USED = "already_used"
+
+# تعليم الكود كمستخدم وإضافة نقاطه للمحفظة في جملة (ومعاملة) واحدة.
+# شرط NOT is_redeemed يجعل الاستخدام المتزامن لنفس الكود آمناً: واحد فقط ينجح.
+_REDEEM_CODE_SQL = text(
+    """
+    WITH r AS (
+        UPDATE redeem_codes
+        SET is_redeemed = true,
+            redeemed_by_user_id = :user_id,
+            redeemed_at = :now
+        WHERE code = :code
+          AND NOT is_redeemed
+          AND EXISTS (SELECT 1 FROM wallets WHERE id = :wallet_id)
+        RETURNING points
+    ),
+    w AS (
+        UPDATE wallets
+        SET balance_cents = wallets.balance_cents + r.points,
+            updated_at = :now
+        FROM r
+        WHERE wallets.id = :wallet_id
+        RETURNING wallets.id, r.points AS points, wallets.balance_cents AS balance
+    ),
+    tx AS (
+        INSERT INTO wallet_transactions (wallet_id, delta, reason, ref, created_at)
+        SELECT id, points, 'redeem', :code, :now FROM w
+    )
+    SELECT points, balance FROM w
+    """
+)
+
+
+def redeem_code(db: Session, user_id: int, wallet_id: int, code: str) -> tuple[str, int, int | None]:
+    """
+    يستخدم الكود ويضيف نقاطه للمحفظة ذرّياً.
+    يرجع (النتيجة, النقاط, الرصيد الجديد) حيث النتيجة إحدى REDEEM_*.
+    """
+    row = db.execute(
+        _REDEEM_CODE_SQL,
+        {
+            "code": code,
+            "user_id": user_id,
+            "wallet_id": wallet_id,
+            "now": datetime.utcnow(),
+        },
+    ).first()
+    db.commit()
+
+    if row is not None:
+        return REDEEM_OK, row.points or 0, row.balance
+
+    # المسار النادر فقط: معرفة سبب الفشل للرسالة
+    is_redeemed = db.execute(
+        text("SELECT is_redeemed FROM redeem_codes WHERE code = :code"),
+        {"code": code},
+    ).scalar_one_or_none()
+    db.commit()
+
+    if is_redeemed is None:
+        return REDEEM_INVALID, 0, None
+    return REDEEM_ALREADY_USED, 0, None
+
+
+# ====================== مطابقة السجل مع الأرصدة ======================
+
+# صفحة من المحافظ (keyset على wallets.id) مع مجموع السجل لكل محفظة
+_RECONCILE_CHUNK_SQL = text(
+    """
+    SELECT w.id AS wallet_id,
+           w.balance_cents AS balance,
+           COALESCE(SUM(t.delta), 0) AS ledger_sum
+    FROM (
+        SELECT id, balance_cents FROM wallets
+        WHERE id > :after_id
+        ORDER BY id
+        LIMIT :chunk_size
+    ) w
+    LEFT JOIN wallet_transactions t ON t.wallet_id = w.id
+    GROUP BY w.id, w.balance_cents
+    ORDER BY w.id
+    """
+)
+
+
+def reconcile_ledger(db: Session, chunk_size: int = 1000) -> list[tuple[int, int, int]]:
+    """
+    يتحقق أن مجموع السجل لكل محفظة يساوي balance_cents، على دفعات بـ keyset pagination.
+    يرجع قائمة الفروقات: (wallet_id, balance_cents, ledger_sum).
+    """
+    mismatches = []
+    after_id = 0
+
+    while True:
+        rows = db.execute(
+            _RECONCILE_CHUNK_SQL,
+            {"after_id": after_id, "chunk_size": chunk_size},
+        ).all()
+        # إنهاء معاملة القراءة بين الدفعات حتى لا نحجز snapshot طويلاً
+        db.commit()
+
+        for row in rows:
+            if row.balance != row.ledger_sum:
+                mismatches.append((row.wallet_id, row.balance, row.ledger_sum))
+
+        if len(rows) < chunk_size:
+            break
+        after_id = rows[-1].wallet_id
+
+    return mismatches
+
+
+_BACKFILL_OPENING_SQL = text(
+    """
+    INSERT INTO wallet_transactions (wallet_id, delta, reason, created_at)
+    SELECT w.id, w.balance_cents - COALESCE(s.total, 0), 'opening', :now
+    FROM wallets w
+    LEFT JOIN (
+        SELECT wallet_id, SUM(delta) AS total
+        FROM wallet_transactions
+        GROUP BY wallet_id
+    ) s ON s.wallet_id = w.id
+    WHERE w.balance_cents <> COALESCE(s.total, 0)
+      AND NOT EXISTS (
+          SELECT 1 FROM wallet_transactions o
+          WHERE o.wallet_id = w.id AND o.reason = 'opening'
+      )
+    """
+)
+
+
+def backfill_opening_balances(db: Session) -> int:
+    """
+    تُشغَّل مرة واحدة بعد إضافة السجل: تضيف سطر 'opening' للمحافظ القديمة
+    بحيث يطابق مجموع السجل رصيدها الحالي. يرجع عدد الأسطر المضافة.
+    """
+    result = db.execute(_BACKFILL_OPENING_SQL, {"now": datetime.utcnow()})
+    db.commit()
+    return result.rowcount
+
+
+# ====================== حجز النقاط (reserve / commit / release) ======================
+
+# المدة الافتراضية للحجز قبل أن يعيده الـ sweeper تلقائياً
+DEFAULT_HOLD_TTL_SECONDS = int(os.environ.get("WALLET_HOLD_TTL_SECONDS", "900"))
+
+# خصم مشروط + إنشاء الحجز + سطر السجل في جملة واحدة
+_RESERVE_POINTS_SQL = text(
+    """
+    WITH w AS (
+        UPDATE wallets
+        SET balance_cents = balance_cents - :amount,
+            updated_at = :now
+        WHERE user_id = (SELECT id FROM users WHERE telegram_id = :telegram_id)
+          AND balance_cents >= :amount
+        RETURNING id, balance_cents
+    ),
+    h AS (
+        INSERT INTO wallet_holds (wallet_id, amount, reason, ref, status, created_at, expires_at)
+        SELECT id, :amount, :reason, :ref, 'held', :now, :expires_at FROM w
+        RETURNING id
+    ),
+    tx AS (
+        INSERT INTO wallet_transactions (wallet_id, delta, reason, ref, created_at)
+        SELECT w.id, -:amount, :reason, 'hold:' || h.id, :now FROM w, h
+    )
+    SELECT h.id AS hold_id, w.balance_cents AS balance FROM w, h
+    """
+)
+
+_COMMIT_HOLD_SQL = text(
+    """
+    UPDATE wallet_holds
+    SET status = 'committed',
+        settled_at = :now,
+        ref = COALESCE(:ref, ref)
+    WHERE id = :hold_id AND status = 'held'
+    RETURNING id
+    """
+)
+
+_SET_HOLD_REF_SQL = text(
+    """
+    UPDATE wallet_holds
+    SET ref = :ref
+    WHERE id = :hold_id AND status = 'held'
+    RETURNING id
+    """
+)
+
+# إعادة نقاط الحجز للمحفظة + سطر refund في السجل في جملة واحدة
+_RELEASE_HOLD_SQL = text(
+    """
+    WITH h AS (
+        UPDATE wallet_holds
+        SET status = 'released',
+            settled_at = :now
+        WHERE id = :hold_id AND status = 'held'
+        RETURNING id, wallet_id, amount
+    ),
+    w AS (
+        UPDATE wallets
+        SET balance_cents = wallets.balance_cents + h.amount,
+            updated_at = :now
+        FROM h
+        WHERE wallets.id = h.wallet_id
+        RETURNING wallets.balance_cents
+    ),
+    tx AS (
+        INSERT INTO wallet_transactions (wallet_id, delta, reason, ref, created_at)
+        SELECT wallet_id, amount, 'refund', 'hold:' || id, :now FROM h
+    )
+    SELECT balance_cents FROM w
+    """
+)
+
+# إنهاء الحجوزات المنتهية دفعة واحدة (SKIP LOCKED حتى لا يتعارض مع commit/release)
+_EXPIRE_HOLDS_SQL = text(
+    """
+    WITH h AS (
+        UPDATE wallet_holds
+        SET status = 'expired',
+            settled_at = :now
+        WHERE id IN (
+            SELECT id FROM wallet_holds
+            WHERE status = 'held' AND expires_at < :now
+            ORDER BY expires_at
+            LIMIT :limit
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, wallet_id, amount
+    ),
+    s AS (
+        SELECT wallet_id, SUM(amount) AS total FROM h GROUP BY wallet_id
+    ),
+    w AS (
+        UPDATE wallets
+        SET balance_cents = wallets.balance_cents + s.total,
+            updated_at = :now
+        FROM s
+        WHERE wallets.id = s.wallet_id
+    ),
+    tx AS (
+        INSERT INTO wallet_transactions (wallet_id, delta, reason, ref, created_at)
+        SELECT wallet_id, amount, 'refund', 'hold:' || id, :now FROM h
+    )
+    SELECT COUNT(*) FROM h
+    """
+)
+
+
+def reserve_points(
+    db: Session,
+    telegram_id: int,
+    amount: int,
+    reason: LedgerReason,
+    ttl_seconds: int = DEFAULT_HOLD_TTL_SECONDS,
+    ref: str | None = None,
+) -> tuple[int, int] | None:
+    """
+    يحجز amount من رصيد المستخدم (إن كان كافياً) لطلب سيبدأ الآن.
+    يرجع (hold_id, الرصيد المتاح الجديد) أو None إذا لم يكفِ الرصيد.
+    """
+    now = datetime.utcnow()
+    row = db.execute(
+        _RESERVE_POINTS_SQL,
+        {
+            "telegram_id": telegram_id,
+            "amount": amount,
+            "reason": LedgerReason(reason).value,
+            "ref": ref,
+            "now": now,
+            "expires_at": now + timedelta(seconds=ttl_seconds),
+        },
+    ).first()
+    db.commit()
+
+    if row is None:
+        return None
+    return row.hold_id, row.balance
+
+
+def commit_hold(db: Session, hold_id: int, ref: str | None = None) -> bool:
+    """تثبيت الحجز بعد نجاح الطلب. False إذا لم يعد الحجز نشطاً (أُعيد أو انتهى)."""
+    row = db.execute(
+        _COMMIT_HOLD_SQL,
+        {"hold_id": hold_id, "ref": ref, "now": datetime.utcnow()},
+    ).first()
+    db.commit()
+    return row is not None
+
+
+def release_hold(db: Session, hold_id: int) -> int | None:
+    """إعادة نقاط الحجز بعد فشل الطلب. يرجع الرصيد الجديد أو None إذا لم يعد الحجز نشطاً."""
+    balance = db.execute(
+        _RELEASE_HOLD_SQL,
+        {"hold_id": hold_id, "now": datetime.utcnow()},
+    ).scalar_one_or_none()
+    db.commit()
+    return balance
+
+
+def set_hold_ref(db: Session, hold_id: int, ref: str) -> bool:
+    """
+    ربط حجز نشط بمرجع خارجي (مثلاً رقم مهمة الفيديو) حتى يمكن استئناف متابعته
+    بعد إعادة تشغيل البوت. False إذا لم يعد الحجز نشطاً.
+    """
+    row = db.execute(_SET_HOLD_REF_SQL, {"hold_id": hold_id, "ref": ref}).first()
+    db.commit()
+    return row is not None
+
+
+def list_open_holds_with_ref(db: Session, reason: LedgerReason) -> list:
+    """
+    الحجوزات النشطة لخدمة معيّنة التي لها مرجع، مع telegram_id صاحبها:
+    صفوف (hold_id, ref, telegram_id, created_at).
+    """
+    return db.execute(
+        select(WalletHold.id.label("hold_id"), WalletHold.ref, User.telegram_id, WalletHold.created_at)
+        .join(Wallet, Wallet.id == WalletHold.wallet_id)
+        .join(User, User.id == Wallet.user_id)
+        .where(WalletHold.status == HoldStatus.HELD.value)
+        .where(WalletHold.reason == LedgerReason(reason).value)
+        .where(WalletHold.ref.isnot(None))
+    ).all()
+
+
+def expire_stale_holds(db: Session, limit: int = 500) -> int:
+    """إعادة نقاط كل الحجوزات التي تجاوزت مهلتها (على دفعات). يرجع عددها."""
+    total = 0
+    while True:
+        count = db.execute(
+            _EXPIRE_HOLDS_SQL,
+            {"limit": limit, "now": datetime.utcnow()},
+        ).scalar_one()
+        db.commit()
+        total += count
+        if count < limit:
+            return total
+
+
+def get_held_points(db: Session, wallet_id: int) -> int:
+    """مجموع النقاط المحجوزة حالياً (يستخدم الفهرس الجزئي على الحجوزات النشطة)."""
+    return db.execute(
+        select(func.coalesce(func.sum(WalletHold.amount), 0))
+        .where(WalletHold.wallet_id == wallet_id)
+        .where(WalletHold.status == HoldStatus.HELD.value)
+    ).scalar_one()